@@ -10,32 +10,22 @@ __author__ = """Adam Jaspan"""
 __email__ = 'adam.jaspan@googlemail.com'
 
 import logging
+import os
 from pathlib import Path
 from .root import ROOT_DIR
+from .log import configure_logging
 
-# Default logging level for the package
-package_log_level = logging.DEBUG
-
-logging_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-
-# Configure the root logger for the package
-logging.basicConfig(
-    level=package_log_level,
-    format=logging_format,
-)
+# Default logging level and format for the package, overridable with the
+# POLLSCRAPER_LOG_LEVEL and POLLSCRAPER_LOG_FORMAT (text or json) variables
+package_log_level = os.environ.get('POLLSCRAPER_LOG_LEVEL', 'INFO').upper()
+package_log_json = os.environ.get('POLLSCRAPER_LOG_FORMAT') == 'json'
 
 # Create a logger instance for the package
 logger = logging.getLogger(__name__)
 
-# Create a FileHandler and set its level and format
+# Log to stderr and a size-rotated file through a background queue
 logs_dir = Path(f'{ROOT_DIR}/logs/')
 logs_dir.mkdir(parents=True, exist_ok=True)
-file_handler = logging.FileHandler(logs_dir / "pollscraper.log")
-file_handler.setLevel(package_log_level)
-formatter = logging.Formatter(
-        logging_format
-    )
-file_handler.setFormatter(formatter)
-
-# Add the FileHandler to the package logger
-logger.addHandler(file_handler)
+configure_logging(logger, level=package_log_level,
+                  log_file=logs_dir / "pollscraper.log",
+                  json_lines=package_log_json)
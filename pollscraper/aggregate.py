@@ -0,0 +1,350 @@
+"""Population-weighted roll-up of regional trends to national trends.
+
+The trends of every region are held in one array of regions by dates by
+candidates, aligned on the union of their dates and candidates. Each
+group of regions (a state, or the nation) is a row of a weight matrix,
+so the trends of every group at every level come from a single matrix
+product with that array. Replacing one region only touches the groups
+containing it, and loading many regions at once costs one product.
+"""
+import numpy as np
+import pandas as pd
+from pollscraper import logger
+from pollscraper.trends import SparseTrends, dense_trends
+
+
+NATIONAL = 'national'
+
+ABSENT_OPTIONS = ('zero', 'skip')
+
+
+def trends_to_frame(trends):
+    """
+    Index trends by date, whatever form they come in.
+
+    Parameters:
+        trends (pandas.DataFrame or SparseTrends): Output of
+            `PollTrend.calculate_trends`, with a date column, or trends
+            already indexed by date.
+
+    Returns:
+        pandas.DataFrame: Trends indexed by date, one column per
+        candidate.
+    """
+    if isinstance(trends, SparseTrends):
+        trends = trends.to_dense()
+    if 'date' in trends.columns:
+        trends = trends.set_index('date')
+    return trends.set_axis(pd.DatetimeIndex(trends.index, name='date'))\
+        .astype(float)
+
+
+class RegionalAggregator:
+    """
+    Weighted average of regional trends at every level of a hierarchy.
+
+    On each day, a group's share for a candidate is the weighted mean of
+    the shares of its regions with a trend for the candidate that day;
+    regions without one are left out and the weights of the rest are
+    renormalised. Values are only reported where the regions with data
+    hold at least `min_coverage` of the group's weight.
+
+    A candidate missing entirely from a region's trends is taken by
+    default not to be standing there, and counts as a share of zero on
+    the days the region has trends for other candidates. Set
+    `absent_candidates='skip'` to leave such regions out instead.
+
+    Attributes:
+        weights (pandas.Series): Weight of each region, e.g. its
+                                 population or turnout.
+        levels (list): Levels of the hierarchy, from the finest to the
+                       coarsest, ending with the national level.
+        groups (list): (level, group) pairs, one per row of `membership`.
+        membership (numpy.ndarray): Groups by regions, the weight of each
+                                    region in each group it belongs to.
+        dates (pandas.DatetimeIndex): Ascending union of the regions'
+                                      dates.
+        candidates (list): Union of the regions' candidates.
+    """
+
+    def __init__(self, weights, levels=(), region_col='region',
+                 weight_col='weight', min_coverage=.5,
+                 absent_candidates='zero') -> None:
+        """
+        Parameters:
+            weights (pandas.DataFrame): One row per region, with its name,
+                                        weight, and the group it belongs
+                                        to at each level.
+            levels (iterable, optional): Columns of `weights` naming the
+                                         intermediate groups, e.g.
+                                         ('state',). The national level
+                                         is always added.
+            region_col (str, optional): Column of region names. Defaults
+                                        to 'region'.
+            weight_col (str, optional): Column of weights. Defaults to
+                                        'weight'.
+            min_coverage (float, optional): Share of a group's weight that
+                                            must have data for a value to
+                                            be reported. Defaults to 0.5.
+            absent_candidates (str, optional): 'zero' or 'skip', see
+                                               above. Defaults to 'zero'.
+        """
+        if absent_candidates not in ABSENT_OPTIONS:
+            raise ValueError(f'Unknown absent_candidates option '
+                             f'{absent_candidates}.')
+        if weights[region_col].duplicated().any():
+            raise ValueError('Regions must appear once in the weights.')
+        if (weights[weight_col] < 0).any() or \
+                weights[weight_col].isna().any():
+            raise ValueError('Region weights must be non-negative numbers.')
+        self.weights = pd.Series(weights[weight_col].to_numpy(float),
+                                 index=pd.Index(weights[region_col]))
+        self.min_coverage = min_coverage
+        self.absent_candidates = absent_candidates
+        self.levels = list(levels) + [NATIONAL]
+
+        groups = []
+        rows = []
+        for level in levels:
+            codes, names = pd.factorize(weights[level], sort=True)
+            for code, name in enumerate(names):
+                groups.append((level, name))
+                rows.append(codes == code)
+        groups.append((NATIONAL, NATIONAL))
+        rows.append(np.ones(len(self.weights), dtype=bool))
+        self.groups = groups
+        self.membership = np.where(rows, self.weights.to_numpy(), 0.)
+        self._totals = self.membership.sum(axis=1)
+        self._position = {region: i for i, region
+                          in enumerate(self.weights.index)}
+
+        n_regions = len(self.weights)
+        self.dates = pd.DatetimeIndex([], name='date')
+        self.candidates = []
+        # Trends of each region, NaN where missing, and the candidates in
+        # each region's trends
+        self._values = np.full((n_regions, 0, 0), np.nan)
+        self._present = np.zeros((n_regions, 0), dtype=bool)
+        self._loaded = np.zeros(n_regions, dtype=bool)
+        # Weighted sums of shares and weights with data, per group
+        self._sums = np.zeros((len(groups), 0, 0))
+        self._covered = np.zeros((len(groups), 0, 0))
+
+    @property
+    def regions(self):
+        return list(self.weights.index[self._loaded])
+
+    def update(self, region, trends):
+        """
+        Add or replace the trends of one region.
+
+        Only the groups containing the region are updated, so refreshing
+        one region costs one pass over its own trends per level.
+
+        Parameters:
+            region (str): The region, as named in the weights.
+            trends (pandas.DataFrame or SparseTrends): The region's
+                                                       trends.
+
+        Returns:
+            RegionalAggregator: The updated aggregator.
+        """
+        frame = self._frame(region, trends)
+        grown = self._extend(frame.index, frame.columns)
+        r = self._position[region]
+        block, present = self._block(frame)
+        if grown and self.absent_candidates == 'zero':
+            # New candidates change how other regions count as well
+            self._set_region(r, block, present)
+            self.refresh()
+        else:
+            self._apply(r, block, present)
+        logger.debug('Updated the trends of region %s', region)
+        return self
+
+    def load(self, region_trends):
+        """
+        Add or replace the trends of many regions at once.
+
+        The arrays are grown once to cover every region's dates and
+        candidates, and the groups are then recomputed with one matrix
+        product, rather than once per region as by `update`.
+
+        Parameters:
+            region_trends (dict): Trends of each region, see `update`.
+
+        Returns:
+            RegionalAggregator: The updated aggregator.
+        """
+        frames = {region: self._frame(region, trends)
+                  for region, trends in region_trends.items()}
+        if not frames:
+            return self
+        dates = pd.DatetimeIndex(np.concatenate(
+            [frame.index.to_numpy() for frame in frames.values()]
+        )).unique()
+        candidates = list(dict.fromkeys(
+            c for frame in frames.values() for c in frame.columns
+        ))
+        self._extend(dates, candidates)
+        for region, frame in frames.items():
+            self._set_region(self._position[region], *self._block(frame))
+        logger.debug('Loaded the trends of %d region(s)', len(frames))
+        return self.refresh()
+
+    def remove(self, region):
+        """Drop the trends of one region, as if it had not reported."""
+        r = self._position[region]
+        self._apply(r, np.full(self._values.shape[1:], np.nan),
+                    np.zeros(len(self.candidates), dtype=bool))
+        self._loaded[r] = False
+        return self
+
+    def _frame(self, region, trends):
+        if region not in self._position:
+            raise KeyError(f'Region {region} has no weight.')
+        frame = trends_to_frame(trends)
+        if not frame.index.is_unique:
+            raise ValueError(f'Trends of {region} repeat dates.')
+        return frame
+
+    def _block(self, frame):
+        """A region's trends on the aligned dates and candidates."""
+        present = np.isin(self.candidates, frame.columns)
+        block = frame.reindex(index=self.dates, columns=self.candidates)\
+            .to_numpy(dtype=float)
+        return block, present
+
+    def _fill_absent(self, block, present):
+        if self.absent_candidates == 'zero':
+            reporting = ~np.isnan(block).all(axis=1)
+            absent = reporting[:, None] & ~present[None, :]
+            block = np.where(absent, 0., block)
+        return block
+
+    def _set_region(self, r, block, present):
+        self._values[r] = self._fill_absent(block, present)
+        self._present[r] = present
+        self._loaded[r] = present.any()
+
+    def _apply(self, r, block, present):
+        old = self._values[r].copy()
+        self._set_region(r, block, present)
+        new = self._values[r]
+        rows = np.flatnonzero(self.membership[:, r])
+        weights = self.membership[rows, r][:, None, None]
+        self._sums[rows] += weights * (np.nan_to_num(new) -
+                                       np.nan_to_num(old))
+        self._covered[rows] += weights * (np.isnan(old).astype(float) -
+                                          np.isnan(new))
+
+    def _extend(self, dates, candidates):
+        """Grow the arrays to cover new dates and candidates."""
+        new_dates = self.dates.union(pd.DatetimeIndex(dates)).sort_values()
+        new_candidates = [c for c in candidates if c not in self.candidates]
+        if len(new_dates) == len(self.dates) and not new_candidates:
+            return False
+        positions = new_dates.get_indexer(self.dates)
+        n_regions, n_groups = len(self.weights), len(self.groups)
+        shape = (len(new_dates), len(self.candidates) + len(new_candidates))
+        values = np.full((n_regions,) + shape, np.nan)
+        sums = np.zeros((n_groups,) + shape)
+        covered = np.zeros((n_groups,) + shape)
+        width = len(self.candidates)
+        values[:, positions, :width] = self._values
+        sums[:, positions, :width] = self._sums
+        covered[:, positions, :width] = self._covered
+        self._values, self._sums, self._covered = values, sums, covered
+        self._present = np.pad(self._present,
+                               ((0, 0), (0, len(new_candidates))))
+        self.dates = pd.DatetimeIndex(new_dates, name='date')
+        self.candidates = self.candidates + new_candidates
+        if new_candidates and self.absent_candidates == 'zero':
+            for r in np.flatnonzero(self._loaded):
+                self._values[r] = self._fill_absent(self._values[r],
+                                                    self._present[r])
+            return True
+        return False
+
+    def refresh(self):
+        """Recompute every group from the regions' trends."""
+        self._sums = np.tensordot(self.membership,
+                                  np.nan_to_num(self._values), axes=1)
+        self._covered = np.tensordot(self.membership,
+                                     (~np.isnan(self._values)).astype(float),
+                                     axes=1)
+        return self
+
+    def averages(self):
+        """
+        Weighted averages of every group.
+
+        Returns:
+            numpy.ndarray: Groups by dates by candidates, NaN where too
+            little of a group has data.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averages = self._sums / self._covered
+            coverage = self._covered / self._totals[:, None, None]
+        # Round-off from incremental updates can leave tiny weights
+        covered = coverage > max(self.min_coverage - 1e-9, 1e-9)
+        return np.where(covered, averages, np.nan)
+
+    def trends(self, level=NATIONAL):
+        """
+        Trends of every group at one level.
+
+        Parameters:
+            level (str, optional): The level. Defaults to the national
+                                   level.
+
+        Returns:
+            dict: Trends of each group, laid out as by
+            `PollTrend.calculate_trends`, with only the candidates
+            standing in the group's regions.
+        """
+        if level not in self.levels:
+            raise KeyError(f'Unknown level {level}.')
+        averages = self.averages()
+        standing = (self.membership > 0) @ self._present > 0
+        descending = self.dates[::-1]
+        result = {}
+        for g, (group_level, group) in enumerate(self.groups):
+            if group_level != level:
+                continue
+            columns = np.flatnonzero(standing[g])
+            result[group] = dense_trends(
+                averages[g][::-1][:, columns], descending,
+                [self.candidates[c] for c in columns]
+            )
+        return result
+
+    def all_trends(self):
+        """
+        Trends of every group at every level.
+
+        Returns:
+            dict: Maps each level to the trends of its groups.
+        """
+        return {level: self.trends(level) for level in self.levels}
+
+
+def aggregate_trends(region_trends, weights, levels=(), **kwargs):
+    """
+    Roll regional trends up to every level of a hierarchy.
+
+    Parameters:
+        region_trends (dict): Trends of each region, as returned by
+                              `PollTrend.calculate_trends`.
+        weights (pandas.DataFrame): Weight and groups of each region, see
+                                    `RegionalAggregator`.
+        levels (iterable, optional): Intermediate levels of the hierarchy.
+        **kwargs: Passed to `RegionalAggregator`.
+
+    Returns:
+        dict: Maps each level, including 'national', to the trends of its
+        groups. The national trends are under
+        `result['national']['national']`.
+    """
+    aggregator = RegionalAggregator(weights, levels, **kwargs)
+    return aggregator.load(region_trends).all_trends()
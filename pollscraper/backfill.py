@@ -0,0 +1,214 @@
+"""Rebuild outputs from archived HTML snapshots of the polls page."""
+import multiprocessing
+import os
+import tarfile
+import zipfile
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
+from pathlib import Path, PurePosixPath
+import pandas as pd
+from pollscraper import logger
+from pollscraper.dedup import PollDeduplicator
+from pollscraper.log import forward_logging, receive_logging
+from pollscraper.output import write_csv, write_outputs
+from pollscraper.scraper import DataPipeline
+from pollscraper.trends import PollTrend
+
+
+SNAPSHOT_SUFFIXES = ('.html', '.htm')
+
+# Pipeline reused by each worker process for all of its snapshots
+_pipeline = None
+
+
+def is_snapshot(name):
+    return PurePosixPath(name).suffix.lower() in SNAPSHOT_SUFFIXES
+
+
+def iter_snapshots(source):
+    """
+    Stream the HTML snapshots held in a directory, tar or zip archive.
+
+    Archive members are read one at a time, without extracting the
+    archive to disk. Directories are searched recursively.
+
+    Parameters:
+        source (str or pathlib.Path): Directory or archive of snapshots.
+
+    Yields:
+        tuple: The snapshot name and its raw content (bytes).
+    """
+    source = Path(source)
+    if source.is_dir():
+        for path in sorted(source.rglob('*')):
+            if path.is_file() and is_snapshot(path.name):
+                yield path.relative_to(source).as_posix(), path.read_bytes()
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_snapshot(info.filename):
+                    with archive.open(info) as f:
+                        yield info.filename, f.read()
+    elif tarfile.is_tarfile(source):
+        # Stream mode reads members in order without seeking
+        with tarfile.open(source, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and is_snapshot(member.name):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise ValueError(f'{source} is not a directory, tar or zip archive.')
+
+
+def snapshot_dir(results_dir, name):
+    """Output directory of one snapshot, named after its path."""
+    stem = PurePosixPath(name).with_suffix('').as_posix()
+    return Path(results_dir) / 'snapshots' / stem.replace('/', '_')
+
+
+def _init_worker(date_anchor, log_queue=None):
+    global _pipeline
+    if log_queue is not None:
+        forward_logging(logger, log_queue)
+    _pipeline = DataPipeline(date_anchor=date_anchor)
+
+
+def process_snapshot(name, content, results_dir, n_sigma=5, n_places=4):
+    """
+    Parse, clean and calculate trends for one snapshot.
+
+    Runs in a worker process, writing the snapshot's polls.csv and
+    trends.csv itself so that only the polls are sent back.
+
+    Parameters:
+        name (str): Snapshot name.
+        content (bytes): Raw HTML of the snapshot.
+        results_dir (str or pathlib.Path): Root output directory.
+        n_sigma (int, optional): Outlier threshold for the trends.
+                                 Defaults to 5.
+        n_places (int, optional): Floating point precision of the output
+                                  files. Defaults to 4.
+
+    Returns:
+        tuple: The snapshot name and its cleaned polls.
+    """
+    if _pipeline is None:
+        _init_worker('end')
+    # Each snapshot is deduplicated on its own
+    _pipeline.deduplicator = PollDeduplicator()
+    html = content.decode('utf-8', errors='replace')
+    table_df = _pipeline.table_data_to_dataframe(
+            _pipeline.parse_html_table(html)
+        )
+    polls = _pipeline.clean_data(table_df)
+    trends, _, _ = PollTrend.calculate_trends(polls.copy(), n_sigma=n_sigma)
+
+    output = snapshot_dir(results_dir, name)
+    write_csv(polls, output / 'polls.csv', n_places)
+    write_csv(trends, output / 'trends.csv', n_places)
+    return name, polls
+
+
+def merge_snapshots(snapshots, merge_revisions=False):
+    """
+    Merge the polls of several snapshots, latest versions first.
+
+    Parameters:
+        snapshots (dict): Cleaned polls by snapshot name. Names are
+                          assumed to sort chronologically, e.g. by
+                          timestamp.
+        merge_revisions (bool, optional): Treat polls by one pollster on
+                                          one day of the same candidates
+                                          as revisions of one poll; see
+                                          `PollDeduplicator`. Defaults to
+                                          False, merging only exact
+                                          republications.
+
+    Returns:
+        pandas.DataFrame: Every poll seen, keeping the version from the
+        latest snapshot it appears in.
+    """
+    frames = [snapshots[name] for name in sorted(snapshots, reverse=True)]
+    merged = pd.concat(frames, ignore_index=True)
+    merged = PollDeduplicator(keep='first', revisions=merge_revisions)\
+        .deduplicate(merged)
+    return merged.sort_values(by=['date', 'pollster'], ascending=False,
+                              kind='stable').reset_index(drop=True)
+
+
+def backfill(source, results_dir, max_workers=None, max_in_flight=None,
+             n_sigma=5, n_places=4, date_anchor='end',
+             merge_revisions=False):
+    """
+    Rebuild poll and trend outputs from archived snapshots.
+
+    Snapshots are streamed from `source` into a process pool, with at
+    most `max_in_flight` of them read but not yet processed, so memory
+    stays bounded however large the archive. Each snapshot's outputs
+    are written to `results_dir/snapshots/<name>/`, and the merged polls
+    and their trends to `results_dir`.
+
+    Parameters:
+        source (str or pathlib.Path): Directory or archive of snapshots.
+        results_dir (str or pathlib.Path): Output directory.
+        max_workers (int, optional): Number of worker processes.
+                                     Defaults to the number of CPUs.
+        max_in_flight (int, optional): Maximum number of snapshots
+                                       submitted at once. Defaults to
+                                       twice the number of workers.
+        n_sigma (int, optional): Outlier threshold for the trends.
+                                 Defaults to 5.
+        n_places (int, optional): Floating point precision of the output
+                                  files. Defaults to 4.
+        date_anchor (str, optional): See `DataPipeline`. Defaults to
+                                     'end'.
+        merge_revisions (bool, optional): See `merge_snapshots`.
+                                          Defaults to False.
+
+    Returns:
+        tuple: The merged polls, and the names of snapshots that failed.
+    """
+    results_dir = Path(results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    max_workers = max_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * max_workers
+    snapshots = {}
+    failed = []
+
+    def collect(done, pending):
+        for future in done:
+            name = pending.pop(future)
+            try:
+                snapshots[name] = future.result()[1]
+                logger.info('Processed snapshot %s', name)
+            except Exception as e:
+                logger.error('Failed to process snapshot %s: %s', name, e)
+                failed.append(name)
+
+    # Workers log through the parent, which writes their records
+    log_queue = multiprocessing.Queue()
+    log_listener = receive_logging(log_queue)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_worker,
+                                 initargs=(date_anchor, log_queue)) \
+                as executor:
+            pending = {}
+            for name, content in iter_snapshots(source):
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done, pending)
+                future = executor.submit(process_snapshot, name, content,
+                                         results_dir, n_sigma, n_places)
+                pending[future] = name
+            collect(wait(pending)[0], pending)
+    finally:
+        log_listener.stop()
+
+    if not snapshots:
+        raise ValueError(f'No snapshots could be processed from {source}.')
+    logger.info('Merging %d snapshot(s)', len(snapshots))
+    merged = merge_snapshots(snapshots, merge_revisions)
+    trends, _, _ = PollTrend.calculate_trends(merged.copy(), n_sigma=n_sigma)
+    write_outputs({'polls': merged, 'trends': trends}, results_dir,
+                  n_places=n_places)
+    return merged, sorted(failed)
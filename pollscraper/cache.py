@@ -0,0 +1,199 @@
+"""Memoization of trend calculations keyed by input fingerprints."""
+import copy
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from pollscraper import logger
+from pollscraper.output import atomic_write
+
+
+def fingerprint_frame(frame):
+    """
+    Hash the contents, labels and dtypes of a DataFrame.
+
+    Parameters:
+        frame (pandas.DataFrame): The frame to fingerprint.
+
+    Returns:
+        str: A hex digest that changes whenever the frame does.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(pd.util.hash_pandas_object(frame, index=True)
+                  .to_numpy().tobytes())
+    digest.update(repr([(str(c), str(t)) for c, t in frame.dtypes.items()])
+                  .encode())
+    return digest.hexdigest()
+
+
+def estimate_size(value):
+    """
+    Estimate the memory held by a cached value, in bytes.
+
+    Parameters:
+        value (object): A frame, array, or tuple/dict of them.
+
+    Returns:
+        int: The estimated size.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_size(v) for v in value.values())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class ResultCache:
+    """
+    LRU cache of results in memory, with an optional on-disk tier.
+
+    Entries are evicted least recently used first once the memory (or
+    disk) budget is exceeded. Entries evicted from memory remain on disk
+    and are promoted back to memory when read.
+
+    Attributes:
+        max_bytes (int): Memory budget for cached values.
+        directory (pathlib.Path): Directory of the disk tier, if any.
+        max_disk_bytes (int): Disk budget for cached values.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups not found in the cache.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, directory=None,
+                 max_disk_bytes=2**30) -> None:
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.directory = Path(directory) if directory is not None else None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """Build a cache key from a stage name, fingerprint and parameters."""
+        return hashlib.blake2b(repr(parts).encode(),
+                               digest_size=16).hexdigest()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or (
+            self.directory is not None and self._path(key).exists()
+        )
+
+    def _path(self, key):
+        return self.directory / f'{key}.pkl'
+
+    def get(self, key, copy_value=True):
+        """
+        Look up a cached value.
+
+        Parameters:
+            key (str): The cache key.
+            copy_value (bool, optional): Return a copy, so callers may
+                                         modify the result. Defaults to
+                                         True.
+
+        Returns:
+            object or None: The cached value, or None on a miss.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                value = self._entries[key][0]
+            else:
+                value = self._load(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return copy.deepcopy(value) if copy_value else value
+
+    def set(self, key, value, copy_value=True):
+        """
+        Store a value, evicting old entries to stay within budget.
+
+        Parameters:
+            key (str): The cache key.
+            value (object): The value to cache.
+            copy_value (bool, optional): Store a copy, so callers may
+                                         go on to modify `value`.
+                                         Defaults to True.
+        """
+        if copy_value:
+            value = copy.deepcopy(value)
+        size = estimate_size(value)
+        with self._lock:
+            self._store(key, value, size)
+            if self.directory is not None:
+                self._dump(key, value)
+
+    def clear(self):
+        """Remove every entry from memory and disk."""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            if self.directory is not None:
+                for path in self.directory.glob('*.pkl'):
+                    path.unlink()
+
+    def _store(self, key, value, size):
+        if key in self._entries:
+            self._nbytes -= self._entries.pop(key)[1]
+        if size > self.max_bytes:
+            logger.debug('Result of %s bytes too large to cache.', size)
+            return
+        self._entries[key] = (value, size)
+        self._nbytes += size
+        while self._nbytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._nbytes -= evicted
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        # Refresh the access time used for disk eviction
+        os.utime(path)
+        self._store(key, value, estimate_size(value))
+        return value
+
+    def _dump(self, key, value):
+        with atomic_write(self._path(key), 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = sorted(self.directory.glob('*.pkl'),
+                       key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for path in files:
+            if total <= self.max_disk_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink()
@@ -1,31 +1,61 @@
 """Console script for pollscraper."""
 import click
 import logging
+from functools import partial
+from pollscraper.backfill import backfill as run_backfill
+from pollscraper.dedup import PollDeduplicator
 from pollscraper.scraper import DataPipeline
 from pollscraper.trends import PollTrend
-from pollscraper import logger
+from pollscraper import logger, logs_dir, package_log_json
+from pollscraper.log import configure_logging
+from pollscraper.output import write_outputs
+from pollscraper.scheduler import Scheduler, build_pipeline, process_source
 
 
 URL = 'https://cdn-dev.economistdatateam.com/jobs/pds/code-test/index.html'
 
 
-@click.command()
+def configure_cli_logging(quiet, log_format, verbose=False):
+    """Apply the logging options shared by every command."""
+    level = logging.DEBUG if verbose else logger.level
+    if quiet:
+        logging.getLogger("urllib3").setLevel(logging.WARNING)
+    if quiet or log_format is not None:
+        json_lines = package_log_json if log_format is None \
+            else log_format == 'json'
+        configure_logging(logger, level=level,
+                          log_file=logs_dir / "pollscraper.log",
+                          json_lines=json_lines,
+                          stream_level=logging.WARNING if quiet else None)
+    else:
+        logger.setLevel(level)
+
+
+@click.group(invoke_without_command=True)
 @click.option('--url',
-              default=URL,
-              prompt='Target URL.',
-              help='Target URL containing polling data.')
+              default=None,
+              help='Target URL containing polling data. '
+                   'Prompted for when omitted.')
 @click.option('--results_dir',
-              default='data/',
-              prompt='Output data path.',
-              help='Location for scraped polling data to be stored.')
+              default=None,
+              help='Location for scraped polling data to be stored. '
+                   'Prompted for when omitted.')
 @click.option('--n_sigma',
               default=5,
               help='Number of standard deviations away from the mean '
               'at which a warning will be raised when checking the '
               'polling data per candidate.')
 @click.option('--quiet', default=False, is_flag=True,
-              help='Reduce streamed logging output. '
+              help='Only stream warnings and errors to the console. '
                    '(This does not affect output in the log file)')
+@click.option('--verbose', default=False, is_flag=True,
+              help='Log debugging output, including the tables at each '
+                   'step. Otherwise the level of POLLSCRAPER_LOG_LEVEL '
+                   '(INFO by default) applies.')
+@click.option('--log_format', default=None,
+              type=click.Choice(['text', 'json']),
+              help='Write logging output as plain text or JSON lines. '
+                   'Defaults to POLLSCRAPER_LOG_FORMAT, or text.')
 @click.option('--n_places', default=4, help="Set floating point precision "
               "stored in the output .csv files.")
 @click.option('--connect_timeout', default=3.05, help="The connect timeout is "
@@ -42,37 +72,96 @@ URL = 'https://cdn-dev.economistdatateam.com/jobs/pds/code-test/index.html'
 @click.option('--http_n_retries', default=5, help="Sets number of "
               "automatic retries to connect to target HTML after failed "
               "connection")
-def main(url, results_dir, quiet, connect_timeout,
-         read_timeout, http_n_retries, n_places,
-         n_sigma) -> None:
+@click.option('--pool_maxsize', default=10, help="Sets the maximum number "
+              "of connections kept open to each host.")
+@click.option('--resolutions', default='1D', help="Comma-separated trend "
+              "periodicities, e.g. '1D,W,MS'. The first is saved to "
+              "trends.csv. Unless only the default '1D' is given, each "
+              "is also saved to trends_<periodicity>.csv.")
+@click.option('--dedup_index', default=None, help="CSV file of polls seen "
+              "in earlier runs, used to recognise republished and revised "
+              "polls. It is created if missing.")
+@click.option('--merge_revisions', default=False, is_flag=True,
+              help='Keep only the latest version of polls by one pollster '
+                   'on one day of the same candidates, treating the rest '
+                   'as revisions.')
+@click.option('--backend', default='numpy',
+              type=click.Choice(['numpy', 'numba', 'auto']),
+              help="Numerical backend for the trend calculation. 'numba' "
+                   "needs the optional numba dependency; 'auto' uses it "
+                   "when installed.")
+@click.option('--estimator', default='rolling',
+              type=click.Choice(['rolling', 'kalman']),
+              help="Trend estimator: a rolling weighted mean, or a "
+                   "Kalman-smoothed random walk.")
+@click.option('--stream', default=False, is_flag=True,
+              help='Parse HTML tables while they download, reducing the '
+                   'time to the first row and peak memory on large '
+                   'pages.')
+@click.option('--partition', default=False, is_flag=True,
+              help='Write outputs as Hive-style partitions, e.g. '
+                   'polls/race=<race>/month=2024-03/part-0.csv, rather than '
+                   'single .csv files. Without --race, outputs are written '
+                   'under race=__all__.')
+@click.option('--race', default=None, help='Name of the race polled, used '
+              'as the outer partition with --partition.')
+@click.pass_context
+def main(ctx, url, results_dir, quiet, verbose, log_format, connect_timeout,
+         read_timeout, http_n_retries, pool_maxsize, n_places,
+         n_sigma, resolutions, dedup_index, merge_revisions, backend,
+         estimator, stream, partition, race) -> None:
+    """Scrape polls from URL and save them with their trends.
+
+    Run `pollscraper backfill --help` to rebuild outputs from archived
+    snapshots instead.
+    """
+    configure_cli_logging(quiet, log_format, verbose)
+    if ctx.invoked_subcommand is not None:
+        return 0
+    if url is None:
+        url = click.prompt('Target URL.', default=URL)
+    if results_dir is None:
+        results_dir = click.prompt('Output data path.', default='data/')
     try:
         filepath = f'{results_dir}'
-        if quiet:
-            logging.getLogger("urllib3").setLevel(logging.WARNING)
-            logger.setLevel(logging.INFO)
-        else:
-            logger.setLevel(logging.DEBUG)
         logger.info('Running PollScraper Pipeline!')
         logger.debug('Logging set to logging.DEBUG '
-                     'Reduce logging output with flag: '
-                     '--quiet')
-        dp = DataPipeline(connect_timeout, read_timeout, http_n_retries)
+                     'Reduce logging output by leaving out the flag: '
+                     '--verbose')
+        dp = DataPipeline(http_n_retries=http_n_retries,
+                          http_connection_timeout=connect_timeout,
+                          http_read_timeout=read_timeout,
+                          pool_maxsize=pool_maxsize,
+                          deduplicator=PollDeduplicator(
+                              dedup_index, revisions=merge_revisions
+                          ),
+                          stream=stream)
         logger.debug('Extracting data from URL.')
         table_df = dp.extract_table_data(url)
         logger.debug('Cleaning poll data.')
         processed_data = dp.clean_data(table_df)
-        logger.info(f'Saving polling data to {filepath}/polls.csv')
-        # Save to n decimal places
-        processed_data.to_csv(f'{filepath}/polls.csv',
-                              float_format=f'%.{n_places}f')
         logger.debug('Calculating trends.')
-        trends, _, _ = PollTrend.calculate_trends(
-                processed_data, n_sigma=n_sigma
-            )
-        logger.info(f'Saving trend data to {filepath}/trends.csv')
-        # Save to n decimal places
-        trends.to_csv(f'{filepath}/trends.csv',
-                      float_format=f'%.{n_places}f')
+        resolutions = [r.strip() for r in resolutions.split(',')
+                       if r.strip()]
+        if resolutions == ['1D']:
+            trends, _, _ = PollTrend.calculate_trends(
+                    processed_data, n_sigma=n_sigma, backend=backend,
+                    estimator=estimator
+                )
+            outputs = {'polls': processed_data, 'trends': trends}
+        else:
+            results = PollTrend.calculate_multi_resolution_trends(
+                    processed_data, resolutions, n_sigma=n_sigma,
+                    backend=backend, estimator=estimator
+                )
+            outputs = {'polls': processed_data,
+                       'trends': results[resolutions[0]][0]}
+            for resolution, (resolution_trends, _, _) in results.items():
+                outputs[f'trends_{resolution}'] = resolution_trends
+        # Save to n decimal places, atomically and concurrently
+        logger.info('Saving polling and trend data to %s', filepath)
+        write_outputs(outputs, filepath, n_places=n_places,
+                      partition=partition, race=race)
         logger.info('Operation completed successfully.')
         return 0
     except Exception as e:
@@ -80,6 +169,97 @@ def main(url, results_dir, quiet, connect_timeout,
         return 0
 
 
+@main.command()
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--results_dir', default='data/backfill/',
+              help='Location for rebuilt polling data to be stored.')
+@click.option('--workers', default=None, type=int,
+              help='Number of worker processes. Defaults to the number '
+                   'of CPUs.')
+@click.option('--max_in_flight', default=None, type=int,
+              help='Maximum number of snapshots queued for the workers '
+                   'at once. Defaults to twice the number of workers.')
+@click.option('--n_sigma', default=5,
+              help='Number of standard deviations away from the mean '
+              'at which a warning will be raised when checking the '
+              'polling data per candidate.')
+@click.option('--n_places', default=4, help="Set floating point precision "
+              "stored in the output .csv files.")
+@click.option('--merge_revisions', default=False, is_flag=True,
+              help='Keep only the latest snapshot\'s version of polls by '
+                   'one pollster on one day of the same candidates, '
+                   'treating the rest as revisions. Otherwise only exact '
+                   'republications are merged.')
+def backfill(source, results_dir, workers, max_in_flight, n_sigma,
+             n_places, merge_revisions) -> None:
+    """Rebuild outputs from a directory, tar or zip of HTML snapshots.
+
+    Each snapshot's polls.csv and trends.csv are written under
+    RESULTS_DIR/snapshots/, and the merged polls and trends to
+    RESULTS_DIR.
+    """
+    logger.info('Backfilling from %s', source)
+    merged, failed = run_backfill(source, results_dir,
+                                  max_workers=workers,
+                                  max_in_flight=max_in_flight,
+                                  n_sigma=n_sigma, n_places=n_places,
+                                  merge_revisions=merge_revisions)
+    if failed:
+        logger.warning('%d snapshot(s) failed: %s', len(failed), failed)
+    logger.info('Saved %d merged polls to %s', len(merged), results_dir)
+
+
+@main.command()
+@click.argument('urls', nargs=-1)
+@click.option('--results_dir', default='data/scheduled/',
+              help='Location for the polling data of each source, saved '
+                   'under a directory named after its URL.')
+@click.option('--state', default='data/scheduled/schedule.json',
+              help='JSON file holding what has been learned about each '
+                   'source, kept across restarts.')
+@click.option('--min_interval', default=300., help='Shortest time between '
+              'fetches of a source, in seconds.')
+@click.option('--max_interval', default=7 * 86400., help='Longest time '
+              'between fetches of a source, in seconds.')
+@click.option('--host_interval', default=1., help='Shortest time between '
+              'requests to one host, in seconds.')
+@click.option('--max_fetches', default=None, type=int,
+              help='Stop after this many fetches. Runs until interrupted '
+                   'by default.')
+@click.option('--n_sigma', default=5,
+              help='Number of standard deviations away from the mean '
+              'at which a warning will be raised when checking the '
+              'polling data per candidate.')
+@click.option('--n_places', default=4, help="Set floating point precision "
+              "stored in the output .csv files.")
+def schedule(urls, results_dir, state, min_interval, max_interval,
+             host_interval, max_fetches, n_sigma, n_places) -> None:
+    """Scrape sources repeatedly, as often as each one changes.
+
+    URLS are added to the sources kept in the --state file. Each source
+    is saved whenever its content changes.
+    """
+    dp = build_pipeline()
+    handler = partial(process_source, dp, results_dir=results_dir,
+                      n_sigma=n_sigma, n_places=n_places)
+    scheduler = Scheduler(dp, handler, state_path=state,
+                          min_interval=min_interval,
+                          max_interval=max_interval,
+                          host_interval=host_interval)
+    for url in urls:
+        scheduler.add(url)
+    if not len(scheduler):
+        raise click.UsageError('No sources to schedule.')
+    logger.info('Scheduling %d source(s)', len(scheduler))
+    try:
+        scheduler.run(max_fetches=max_fetches)
+    except KeyboardInterrupt:
+        logger.info('Scheduler stopped.')
+    finally:
+        scheduler.save()
+    logger.info('Scheduler metrics: %s', scheduler.metrics())
+
+
 if __name__ == "__main__":
     cmd = f'--url {URL} --results_dir data/'
     print(f"Running $ PollScraper with options: {cmd}")
@@ -0,0 +1,220 @@
+"""Interned integer codes for candidates and pollsters."""
+import numpy as np
+import pandas as pd
+from pollscraper.kernels import get_kernels
+
+
+class CodeTable:
+    """
+    Append-only mapping between the labels of one `PollMatrix` and
+    integer codes.
+
+    A label keeps the code it was first given for the life of the table.
+
+    Attributes:
+        name (str): Name of what the labels are, e.g. 'candidate'.
+    """
+
+    def __init__(self, name, labels=()) -> None:
+        self.name = name
+        self._labels = []
+        self._index = pd.Index([], dtype=object)
+        self.encode(labels)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __repr__(self):
+        return f'CodeTable({self.name!r}, {len(self)} labels)'
+
+    @property
+    def labels(self):
+        """Labels in code order, as an object array."""
+        return np.asarray(self._labels, dtype=object)
+
+    def encode(self, labels):
+        """
+        Look up the codes of many labels, interning new ones.
+
+        Parameters:
+            labels (array-like): Labels to encode.
+
+        Returns:
+            numpy.ndarray: An int32 code for each label.
+        """
+        labels = pd.Index(np.asarray(labels, dtype=object))
+        codes = self._index.get_indexer(labels)
+        unseen = codes < 0
+        if unseen.any():
+            new = labels[unseen].unique()
+            self._labels.extend(new)
+            self._index = pd.Index(self._labels, dtype=object)
+            codes[unseen] = self._index.get_indexer(labels[unseen])
+        return codes.astype(np.int32)
+
+    def decode(self, codes):
+        """
+        Map codes back to their labels.
+
+        Parameters:
+            codes (array-like): Codes from this table.
+
+        Returns:
+            numpy.ndarray: The labels, as an object array.
+        """
+        return self.labels[np.asarray(codes, dtype=np.intp)]
+
+
+class PollMatrix:
+    """
+    Compact, integer-keyed form of a cleaned poll table.
+
+    Polls are held as parallel arrays of dates, pollster codes and sample
+    sizes, alongside a 2-D array of vote shares with one column per
+    candidate code. It is the array form in which polls are binned by
+    period when resampling and filtered by `KalmanTrend`; see
+    `from_frame` and `to_frame`.
+
+    Attributes:
+        dates (numpy.ndarray): datetime64 date of each poll.
+        pollsters (numpy.ndarray): Pollster code of each poll.
+        sample (numpy.ndarray): Sample size of each poll, NaN if unknown.
+        shares (numpy.ndarray): Vote shares, polls by candidates.
+        candidates (numpy.ndarray): Candidate code of each shares column.
+        index (pandas.Index): Labels of the polls in the source frame.
+        pollster_table (CodeTable): Table of the pollster codes.
+        candidate_table (CodeTable): Table of the candidate codes.
+    """
+
+    def __init__(self, dates, pollsters, sample, shares, candidates,
+                 index=None, pollster_table=None,
+                 candidate_table=None) -> None:
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.pollsters = np.asarray(pollsters, dtype=np.int32)
+        self.sample = np.asarray(sample, dtype=float)
+        self.shares = np.asarray(shares, dtype=float)
+        self.candidates = np.asarray(candidates, dtype=np.int32)
+        self.index = pd.RangeIndex(len(self.dates)) if index is None \
+            else pd.Index(index)
+        self.pollster_table = CodeTable('pollster') \
+            if pollster_table is None else pollster_table
+        self.candidate_table = CodeTable('candidate') \
+            if candidate_table is None else candidate_table
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def candidate_names(self):
+        return list(self.candidate_table.decode(self.candidates))
+
+    @property
+    def pollster_names(self):
+        return self.pollster_table.decode(self.pollsters)
+
+    @property
+    def nbytes(self):
+        arrays = (self.dates, self.pollsters, self.sample, self.shares,
+                  self.candidates)
+        return sum(a.nbytes for a in arrays)
+
+    @classmethod
+    def from_frame(cls, frame, candidates=None, date='date',
+                   pollster='pollster', sample='n'):
+        """
+        Build the matrix from a cleaned poll table.
+
+        Parameters:
+            frame (pandas.DataFrame): Cleaned polls, with the date either
+                                      as a column or as the index.
+            candidates (list, optional): Candidate columns. Defaults to
+                                         every column other than the
+                                         date, pollster and sample.
+
+        Returns:
+            PollMatrix: The polls.
+        """
+        reserved = (date, pollster, sample)
+        if candidates is None:
+            candidates = [c for c in frame.columns if c not in reserved]
+        dates = frame[date] if date in frame.columns else frame.index
+        n = frame[sample] if sample in frame.columns \
+            else np.full(len(frame), np.nan)
+        pollster_table = CodeTable('pollster')
+        candidate_table = CodeTable('candidate')
+        return cls(
+            pd.to_datetime(np.asarray(dates)),
+            pollster_table.encode(frame[pollster]),
+            pd.to_numeric(pd.Series(np.asarray(n)), errors='coerce'),
+            frame[list(candidates)].to_numpy(dtype=float, na_value=np.nan),
+            candidate_table.encode(candidates),
+            index=frame.index,
+            pollster_table=pollster_table,
+            candidate_table=candidate_table,
+        )
+
+    def to_frame(self, date='date', pollster='pollster', sample='n'):
+        """
+        Convert back to the public poll table layout.
+
+        Returns:
+            pandas.DataFrame: Date, pollster and sample columns followed
+            by one share column per candidate.
+        """
+        frame = pd.DataFrame({date: self.dates,
+                              pollster: self.pollster_names,
+                              sample: self.sample}, index=self.index)
+        shares = pd.DataFrame(self.shares, index=self.index,
+                              columns=self.candidate_names)
+        return pd.concat([frame, shares], axis=1)
+
+    def period_bins(self, sample_periodicity):
+        """
+        Assign each poll to a sampling period.
+
+        Periods follow `pandas.Grouper(freq=sample_periodicity)`,
+        including the empty periods between polls.
+
+        Returns:
+            tuple: The period position of each poll, -1 for polls without
+            a date, and the period labels as a pandas.DatetimeIndex.
+        """
+        # The grouper returns periods in date order, leaving out missing
+        # dates, so group the sorted dates and scatter the periods back
+        dated = np.flatnonzero(~np.isnat(self.dates))
+        order = dated[np.argsort(self.dates[dated], kind='stable')]
+        grouped = pd.Series(np.zeros(len(order)),
+                            index=pd.DatetimeIndex(self.dates[order],
+                                                   name='date'))\
+            .groupby(pd.Grouper(freq=sample_periodicity))
+        bins = np.full(len(self), -1, dtype=np.intp)
+        bins[order] = grouped.ngroup().to_numpy(dtype=np.intp)
+        return bins, grouped.size().index
+
+    def binned_sums(self, bins, n_bins, weights=None, backend='numpy'):
+        """
+        Sum the weighted shares of every candidate in each period.
+
+        One pass over the share matrix replaces a group-by per candidate.
+        Missing shares count as zero.
+
+        Parameters:
+            bins (numpy.ndarray): Period position of each poll. Polls
+                                  in no period (-1) are left out.
+            n_bins (int): Number of periods.
+            weights (numpy.ndarray, optional): Weight of each poll.
+                                               Defaults to unit weights.
+            backend (str, optional): Kernel backend, see
+                                     `kernels.get_kernels`. Defaults to
+                                     'numpy'.
+
+        Returns:
+            tuple: Weighted share sums (periods by candidates), weight
+            totals per period, and the number of polls including each
+            candidate in each period.
+        """
+        weights = np.ones(len(self)) if weights is None \
+            else np.asarray(weights, dtype=float)
+        return get_kernels(backend).binned_sums(
+            np.asarray(bins, dtype=np.intp), n_bins, self.shares, weights
+        )
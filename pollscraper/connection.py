@@ -0,0 +1,116 @@
+"""HTTP connection management shared by DataPipeline instances."""
+import threading
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from pollscraper import logger
+
+
+# Server errors and rate limiting are retried; see Retry.status_forcelist.
+RETRY_STATUS_FORCELIST = (429, 500, 502, 503, 504)
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def build_retry(http_n_retries=5, backoff_factor=0.1, status_retries=None):
+    """
+    Build the retry policy used for every mounted adapter.
+
+    Retries honour the `Retry-After` header sent with 429 and 503
+    responses before falling back to exponential backoff.
+
+    Parameters:
+        http_n_retries (int, optional): Total number of retries.
+                                        Defaults to 5.
+        backoff_factor (float, optional): Exponential backoff factor
+                                          between attempts. Defaults to 0.1.
+        status_retries (int, optional): Retries on the statuses of
+                                        `RETRY_STATUS_FORCELIST`. Once
+                                        they run out, the last response
+                                        is returned rather than raising
+                                        `RetryError`, keeping its
+                                        `Retry-After`. Defaults to the
+                                        total number of retries.
+
+    Returns:
+        urllib3.util.Retry: The retry policy.
+    """
+    status = {} if status_retries is None else \
+        {'status': status_retries, 'raise_on_status': False}
+    return Retry(total=http_n_retries,
+                 backoff_factor=backoff_factor,
+                 status_forcelist=RETRY_STATUS_FORCELIST,
+                 respect_retry_after_header=True,
+                 **status)
+
+
+def build_session(http_n_retries=5, pool_connections=10, pool_maxsize=10,
+                  pool_block=False, keep_alive=True, backoff_factor=0.1,
+                  status_retries=None):
+    """
+    Build a session with pooled, retrying adapters on both schemes.
+
+    Parameters:
+        http_n_retries (int, optional): Total number of retries.
+                                        Defaults to 5.
+        pool_connections (int, optional): Number of hosts to keep
+                                          connection pools for.
+                                          Defaults to 10.
+        pool_maxsize (int, optional): Maximum number of connections kept
+                                      open per host. Defaults to 10.
+        pool_block (bool, optional): Block when the pool is exhausted
+                                     rather than opening a throwaway
+                                     connection. Defaults to False.
+        keep_alive (bool, optional): Keep connections open between
+                                     requests. Defaults to True.
+        backoff_factor (float, optional): Exponential backoff factor
+                                          between attempts. Defaults to 0.1.
+        status_retries (int, optional): Retries on rate limiting and
+                                        server errors; see `build_retry`.
+                                        Defaults to the total number of
+                                        retries.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=build_retry(http_n_retries,
+                                                  backoff_factor,
+                                                  status_retries),
+                          pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          pool_block=pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    logger.debug('HTTP session built with pool_maxsize=%s, retries=%s',
+                 pool_maxsize, http_n_retries)
+    return session
+
+
+def shared_session(**kwargs):
+    """
+    Return the process-wide session, building it on first use.
+
+    Sharing one session lets many `DataPipeline` instances reuse open
+    connections instead of repeating the TCP/TLS handshake per instance.
+    Keyword arguments are passed to `build_session` on first use only.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = build_session(**kwargs)
+        return _shared_session
+
+
+def close_shared_session():
+    """Close the process-wide session and its pooled connections."""
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is not None:
+            _shared_session.close()
+            _shared_session = None
@@ -0,0 +1,168 @@
+"""Date parsing for scraped poll tables."""
+import re
+from functools import lru_cache, partial
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype as is_datetime
+from pollscraper import logger
+
+
+# Formats tried during detection, in order of preference when a sample
+# is equally well parsed by several (e.g. 3/4/24 is read month first).
+DATE_FORMATS = (
+    '%m/%d/%y',
+    '%m/%d/%Y',
+    '%Y-%m-%d',
+    '%d/%m/%y',
+    '%d/%m/%Y',
+    '%b %d, %Y',
+    '%B %d, %Y',
+    '%d %b %Y',
+    '%d %B %Y',
+)
+
+# Field periods such as 10/11-10/14/23 or 10/11-14/23 (month first).
+DATE_RANGE_PATTERN = re.compile(
+    r'^\s*(?P<start_month>\d{1,2})/(?P<start_day>\d{1,2})'
+    r'(?:/(?P<start_year>\d{2}|\d{4}))?'
+    r'\s*[-–—]\s*'
+    r'(?:(?P<end_month>\d{1,2})/)?(?P<end_day>\d{1,2})'
+    r'/(?P<end_year>\d{2}|\d{4})\s*$'
+)
+
+DETECTION_SAMPLE_SIZE = 50
+
+
+@lru_cache(maxsize=None)
+def date_parser(date_format):
+    """
+    Return the parser for a date format, built once per format.
+
+    Parameters:
+        date_format (str): A `strftime` format string.
+
+    Returns:
+        callable: Parses an array of strings, returning NaT where a
+        string does not match the format.
+    """
+    return partial(pd.to_datetime, format=date_format, errors='coerce',
+                   cache=False)
+
+
+@lru_cache(maxsize=256)
+def detect_date_formats(sample):
+    """
+    Detect the date formats used by a sample of date strings.
+
+    Parameters:
+        sample (tuple): Distinct date strings from a column.
+
+    Returns:
+        tuple: The formats that parse at least one string in the sample,
+        most successful first.
+    """
+    values = np.asarray(sample, dtype=object)
+    counts = {fmt: date_parser(fmt)(values).notna().sum()
+              for fmt in DATE_FORMATS}
+    return tuple(fmt for fmt in sorted(counts, key=counts.get,
+                                       reverse=True) if counts[fmt] > 0)
+
+
+def _sample(uniques, size=DETECTION_SAMPLE_SIZE):
+    """Pick up to `size` strings spread evenly over the column."""
+    if len(uniques) <= size:
+        return tuple(uniques)
+    return tuple(uniques[np.linspace(0, len(uniques) - 1, size).astype(int)])
+
+
+def _as_year(years):
+    return years.where(years >= 100, years + 2000)
+
+
+def parse_date_ranges(strings):
+    """
+    Parse field-period ranges into start and end dates.
+
+    A start without a year takes the year of the end, or the year
+    before when the period crosses new year.
+
+    Parameters:
+        strings (pandas.Index): Date strings.
+
+    Returns:
+        tuple: Start and end dates as pandas.DatetimeIndex, NaT where a
+        string is not a valid range.
+    """
+    parts = strings.str.extract(DATE_RANGE_PATTERN)\
+        .apply(pd.to_numeric, errors='coerce')
+    end_month = parts['end_month'].fillna(parts['start_month'])
+    end_year = _as_year(parts['end_year'])
+    start_year = _as_year(parts['start_year']).fillna(
+        end_year - (parts['start_month'] > end_month)
+    )
+    start = pd.to_datetime(pd.DataFrame({'year': start_year,
+                                         'month': parts['start_month'],
+                                         'day': parts['start_day']}),
+                           errors='coerce')
+    end = pd.to_datetime(pd.DataFrame({'year': end_year,
+                                       'month': end_month,
+                                       'day': parts['end_day']}),
+                         errors='coerce')
+    start, end = pd.DatetimeIndex(start), pd.DatetimeIndex(end)
+    backwards = end < start
+    return start.where(~backwards), end.where(~backwards)
+
+
+def parse_poll_dates(dates):
+    """
+    Parse a column of poll dates into field period start, end and
+    midpoint.
+
+    Each distinct string is parsed once and the results mapped back onto
+    the column. Formats are detected once from a sample of the distinct
+    strings; strings that match none of them are left as NaT.
+
+    Parameters:
+        dates (pandas.Series): Date strings, either single dates or
+                               field-period ranges.
+
+    Returns:
+        pandas.DataFrame: `start`, `end` and `mid` dates, indexed like
+        `dates`.
+
+    Raises:
+        ValueError: If no date in the column can be parsed.
+    """
+    if is_datetime(dates):
+        return pd.DataFrame({'start': dates, 'end': dates, 'mid': dates})
+    codes, uniques = pd.factorize(dates)
+    strings = pd.Index(uniques.astype(str)).str.strip()
+    start, end = parse_date_ranges(strings)
+    start = start.to_numpy(dtype='datetime64[ns]')
+    end = end.to_numpy(dtype='datetime64[ns]')
+    single = np.isnat(start) & np.isnat(end)
+    if single.any():
+        remaining = strings[single].to_numpy()
+        formats = detect_date_formats(_sample(remaining))
+        logger.debug('Detected date formats: %s', formats)
+        parsed = np.full(len(remaining), np.datetime64('NaT'),
+                         dtype='datetime64[ns]')
+        # Strings the main format misses are offered to the others
+        for fmt in formats:
+            unparsed = np.isnat(parsed)
+            if not unparsed.any():
+                break
+            parsed[unparsed] = date_parser(fmt)(remaining[unparsed])\
+                .to_numpy(dtype='datetime64[ns]')
+        start[single] = parsed
+        end[single] = parsed
+    if len(strings) and np.isnat(end).all():
+        raise ValueError('Unrecognised date format.')
+    start = pd.DatetimeIndex(start)
+    end = pd.DatetimeIndex(end)
+    mid = (start + (end - start) / 2).floor('D')
+    return pd.DataFrame({
+        'start': start.take(codes, allow_fill=True, fill_value=pd.NaT),
+        'end': end.take(codes, allow_fill=True, fill_value=pd.NaT),
+        'mid': mid.take(codes, allow_fill=True, fill_value=pd.NaT),
+    }, index=dates.index)
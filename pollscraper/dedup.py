@@ -0,0 +1,237 @@
+"""Detection of republished and revised polls."""
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from pollscraper import logger
+from pollscraper.output import atomic_write
+
+
+INDEX_COLUMNS = ['fuzzy_key', 'exact_key', 'generation', 'last_seen']
+
+
+def normalise_pollster(pollsters):
+    """
+    Normalise pollster names so that trivial differences hash alike.
+
+    Parameters:
+        pollsters (pandas.Series): Pollster names.
+
+    Returns:
+        pandas.Series: Case-folded names with punctuation and repeated
+        whitespace collapsed to single spaces.
+    """
+    return pollsters.astype(str).str.casefold()\
+        .str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+
+
+def _hash(frame):
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def _row_hashes(pairs, positions, n_rows):
+    """Combine per-cell hashes into an order-independent hash per row."""
+    combined = np.zeros(n_rows, dtype=np.uint64)
+    np.add.at(combined, positions, pairs)
+    return combined
+
+
+class PollDeduplicator:
+    """
+    Hash index of polls, used to drop republished and revised polls.
+
+    Every poll has two keys:
+
+    * an exact key over the normalised pollster, date, sample size and
+      rounded vote shares, shared by republications of a poll;
+    * a fuzzy key over the normalised pollster, date and the set of
+      candidates polled, shared by revisions of a poll.
+
+    Republications are always dropped. Revisions are only merged when
+    `revisions` is set, as distinct polls by one pollster on one day,
+    e.g. of different samples or modes, share a fuzzy key too. Only the
+    latest version of each key is then kept: a version first seen in a
+    later run is later than one already in the index, and within a run
+    `keep` decides. Keys are hashed, so finding matches is O(n) rather
+    than a pairwise comparison.
+
+    Attributes:
+        path (pathlib.Path): CSV file the index is persisted to, if any.
+        index (pandas.DataFrame): Known keys, with the runs (generations)
+                                  in which each exact key was first and
+                                  last seen.
+        superseded (pandas.DataFrame): Rows removed by the last call to
+                                       `deduplicate`, with the label of
+                                       the row kept in their place and
+                                       the reason, 'duplicate' or
+                                       'revision'.
+    """
+
+    def __init__(self, path=None, share_decimals=3, keep='first',
+                 revisions=False, max_generations=100,
+                 pollster='pollster', date='date', sample='n') -> None:
+        """
+        Parameters:
+            path (str or pathlib.Path, optional): CSV file to load the
+                                                  index from and save it
+                                                  to. Defaults to an
+                                                  in-memory index.
+            share_decimals (int, optional): Decimal places vote shares
+                                            are rounded to before hashing.
+                                            Defaults to 3.
+            keep (str, optional): Which of several versions within one
+                                  table is the latest, 'first' or 'last'.
+                                  Defaults to 'first', as tables list the
+                                  newest polls first.
+            revisions (bool, optional): Also drop all but the latest
+                                        version of polls sharing a fuzzy
+                                        key. Defaults to False.
+            max_generations (int, optional): Forget polls not seen in
+                                             this many runs. Defaults to
+                                             100; None keeps every poll.
+        """
+        if keep not in ('first', 'last'):
+            raise ValueError(f'Unknown keep option {keep}.')
+        self.path = Path(path) if path is not None else None
+        self.share_decimals = share_decimals
+        self.keep = keep
+        self.revisions = revisions
+        self.max_generations = max_generations
+        self.pollster = pollster
+        self.date = date
+        self.sample = sample
+        self.index = self.load()
+        self.superseded = None
+
+    def load(self):
+        """
+        Load the persisted index.
+
+        Returns:
+            pandas.DataFrame: The index, empty if there is none yet.
+        """
+        if self.path is not None and self.path.is_file():
+            index = pd.read_csv(self.path, dtype={'fuzzy_key': np.uint64,
+                                                  'exact_key': np.uint64,
+                                                  'generation': np.int64,
+                                                  'last_seen': np.int64})
+            if 'last_seen' not in index:
+                # Written before polls were pruned
+                index['last_seen'] = index['generation']
+            logger.debug('Loaded %d known polls from %s', len(index),
+                         self.path)
+            return index
+        return pd.DataFrame({'fuzzy_key': pd.Series(dtype=np.uint64),
+                             'exact_key': pd.Series(dtype=np.uint64),
+                             'generation': pd.Series(dtype=np.int64),
+                             'last_seen': pd.Series(dtype=np.int64)})
+
+    def save(self):
+        """Write the index to `path`, replacing it atomically."""
+        if self.path is None:
+            return
+        with atomic_write(self.path, newline='') as f:
+            self.index.to_csv(f, index=False)
+
+    def keys(self, frame):
+        """
+        Hash the exact and fuzzy keys of each poll.
+
+        Vote shares are hashed as (candidate, share) pairs, so keys do not
+        change when candidates are added to or removed from the table.
+
+        Parameters:
+            frame (pandas.DataFrame): Cleaned poll data.
+
+        Returns:
+            tuple: Arrays of exact and fuzzy keys, one per row.
+        """
+        reserved = (self.pollster, self.date, self.sample)
+        candidates = [c for c in frame.columns if c not in reserved]
+        shares = frame[candidates].to_numpy(dtype=float, na_value=np.nan)
+        positions, columns = np.nonzero(~np.isnan(shares))
+        names = pd.Series(np.asarray(candidates, dtype=object)[columns])
+        pairs = pd.DataFrame({
+            'candidate': names,
+            'share': shares[positions, columns].round(self.share_decimals),
+        })
+        exact_shares = _row_hashes(_hash(pairs), positions, len(frame))
+        polled = _row_hashes(_hash(names), positions, len(frame))
+
+        common = pd.DataFrame({
+            'pollster': normalise_pollster(frame[self.pollster])
+            .to_numpy(),
+            'date': pd.to_datetime(frame[self.date]).to_numpy(),
+        })
+        sample = pd.to_numeric(frame[self.sample], errors='coerce')
+        exact = _hash(common.assign(n=sample.to_numpy(),
+                                    shares=exact_shares))
+        fuzzy = _hash(common.assign(polled=polled))
+        return exact, fuzzy
+
+    def deduplicate(self, frame, drop_known=False):
+        """
+        Remove republished and superseded polls, and index the rest.
+
+        Parameters:
+            frame (pandas.DataFrame): Cleaned poll data.
+            drop_known (bool, optional): Also drop polls already in the
+                                         index, leaving only new polls.
+                                         Defaults to False.
+
+        Returns:
+            pandas.DataFrame: The latest version of each poll.
+        """
+        exact, fuzzy = self.keys(frame)
+        key = fuzzy if self.revisions else exact
+        generation = int(self.index['last_seen'].max()) + 1 \
+            if len(self.index) else 0
+        first_seen = pd.Series(self.index['generation'].to_numpy(),
+                               index=self.index['exact_key'].to_numpy())
+        first_seen = first_seen[~first_seen.index.duplicated()]
+        seen = pd.Series(exact).map(first_seen)
+        known = seen.notna().to_numpy()
+        seen = seen.fillna(generation).to_numpy(dtype=np.int64)
+
+        # Order rows from oldest to latest version, and keep the last of
+        # each key
+        position = np.arange(len(frame))
+        if self.keep == 'first':
+            position = position[::-1]
+        order = np.lexsort((position, seen))
+        latest = pd.Series(key[order]).duplicated(keep='last').to_numpy()
+        dropped = np.zeros(len(frame), dtype=bool)
+        dropped[order] = latest
+
+        kept_row = pd.Series(np.arange(len(frame))[~dropped],
+                             index=key[~dropped])
+        replacement = kept_row.loc[key[dropped]].to_numpy()
+        self.superseded = frame[dropped].assign(
+            superseded_by=frame.index.to_numpy()[replacement],
+            reason=np.where(exact[dropped] == exact[replacement],
+                            'duplicate', 'revision'),
+        )
+        if dropped.any():
+            logger.warning('%d duplicate or superseded poll(s) removed',
+                           dropped.sum())
+            logger.debug('Superseded polls: %s', self.superseded)
+
+        new = ~known & ~pd.Series(exact).duplicated().to_numpy()
+        index = self.index.copy()
+        index.loc[index['exact_key'].isin(exact), 'last_seen'] = generation
+        index = pd.concat([index, pd.DataFrame({
+            'fuzzy_key': fuzzy[new],
+            'exact_key': exact[new],
+            'generation': np.full(new.sum(), generation, dtype=np.int64),
+            'last_seen': np.full(new.sum(), generation, dtype=np.int64),
+        })], ignore_index=True)
+        if self.max_generations is not None:
+            stale = index['last_seen'] <= generation - self.max_generations
+            if stale.any():
+                logger.debug('Forgetting %d poll(s) not seen in %d runs',
+                             stale.sum(), self.max_generations)
+                index = index[~stale].reset_index(drop=True)
+        self.index = index
+        self.save()
+
+        keep = ~dropped & ~known if drop_known else ~dropped
+        return frame[keep]
@@ -0,0 +1,406 @@
+"""State-space polling average, fitted with a Kalman filter and smoother.
+
+Each candidate's true vote share follows a random walk, and each poll
+observes it with sampling noise that shrinks with the sample size,
+non-sampling noise common to every poll, and an optional house effect
+for the pollster. The state of every candidate
+is held in one vector, so each filter step is a handful of array
+operations across all candidates at once. Polls within a period are
+combined in information form, which also copes with candidates who
+have not been polled yet (an infinite prior variance).
+"""
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from pollscraper import logger
+from pollscraper.codes import PollMatrix
+
+
+DAY = np.timedelta64(1, 'D')
+
+
+class KalmanTrend:
+    """
+    Random-walk polling average with streaming updates.
+
+    `fit` filters a table of polls from scratch; `update` then absorbs
+    newer polls in O(1) work per poll, continuing from the last filtered
+    state rather than refitting the history. `smooth` runs the
+    Rauch-Tung-Striebel smoother over everything filtered so far, giving
+    the trend and its uncertainty on every period.
+
+    Attributes:
+        process_sd (float): Standard deviation of the daily change in a
+                            candidate's share.
+        default_sample (float): Sample size assumed for polls without one.
+        extra_sd (float): Non-sampling error of a poll, or None to
+                          estimate it for each candidate in `fit`.
+        pollster_effects (bool): Whether `fit` estimates house effects.
+        shrinkage (float): Pseudo-count of polls shrinking each house
+                           effect towards zero.
+        sample_periodicity (str): Length of the filter's time steps.
+        candidates (list): Candidates in state-vector order.
+        periods (pandas.DatetimeIndex): The filtered periods.
+        house_effects (pandas.DataFrame): Estimated bias of each pollster
+                                          (rows) for each candidate.
+        mean_share (pandas.Series): Mean share of each candidate in the
+                                    polls passed to `fit`.
+        excess_sd (pandas.Series): Non-sampling error of each candidate.
+        noise_sd (pandas.Series): Typical total error of one poll for
+                                  each candidate.
+    """
+
+    def __init__(self, process_sd=0.005, default_sample=1000.,
+                 extra_sd=None, pollster_effects=False, shrinkage=5.,
+                 sample_periodicity='1D') -> None:
+        """
+        Parameters:
+            process_sd (float, optional): Standard deviation of the daily
+                                          change in a share. Defaults to
+                                          0.005 (half a point).
+            default_sample (float, optional): Sample size assumed for
+                                              polls without one. Defaults
+                                              to 1000.
+            extra_sd (float, optional): Non-sampling error of a poll, e.g.
+                                        from question wording or
+                                        weighting. Defaults to None, which
+                                        estimates it from the spread of
+                                        successive polls.
+            pollster_effects (bool, optional): Estimate and remove a house
+                                               effect per pollster and
+                                               candidate. Defaults to
+                                               False.
+            shrinkage (float, optional): Pseudo-count of polls shrinking
+                                         house effects towards zero.
+                                         Defaults to 5.
+            sample_periodicity (str, optional): Length of the time steps.
+                                                Defaults to '1D'.
+        """
+        to_offset(sample_periodicity)
+        if process_sd <= 0:
+            raise ValueError('process_sd must be positive.')
+        self.process_sd = process_sd
+        self.default_sample = default_sample
+        self.extra_sd = extra_sd
+        self.pollster_effects = pollster_effects
+        self.shrinkage = shrinkage
+        self.sample_periodicity = sample_periodicity
+        self.house_effects = pd.DataFrame(dtype=float)
+        self.mean_share = pd.Series(dtype=float)
+        self.excess_sd = pd.Series(dtype=float)
+        self.noise_sd = pd.Series(dtype=float)
+        self.reset()
+
+    def __repr__(self):
+        return (f'KalmanTrend(process_sd={self.process_sd!r}, '
+                f'default_sample={self.default_sample!r}, '
+                f'extra_sd={self.extra_sd!r}, '
+                f'pollster_effects={self.pollster_effects!r}, '
+                f'shrinkage={self.shrinkage!r}, '
+                f'sample_periodicity={self.sample_periodicity!r})')
+
+    def with_periodicity(self, sample_periodicity):
+        """An unfitted copy of the estimator with different time steps."""
+        return KalmanTrend(self.process_sd, self.default_sample,
+                           self.extra_sd, self.pollster_effects,
+                           self.shrinkage, sample_periodicity)
+
+    def reset(self):
+        """Forget every filtered period."""
+        self.candidates = []
+        self._periods = []
+        # Filtered mean and variance, and predicted variance, per period
+        self._mean = []
+        self._var = []
+        self._pred_var = []
+
+    @property
+    def periods(self):
+        return pd.DatetimeIndex(self._periods, name='date')
+
+    def observations(self, polls, candidates=None, weights=None):
+        """
+        Turn polls into share observations and their variances.
+
+        The variance of a poll's share is the sampling variance
+        p(1 - p)/n, taking p as the candidate's mean share so that low
+        readings are not trusted more, plus the non-sampling variance,
+        all divided by the poll's weight.
+
+        Parameters:
+            polls (pandas.DataFrame): Cleaned polls, with the date as a
+                                      column or as the index.
+            candidates (list, optional): Candidate columns. Defaults to
+                                         every column other than the
+                                         date, pollster and sample.
+            weights (array-like, optional): Weight of each poll. Defaults
+                                            to unit weights.
+
+        Returns:
+            tuple: The polls as a `PollMatrix`, with house effects
+            removed from the shares, and the observation variances.
+        """
+        matrix = PollMatrix.from_frame(polls, candidates)
+        variance = self._sampling_variance(matrix) + \
+            self._excess_variance(matrix.candidate_names)
+        variance = np.where(np.isnan(matrix.shares), np.nan, variance)
+        if weights is not None:
+            with np.errstate(divide='ignore'):
+                variance = variance / np.asarray(weights, float)[:, None]
+        if not self.house_effects.empty:
+            effects = self.house_effects.reindex(
+                index=matrix.pollster_names,
+                columns=matrix.candidate_names
+            ).fillna(0.).to_numpy()
+            matrix.shares = matrix.shares - effects
+        return matrix, variance
+
+    def _sampling_variance(self, matrix):
+        sample = np.where(np.isnan(matrix.sample) | (matrix.sample <= 0),
+                          self.default_sample, matrix.sample)
+        p = pd.DataFrame(matrix.shares,
+                         columns=matrix.candidate_names).mean()
+        if len(self.mean_share):
+            p = self.mean_share.reindex(p.index).fillna(p)
+        p = np.clip(p.fillna(.5).to_numpy(), .01, .99)
+        return p * (1 - p) / sample[:, None]
+
+    def _excess_variance(self, names):
+        if self.extra_sd is not None:
+            return np.full(len(names), float(self.extra_sd) ** 2)
+        default = self.excess_sd.median() if len(self.excess_sd) else 0.
+        return self.excess_sd.reindex(names).fillna(default)\
+            .to_numpy() ** 2
+
+    def estimate_excess_sd(self, polls, candidates=None):
+        """
+        Estimate each candidate's non-sampling error.
+
+        Half the mean squared difference between successive polls of a
+        candidate estimates the variance of one poll, barely affected by
+        slow movements in the true share. The sampling variance is
+        subtracted to leave the non-sampling variance.
+
+        Parameters:
+            polls (pandas.DataFrame): Cleaned polls.
+            candidates (list, optional): Candidate columns.
+
+        Returns:
+            pandas.Series: The non-sampling error of each candidate.
+        """
+        matrix = PollMatrix.from_frame(polls, candidates)
+        order = np.argsort(matrix.dates, kind='stable')
+        shares = pd.DataFrame(matrix.shares[order],
+                              columns=matrix.candidate_names)
+        successive = shares.apply(
+            lambda share: share.dropna().diff().pow(2).mean() / 2
+        )
+        sampling = np.nanmean(
+            np.where(np.isnan(matrix.shares), np.nan,
+                     self._sampling_variance(matrix)), axis=0
+        ) if len(matrix) else np.zeros(len(successive))
+        excess = (successive - sampling).clip(lower=0.).fillna(0.)
+        return np.sqrt(excess)
+
+    def fit(self, polls, candidates=None, weights=None):
+        """
+        Filter a table of polls from scratch.
+
+        With `pollster_effects`, the polls are filtered and smoothed
+        once, the house effects are estimated from the residuals, and the
+        polls are filtered again with the effects removed.
+
+        Parameters:
+            polls (pandas.DataFrame): Cleaned polls.
+            candidates (list, optional): Candidate columns.
+            weights (array-like, optional): Weight of each poll.
+
+        Returns:
+            KalmanTrend: The fitted estimator.
+        """
+        self.house_effects = pd.DataFrame(dtype=float)
+        self.mean_share = pd.Series(dtype=float)
+        self.reset()
+        if self.extra_sd is None:
+            self.excess_sd = self.estimate_excess_sd(polls, candidates)
+        matrix, variance = self.observations(polls, candidates, weights)
+        self.mean_share = pd.DataFrame(
+            matrix.shares, columns=matrix.candidate_names
+        ).mean()
+        self._filter(matrix, variance)
+        if self.pollster_effects:
+            self.house_effects = self._house_effects(matrix)
+            self.reset()
+            matrix, variance = self.observations(polls, candidates,
+                                                 weights)
+            self._filter(matrix, variance)
+        self.noise_sd = pd.DataFrame(np.sqrt(variance),
+                                     columns=matrix.candidate_names).median()
+        return self
+
+    def update(self, polls, candidates=None, weights=None):
+        """
+        Absorb new polls into the filter without refitting the history.
+
+        The mean shares, non-sampling error and house effects estimated
+        by `fit` are kept, so absorbing polls one batch at a time gives
+        the same filtered trend as absorbing them all at once.
+        Polls dated before the latest filtered period arrived late, and
+        are counted in the latest period.
+
+        Parameters:
+            polls (pandas.DataFrame): Cleaned polls.
+            candidates (list, optional): Candidate columns.
+            weights (array-like, optional): Weight of each poll.
+
+        Returns:
+            KalmanTrend: The updated estimator.
+        """
+        matrix, variance = self.observations(polls, candidates, weights)
+        self._filter(matrix, variance)
+        return self
+
+    def _filter(self, matrix, variance):
+        columns = self._columns(matrix.candidate_names)
+        bins, labels = matrix.period_bins(self.sample_periodicity)
+        if self._periods and len(labels):
+            # Continue the grid from the latest filtered period
+            last = self._periods[-1]
+            grid = pd.date_range(last, max(labels[-1], last),
+                                 freq=self.sample_periodicity)
+            position = np.maximum(
+                grid.searchsorted(labels, side='right') - 1, 0
+            )
+            late = labels < last
+            if late.any():
+                logger.debug('%d period(s) of polls predate the latest '
+                             'filtered period %s', late.sum(), last)
+            bins = np.where(bins >= 0, position[bins], -1)
+        else:
+            grid = labels
+
+        # Total precision and precision-weighted shares per period
+        n_candidates = len(self.candidates)
+        observed = (bins[:, None] >= 0) & ~np.isnan(matrix.shares) & \
+            (variance > 0) & np.isfinite(variance)
+        rows, cols = np.nonzero(observed)
+        cells = bins[rows] * n_candidates + columns[cols]
+        precision = 1. / variance[rows, cols]
+        size = len(grid) * n_candidates
+        info = np.bincount(cells, weights=precision, minlength=size)\
+            .reshape(len(grid), n_candidates)
+        info_mean = np.bincount(
+            cells, weights=precision * matrix.shares[rows, cols],
+            minlength=size
+        ).reshape(len(grid), n_candidates)
+
+        q = self.process_sd ** 2
+        for k, period in enumerate(grid):
+            if self._periods and period == self._periods[-1]:
+                # More polls for the latest period: update it in place
+                mean, var = self._state(n_candidates)
+                self._mean[-1], self._var[-1] = self._correct(
+                    mean, var, info[k], info_mean[k]
+                )
+                continue
+            if self._periods:
+                mean, var = self._state(n_candidates)
+                days = (period - self._periods[-1]) / DAY
+                var = var + q * days
+            else:
+                mean = np.zeros(n_candidates)
+                var = np.full(n_candidates, np.inf)
+            self._pred_var.append(var)
+            mean, var = self._correct(mean, var, info[k], info_mean[k])
+            self._periods.append(period)
+            self._mean.append(mean)
+            self._var.append(var)
+
+    def _columns(self, names):
+        """State positions of the named candidates, adding new ones."""
+        for name in names:
+            if name not in self.candidates:
+                self.candidates.append(name)
+        return np.array([self.candidates.index(n) for n in names],
+                        dtype=np.intp)
+
+    def _state(self, n_candidates):
+        """The latest filtered state, with priors for new candidates."""
+        mean, var = self._mean[-1], self._var[-1]
+        new = n_candidates - len(mean)
+        return (np.concatenate([mean, np.zeros(new)]),
+                np.concatenate([var, np.full(new, np.inf)]))
+
+    @staticmethod
+    def _correct(mean, var, info, info_mean):
+        """Combine the prior with a period's polls, in information form."""
+        precision = 1. / var + info
+        with np.errstate(divide='ignore', invalid='ignore'):
+            posterior = (mean / var + info_mean) / precision
+            posterior_var = 1. / precision
+        polled = info > 0
+        return (np.where(polled, posterior, mean),
+                np.where(polled, posterior_var, var))
+
+    def _stack(self, arrays, fill):
+        out = np.full((len(arrays), len(self.candidates)), fill)
+        for k, values in enumerate(arrays):
+            out[k, :len(values)] = values
+        return out
+
+    def filtered(self):
+        """
+        The filtered trend, using only the polls up to each period.
+
+        Returns:
+            tuple: Mean and standard deviation frames, periods by
+            candidates, NaN before a candidate's first poll.
+        """
+        mean = self._stack(self._mean, 0.)
+        var = self._stack(self._var, np.inf)
+        return self._frames(mean, var)
+
+    def smooth(self):
+        """
+        Run the Rauch-Tung-Striebel smoother over the filtered periods.
+
+        Returns:
+            tuple: Mean and standard deviation frames, periods by
+            candidates, NaN before a candidate's first poll.
+        """
+        mean = self._stack(self._mean, 0.)
+        var = self._stack(self._var, np.inf)
+        pred_var = self._stack(self._pred_var, np.inf)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k in range(len(mean) - 2, -1, -1):
+                # The random walk predicts the next mean unchanged
+                gain = var[k] / pred_var[k + 1]
+                gain = np.where(np.isfinite(var[k]), gain, 0.)
+                mean[k] = mean[k] + gain * (mean[k + 1] - mean[k])
+                var[k] = var[k] + gain ** 2 * (var[k + 1] - pred_var[k + 1])
+        return self._frames(mean, var)
+
+    def _frames(self, mean, var):
+        unobserved = ~np.isfinite(var)
+        mean[unobserved] = np.nan
+        var[unobserved] = np.nan
+        return (pd.DataFrame(mean, index=self.periods,
+                             columns=self.candidates),
+                pd.DataFrame(np.sqrt(var), index=self.periods,
+                             columns=self.candidates))
+
+    def _house_effects(self, matrix):
+        """Shrunken mean residual of each pollster for each candidate."""
+        trend, _ = self.smooth()
+        bins, labels = matrix.period_bins(self.sample_periodicity)
+        dated = bins >= 0
+        level = trend.reindex(labels).to_numpy()[bins[dated]]
+        level = level[:, self._columns(matrix.candidate_names)]
+        residuals = pd.DataFrame(matrix.shares[dated] - level,
+                                 columns=matrix.candidate_names)
+        grouped = residuals.groupby(matrix.pollster_names[dated])
+        counts = grouped.count()
+        effects = (grouped.sum() / (counts + self.shrinkage))\
+            .where(counts > 0)
+        # Only relative house effects are identifiable
+        return (effects - effects.mean()).fillna(0.)
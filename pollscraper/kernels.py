@@ -0,0 +1,238 @@
+"""Numerical kernels behind trend calculation, optionally Numba-compiled.
+
+Each kernel has a NumPy implementation and a loop implementation that is
+compiled with Numba when it is installed. Compiled kernels are cached to
+disk (see Numba's `NUMBA_CACHE_DIR`), so the compile cost is paid once
+per deployment rather than once per process. Both backends give the
+same results, up to floating point rounding.
+"""
+import numpy as np
+from pollscraper import logger
+
+try:
+    import numba
+except ImportError:  # Numba is an optional dependency
+    numba = None
+
+
+BACKENDS = ('numpy', 'numba')
+
+
+def jit(func):
+    """Compile `func` with Numba, caching it to disk, if Numba is present."""
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+def binned_sums_numpy(bins, n_bins, shares, weights):
+    """
+    Sum weighted shares, weights and polls per period.
+
+    Parameters:
+        bins (numpy.ndarray): Period of each poll, -1 to leave it out.
+        n_bins (int): Number of periods.
+        shares (numpy.ndarray): Vote shares, polls by candidates. Missing
+                                shares count as zero.
+        weights (numpy.ndarray): Weight of each poll.
+
+    Returns:
+        tuple: Weighted share sums (periods by candidates), weight totals
+        per period, and the number of polls including each candidate in
+        each period.
+    """
+    binned = bins >= 0
+    bins, weights, shares = bins[binned], weights[binned], shares[binned]
+    n_candidates = shares.shape[1]
+    cells = (bins[:, None] * n_candidates + np.arange(n_candidates)).ravel()
+    size = n_bins * n_candidates
+    polled = ~np.isnan(shares)
+    weighted = np.where(polled, shares * weights[:, None], 0.)
+    sums = np.bincount(cells, weights=np.nan_to_num(weighted.ravel()),
+                       minlength=size).reshape(n_bins, n_candidates)
+    counts = np.bincount(cells, weights=polled.ravel(), minlength=size)\
+        .reshape(n_bins, n_candidates).astype(np.int64)
+    totals = np.bincount(bins, weights=np.nan_to_num(weights),
+                         minlength=n_bins)
+    return sums, totals, counts
+
+
+@jit
+def binned_sums_numba(bins, n_bins, shares, weights):
+    n_polls, n_candidates = shares.shape
+    sums = np.zeros((n_bins, n_candidates))
+    totals = np.zeros(n_bins)
+    counts = np.zeros((n_bins, n_candidates), dtype=np.int64)
+    for i in range(n_polls):
+        b = bins[i]
+        if b < 0:
+            continue
+        w = weights[i]
+        if not np.isnan(w):
+            totals[b] += w
+        for j in range(n_candidates):
+            share = shares[i, j]
+            if np.isnan(share):
+                continue
+            counts[b, j] += 1
+            value = share * w
+            if not np.isnan(value):
+                sums[b, j] += value
+    return sums, totals, counts
+
+
+def window_stats_numpy(values, weights, lo, hi):
+    """
+    Weighted mean and standard deviation of `values[lo:hi]` per window.
+
+    Sums are shifted by the overall mean for numerical stability, and
+    the variance uses reliability weights (ddof=1 for unit weights).
+
+    Parameters:
+        values (numpy.ndarray): Observed values, without missing values.
+        weights (numpy.ndarray): Observation weights.
+        lo (numpy.ndarray): First observation of each window.
+        hi (numpy.ndarray): One past the last observation of each window.
+
+    Returns:
+        tuple: Mean and standard deviation of each window, NaN where the
+        window holds too few observations.
+    """
+    lo, hi = np.asarray(lo), np.asarray(hi)
+    count = hi - lo
+    if not len(values):
+        nan = np.full(len(lo), np.nan)
+        return nan, nan.copy()
+    shift = np.average(values, weights=weights) if weights.sum() else 0.
+    shifted = values - shift
+    sums = np.zeros((4, len(values) + 1))
+    np.cumsum(weights, out=sums[0, 1:])
+    np.cumsum(weights * shifted, out=sums[1, 1:])
+    np.cumsum(weights * shifted ** 2, out=sums[2, 1:])
+    np.cumsum(weights ** 2, out=sums[3, 1:])
+    w, wx, wxx, ww = sums[:, hi] - sums[:, lo]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, shift + wx / w, np.nan)
+        sum_squares = np.maximum(wxx - wx * wx / w, 0.)
+        dof = w - ww / w
+        var = np.where((count > 1) & (dof > 0), sum_squares / dof, np.nan)
+    return mean, np.sqrt(var)
+
+
+@jit
+def window_stats_numba(values, weights, lo, hi):
+    n = len(values)
+    mean = np.full(len(lo), np.nan)
+    std = np.full(len(lo), np.nan)
+    if n == 0:
+        return mean, std
+    total = weights.sum()
+    shift = (values * weights).sum() / total if total != 0. else 0.
+    w_sum = np.zeros(n + 1)
+    wx_sum = np.zeros(n + 1)
+    wxx_sum = np.zeros(n + 1)
+    ww_sum = np.zeros(n + 1)
+    for i in range(n):
+        x = values[i] - shift
+        w = weights[i]
+        w_sum[i + 1] = w_sum[i] + w
+        wx_sum[i + 1] = wx_sum[i] + w * x
+        wxx_sum[i + 1] = wxx_sum[i] + w * x * x
+        ww_sum[i + 1] = ww_sum[i] + w * w
+    for k in range(len(lo)):
+        a, b = lo[k], hi[k]
+        if b <= a:
+            continue
+        w = w_sum[b] - w_sum[a]
+        if w == 0.:
+            continue
+        wx = wx_sum[b] - wx_sum[a]
+        mean[k] = shift + wx / w
+        dof = w - (ww_sum[b] - ww_sum[a]) / w
+        if b - a > 1 and dof > 0.:
+            sum_squares = max(wxx_sum[b] - wxx_sum[a] - wx * wx / w, 0.)
+            std[k] = np.sqrt(sum_squares / dof)
+    return mean, std
+
+
+def outlier_mask_numpy(values, mean, std, n_sigma):
+    """
+    Flag values at least `n_sigma` standard deviations from the mean.
+
+    Parameters:
+        values (numpy.ndarray): Values to check.
+        mean (numpy.ndarray): Mean at each value.
+        std (numpy.ndarray): Standard deviation at each value.
+        n_sigma (float): Threshold, in standard deviations.
+
+    Returns:
+        numpy.ndarray: True for each outlier. Comparisons with missing
+        values are False.
+    """
+    with np.errstate(invalid='ignore'):
+        return np.abs(values - mean) >= n_sigma * std
+
+
+@jit
+def outlier_mask_numba(values, mean, std, n_sigma):
+    mask = np.zeros(len(values), dtype=np.bool_)
+    for i in range(len(values)):
+        mask[i] = abs(values[i] - mean[i]) >= n_sigma * std[i]
+    return mask
+
+
+class Kernels:
+    """
+    The kernel functions of one backend.
+
+    Attributes:
+        name (str): The backend, one of `BACKENDS`.
+        binned_sums (callable): See `binned_sums_numpy`.
+        window_stats (callable): See `window_stats_numpy`.
+        outlier_mask (callable): See `outlier_mask_numpy`.
+    """
+
+    def __init__(self, name, binned_sums, window_stats,
+                 outlier_mask) -> None:
+        self.name = name
+        self.binned_sums = binned_sums
+        self.window_stats = window_stats
+        self.outlier_mask = outlier_mask
+
+    def __repr__(self):
+        return f'Kernels({self.name!r})'
+
+
+_KERNELS = {
+    'numpy': Kernels('numpy', binned_sums_numpy, window_stats_numpy,
+                     outlier_mask_numpy),
+    'numba': Kernels('numba', binned_sums_numba, window_stats_numba,
+                     outlier_mask_numba),
+}
+
+
+def get_kernels(backend='numpy'):
+    """
+    Look up the kernels of a backend.
+
+    Parameters:
+        backend (str, optional): 'numpy', 'numba', or 'auto' for Numba
+                                 when it is installed. Asking for Numba
+                                 without it installed falls back to
+                                 NumPy with a warning. Defaults to 'numpy'.
+
+    Returns:
+        Kernels: The backend's kernels.
+    """
+    if isinstance(backend, Kernels):
+        return backend
+    if backend == 'auto':
+        backend = 'numpy' if numba is None else 'numba'
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend}.')
+    if backend == 'numba' and numba is None:
+        logger.warning('Numba is not installed, '
+                       'falling back to the NumPy backend.')
+        backend = 'numpy'
+    return _KERNELS[backend]
@@ -0,0 +1,190 @@
+"""Non-blocking logging configuration for the package."""
+import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+LOGGING_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Running listeners, by logger name
+_listeners = {}
+
+# Arguments that cannot change before the listener formats the record
+_IMMUTABLE = (str, bytes, int, float, complex, bool, type(None), frozenset)
+
+
+def _snapshot(value):
+    if isinstance(value, _IMMUTABLE):
+        return value
+    try:
+        return copy.copy(value)
+    except Exception:
+        return value
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler that leaves all formatting to the listener's handlers.
+
+    `QueueHandler.prepare` formats each record on the calling thread,
+    merging its arguments into the message and rendering any traceback.
+    This handler only copies the record and snapshots mutable arguments,
+    so the message reads as it would have at the call even if they are
+    changed before the listener thread formats it.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.args, dict):
+            record.args = {key: _snapshot(value)
+                           for key, value in record.args.items()}
+        elif record.args:
+            record.args = tuple(_snapshot(arg) for arg in record.args)
+        return record
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """Format each record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'name': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(logger, level=logging.INFO, log_file=None,
+                      json_lines=False, max_bytes=10 * 2**20,
+                      backup_count=5, stream=sys.stderr,
+                      stream_level=None):
+    """
+    Route a logger through a queue to stream and rotating file handlers.
+
+    Callers only put records on a queue, see `DeferredQueueHandler`. A
+    background listener thread does the formatting and the writes to
+    stderr and the log file, so both stay off the pipeline's hot paths.
+    Calling this again replaces the previous configuration.
+
+    Parameters:
+        logger (logging.Logger): The logger to configure.
+        level (int or str, optional): Logging level. Defaults to INFO.
+        log_file (str or pathlib.Path, optional): Path of the log file,
+                                                  which is rotated by size.
+        json_lines (bool, optional): Write structured JSON lines rather than
+                                     plain text. Defaults to False.
+        max_bytes (int, optional): Size at which the log file is rotated.
+                                   Defaults to 10 MiB.
+        backup_count (int, optional): Number of rotated files kept.
+                                      Defaults to 5.
+        stream (file, optional): Stream for console output, or None to
+                                 disable it. Defaults to stderr.
+        stream_level (int or str, optional): Lowest level written to
+                                             `stream`, e.g. to quieten
+                                             the console but not the
+                                             log file. Defaults to
+                                             `level`.
+
+    Returns:
+        logging.handlers.QueueListener: The running listener.
+    """
+    stop_logging(logger)
+
+    formatter = JSONLinesFormatter() if json_lines \
+        else logging.Formatter(LOGGING_FORMAT)
+    handlers = []
+    if stream is not None:
+        stream_handler = logging.StreamHandler(stream)
+        if stream_level is not None:
+            stream_handler.setLevel(stream_level)
+        handlers.append(stream_handler)
+    if log_file is not None:
+        handlers.append(RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                            backupCount=backup_count,
+                                            delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    logger.setLevel(level)
+    listener = QueueListener(log_queue, *handlers,
+                             respect_handler_level=True)
+    listener.start()
+    _listeners[logger.name] = listener
+    return listener
+
+
+def stop_logging(logger):
+    """
+    Flush queued records and detach the queue handler from a logger.
+
+    Parameters:
+        logger (logging.Logger): The configured logger.
+    """
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    listener = _listeners.pop(logger.name, None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+class _LoggerHandler(logging.Handler):
+    """Pass records on to the logger they were logged to."""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def forward_logging(logger, log_queue):
+    """
+    Send a worker process's records to its parent through a queue.
+
+    A forked worker inherits the parent's queue handler but not its
+    listener thread, so its records would otherwise never be written.
+    Records are formatted in the worker, so that they can be pickled.
+
+    Parameters:
+        logger (logging.Logger): The logger to forward.
+        log_queue (multiprocessing.Queue): Queue read by the parent with
+                                           `receive_logging`.
+    """
+    stop_logging(logger)
+    logger.addHandler(QueueHandler(log_queue))
+
+
+def receive_logging(log_queue):
+    """
+    Log the records forwarded by worker processes with `forward_logging`.
+
+    Each record is handled by the logger of its name in this process.
+
+    Parameters:
+        log_queue (multiprocessing.Queue): Queue the workers write to.
+
+    Returns:
+        logging.handlers.QueueListener: The running listener, to stop
+        once the workers have exited.
+    """
+    listener = QueueListener(log_queue, _LoggerHandler())
+    listener.start()
+    return listener
+
+
+def _stop_at_exit():
+    for listener in _listeners.values():
+        listener.stop()
+
+
+atexit.register(_stop_at_exit)
@@ -0,0 +1,226 @@
+"""Atomic, concurrent and partitioned writing of output tables."""
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+import pandas as pd
+from pollscraper import logger
+
+
+# Hive's name for the partition of rows with a missing key
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Race partition of tables written without a race
+ALL_RACES = '__all__'
+
+_umask = None
+_umask_lock = threading.Lock()
+
+
+def _default_mode(directory=False):
+    """
+    Mode that `open` or `mkdir` would give a new file or directory.
+
+    `mkstemp` and `mkdtemp` create private files and directories, which
+    would otherwise keep their 0600 and 0700 modes once renamed into
+    place. Outside of Linux the umask can only be read by setting it,
+    so it is read once.
+    """
+    global _umask
+    with _umask_lock:
+        if _umask is None:
+            _umask = _read_umask()
+    return (0o777 if directory else 0o666) & ~_umask
+
+
+def _read_umask():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def atomic_write(path, mode='w', **kwargs):
+    """
+    Open a temporary file that replaces `path` once closed successfully.
+
+    The file is written next to `path` and renamed over it, so readers
+    see either the old file or the complete new one, never a partial
+    write. If writing fails, `path` is left untouched.
+
+    Parameters:
+        path (str or pathlib.Path): The destination file.
+        mode (str, optional): File mode, 'w' or 'wb'. Defaults to 'w'.
+        **kwargs: Passed to `open`, e.g. `newline=''`.
+
+    Yields:
+        file: The open temporary file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.',
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, _default_mode())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_csv(frame, path, n_places=4, **kwargs):
+    """
+    Write a frame to CSV atomically.
+
+    Parameters:
+        frame (pandas.DataFrame): The table.
+        path (str or pathlib.Path): The destination file.
+        n_places (int, optional): Floating point precision. Defaults to 4.
+        **kwargs: Passed to `DataFrame.to_csv`.
+
+    Returns:
+        pathlib.Path: The written file.
+    """
+    with atomic_write(path, newline='') as f:
+        frame.to_csv(f, float_format=f'%.{n_places}f', **kwargs)
+    return Path(path)
+
+
+def partition_keys(frame, date_col='date'):
+    """
+    Hive partition of each row, by month.
+
+    Parameters:
+        frame (pandas.DataFrame): The table.
+        date_col (str, optional): Date column. Defaults to 'date'.
+
+    Returns:
+        pandas.Series: The partition directory of each row, e.g.
+        'month=2024-03'.
+    """
+    months = pd.to_datetime(frame[date_col]).dt.strftime('%Y-%m')\
+        .fillna(DEFAULT_PARTITION)
+    return 'month=' + months
+
+
+def _replace_dir(tmp, target):
+    """
+    Swap a fully written directory into place.
+
+    This takes two renames, moving `target` aside and then `tmp` into
+    place, so a reader can briefly find no directory at `target`. It
+    never sees a partly written one.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    old = None
+    if target.exists():
+        old = Path(tempfile.mkdtemp(dir=target.parent,
+                                    prefix=f'.{target.name}.old.'))
+        os.replace(target, old / target.name)
+    os.replace(tmp, target)
+    if old is not None:
+        shutil.rmtree(old)
+
+
+def write_partitioned(frame, directory, race=None, n_places=4,
+                      date_col='date', **kwargs):
+    """
+    Write a frame as Hive-style partitions, one CSV per partition.
+
+    Files are laid out as `directory/race=<race>/month=<YYYY-MM>/
+    part-0.csv`, with tables without a race under `race=__all__`. The
+    partitions are written to a temporary directory which then replaces
+    the race's directory, so partitions left from earlier runs are
+    removed and other races are untouched. Each file is complete once
+    visible, but the race's directory is briefly missing while it is
+    replaced, see `_replace_dir`.
+
+    Parameters:
+        frame (pandas.DataFrame): The table.
+        directory (str or pathlib.Path): Root directory of the dataset.
+        race (str, optional): Name of the race the table belongs to.
+                              Defaults to `ALL_RACES`.
+        n_places (int, optional): Floating point precision. Defaults to 4.
+        date_col (str, optional): Date column. Defaults to 'date'.
+        **kwargs: Passed to `DataFrame.to_csv`.
+
+    Returns:
+        list: The written files.
+    """
+    directory = Path(directory)
+    race = ALL_RACES if race is None else race
+    target = directory / f'race={race}'
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=target.parent,
+                                prefix=f'.{target.name}.'))
+    written = []
+    try:
+        keys = partition_keys(frame, date_col)
+        for key, part in frame.groupby(keys.to_numpy(), sort=True):
+            path = tmp / key / 'part-0.csv'
+            path.parent.mkdir(parents=True)
+            part.to_csv(path, float_format=f'%.{n_places}f', **kwargs)
+            written.append(target / key / 'part-0.csv')
+        os.chmod(tmp, _default_mode(directory=True))
+        _replace_dir(tmp, target)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return written
+
+
+def write_outputs(outputs, results_dir, n_places=4, partition=False,
+                  race=None, max_workers=None):
+    """
+    Write several output tables concurrently.
+
+    Each CSV file is replaced atomically; see `write_partitioned` for
+    partitioned tables.
+
+    Parameters:
+        outputs (dict): Tables by name, e.g. {'polls': ..., 'trends': ...}.
+        results_dir (str or pathlib.Path): Output directory.
+        n_places (int, optional): Floating point precision. Defaults to 4.
+        partition (bool, optional): Write each table as Hive-style
+                                    partitions under `results_dir/<name>/`
+                                    rather than as `results_dir/<name>.csv`.
+                                    Defaults to False.
+        race (str, optional): Name of the race, used as the outer
+                              partition. Defaults to `ALL_RACES`.
+        max_workers (int, optional): Number of writer threads. Defaults to
+                                     one per table.
+
+    Returns:
+        dict: The written files for each table.
+    """
+    results_dir = Path(results_dir)
+
+    def write(name, frame):
+        if partition:
+            return write_partitioned(frame, results_dir / name, race,
+                                     n_places)
+        return [write_csv(frame, results_dir / f'{name}.csv', n_places)]
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(outputs) or 1) \
+            as executor:
+        futures = {name: executor.submit(write, name, frame)
+                   for name, frame in outputs.items()}
+        written = {name: future.result() for name, future in futures.items()}
+    for name, paths in written.items():
+        logger.info('Saved %s to %s', name,
+                    paths[0] if len(paths) == 1 else results_dir / name)
+    return written
@@ -0,0 +1,80 @@
+"""Rolling weighted statistics over irregularly spaced polls."""
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from pollscraper.kernels import get_kernels
+
+
+def window_bounds(times, eval_times, window, align='right'):
+    """
+    Find the observations inside the window of each evaluation time.
+
+    Parameters:
+        times (numpy.ndarray): Sorted observation times.
+        eval_times (numpy.ndarray): Sorted evaluation times.
+        window (numpy.timedelta64): The window length.
+        align (str, optional): 'right' for trailing windows (t - w, t],
+                               'left' for forward-looking windows
+                               [t, t + w). Defaults to 'right'.
+
+    Returns:
+        tuple: Arrays of the first and one-past-last observation index in
+        each window.
+    """
+    if align == 'right':
+        return (np.searchsorted(times, eval_times - window, side='right'),
+                np.searchsorted(times, eval_times, side='right'))
+    if align == 'left':
+        return (np.searchsorted(times, eval_times, side='left'),
+                np.searchsorted(times, eval_times + window, side='left'))
+    raise ValueError(f'Unknown window alignment {align}.')
+
+
+def rolling_weighted_stats(times, values, window, eval_times=None,
+                           weights=None, align='right', backend='numpy'):
+    """
+    Weighted mean and standard deviation over time-based windows.
+
+    Mean and variance come from one pass of running sums of the weights,
+    and of the weighted values and squared values. The values are
+    shifted by their overall mean first, which keeps the variance
+    numerically stable. Each window then costs O(1), whatever the
+    spacing of the observations, and no dense grid is needed. Missing
+    values are ignored. The variance uses reliability weights, so with
+    unit weights it is the usual sample variance (ddof=1).
+
+    Parameters:
+        times (array-like): Observation times, sorted ascending.
+        values (array-like): Observed values.
+        window (str or pandas.Timedelta): Window length, e.g. '7D'.
+        eval_times (array-like, optional): Sorted times at which to
+                                           evaluate the statistics.
+                                           Defaults to `times`.
+        weights (array-like, optional): Observation weights. Defaults to
+                                        unit weights.
+        align (str, optional): 'right' for trailing windows (t - w, t],
+                               'left' for forward-looking windows
+                               [t, t + w). Defaults to 'right'.
+        backend (str, optional): Kernel backend, see
+                                 `kernels.get_kernels`. Defaults to
+                                 'numpy'.
+
+    Returns:
+        tuple: Arrays of the mean, standard deviation and number of
+        observations in each window. The mean is NaN for empty windows,
+        and the standard deviation for windows of one observation.
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    values = np.asarray(values, dtype=float)
+    eval_times = times if eval_times is None \
+        else np.asarray(eval_times, dtype='datetime64[ns]')
+    weights = np.ones_like(values) if weights is None \
+        else np.asarray(weights, dtype=float)
+    window = pd.to_timedelta(to_offset(window)).to_timedelta64()
+
+    observed = ~np.isnan(values) & ~np.isnan(weights)
+    times, values, weights = times[observed], values[observed], \
+        weights[observed]
+    lo, hi = window_bounds(times, eval_times, window, align)
+    mean, std = get_kernels(backend).window_stats(values, weights, lo, hi)
+    return mean, std, hi - lo
@@ -0,0 +1,546 @@
+"""Adaptive scheduling of scrapes by each source's observed rate of change.
+
+Each source is refetched at an interval set from an estimate of how often
+its content changes, so that pages which change hourly are scraped
+hourly and pages which change weekly are scraped about weekly. Changes
+are detected by hashing the content of each fetch. Changes are assumed
+to arrive as a Poisson process, and its rate is estimated from how many
+fetches found the content unchanged, using the estimator of Cho and
+Garcia-Molina ("Estimating frequency of change", 2003), which allows
+for several changes falling between two fetches.
+"""
+import hashlib
+import heapq
+import json
+import math
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+import requests
+from pollscraper import logger
+from pollscraper.connection import build_session
+from pollscraper.dedup import PollDeduplicator
+from pollscraper.output import atomic_write, write_outputs
+from pollscraper.scraper import DataPipeline
+from pollscraper.trends import PollTrend
+
+
+STATE_VERSION = 1
+
+
+class SourceState:
+    """
+    What the scheduler has learned about one source.
+
+    Counts of fetches are exponentially decayed, so the estimated rate of
+    change follows sources whose update frequency drifts.
+
+    Attributes:
+        url (str): The source URL.
+        interval (float): Current refetch interval, in seconds.
+        next_fetch (float): Time of the next fetch, in epoch seconds.
+        last_fetch (float): Time of the last successful fetch, if any.
+        content_hash (str): Hash of the content of the last fetch.
+        observed (float): Decayed number of fetches compared with the one
+                          before.
+        unchanged (float): Decayed number of those fetches that found the
+                           content unchanged.
+        observed_time (float): Decayed total time between those fetches.
+        fetches (int): Number of successful fetches.
+        changes (int): Number of fetches that found new content.
+        errors (int): Number of consecutive failed fetches.
+        last_error (str): Message of the last failure, if any.
+    """
+
+    FIELDS = ('url', 'interval', 'next_fetch', 'last_fetch', 'content_hash',
+              'observed', 'unchanged', 'observed_time', 'fetches',
+              'changes', 'errors', 'last_error')
+
+    def __init__(self, url, interval, next_fetch=0., last_fetch=None,
+                 content_hash=None, observed=0., unchanged=0.,
+                 observed_time=0., fetches=0, changes=0, errors=0,
+                 last_error=None) -> None:
+        self.url = url
+        self.interval = interval
+        self.next_fetch = next_fetch
+        self.last_fetch = last_fetch
+        self.content_hash = content_hash
+        self.observed = observed
+        self.unchanged = unchanged
+        self.observed_time = observed_time
+        self.fetches = fetches
+        self.changes = changes
+        self.errors = errors
+        self.last_error = last_error
+
+    def __repr__(self):
+        return (f'SourceState({self.url!r}, interval={self.interval:.0f}, '
+                f'next_fetch={self.next_fetch:.0f})')
+
+    @property
+    def host(self):
+        return urlsplit(self.url).netloc.lower()
+
+    @property
+    def change_rate(self):
+        """
+        Estimated number of changes per second, or None before any
+        fetches have been compared.
+        """
+        if self.observed <= 0 or self.observed_time <= 0:
+            return None
+        mean_interval = self.observed_time / self.observed
+        return -math.log((self.unchanged + .5) / (self.observed + .5)) \
+            / mean_interval
+
+    def observe(self, changed, now, decay=.9):
+        """
+        Record whether a fetch at `now` found the content changed.
+
+        Parameters:
+            changed (bool): Whether the content changed since the last
+                            successful fetch.
+            now (float): Time of the fetch, in epoch seconds.
+            decay (float, optional): Weight kept by earlier fetches.
+                                     Defaults to 0.9.
+        """
+        if self.last_fetch is not None and now > self.last_fetch:
+            self.observed = decay * self.observed + 1
+            self.unchanged = decay * self.unchanged + (not changed)
+            self.observed_time = decay * self.observed_time + \
+                now - self.last_fetch
+        self.last_fetch = now
+        self.fetches += 1
+        self.changes += bool(changed)
+        self.errors = 0
+        self.last_error = None
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(**{k: v for k, v in state.items() if k in cls.FIELDS})
+
+
+def build_pipeline(**kwargs):
+    """
+    Build a pipeline that leaves rate limiting and server errors to the
+    scheduler.
+
+    The default session retries 429 and 503 responses itself, sleeping
+    for their `Retry-After`, which would stall every other source. Here
+    such responses are raised at once as `HTTPError`, and the scheduler
+    backs off that source alone. Connection errors are still retried.
+
+    Parameters:
+        **kwargs: Passed to `DataPipeline`.
+
+    Returns:
+        DataPipeline: The pipeline.
+    """
+    kwargs.setdefault('session', build_session(status_retries=0))
+    return DataPipeline(**kwargs)
+
+
+def retry_after(error, now):
+    """Seconds to wait asked for by a `Retry-After` header, if any."""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') \
+        if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - now, 0.)
+    except (TypeError, ValueError):
+        return None
+
+
+class Scheduler:
+    """
+    Fetch sources as often as their content changes.
+
+    Sources are held in a priority queue ordered by the time of their
+    next fetch. After each fetch, the next is scheduled so that the
+    content has changed with probability `change_probability` by then,
+    within `min_interval` and `max_interval`. Requests to one host are
+    spaced by at least `host_interval`, and a source that fails is
+    retried with exponential backoff, or after the server's
+    `Retry-After`. State is saved to `state_path` after every round of
+    fetches, so a restarted scheduler carries on where it left off.
+
+    Attributes:
+        pipeline (DataPipeline): Pipeline used to fetch sources.
+        handler (callable): Called as `handler(url, response)` with each
+                            fetch that found new content.
+        sources (dict): `SourceState` of each source, by URL.
+        state_path (pathlib.Path): JSON file holding the state, if any.
+        fetches (int): Fetches made by this scheduler.
+        changes (int): Fetches that found new content.
+        failures (int): Fetches that failed.
+    """
+
+    def __init__(self, pipeline=None, handler=None, state_path=None,
+                 min_interval=300., max_interval=7 * 86400.,
+                 initial_interval=3600., change_probability=.5,
+                 decay=.9, host_interval=1., backoff=60.,
+                 max_backoff=86400., jitter=.1, clock=time.time,
+                 sleep=time.sleep, seed=None) -> None:
+        """
+        Parameters:
+            pipeline (DataPipeline, optional): Pipeline used to fetch
+                                               sources. Defaults to one
+                                               from `build_pipeline`.
+            handler (callable, optional): Called as `handler(url,
+                                          response)` with new content.
+            state_path (str or pathlib.Path, optional): JSON file to load
+                                                        the state from and
+                                                        save it to.
+            min_interval (float, optional): Shortest refetch interval, in
+                                            seconds. Defaults to 5 minutes.
+            max_interval (float, optional): Longest refetch interval, in
+                                            seconds. Defaults to a week.
+            initial_interval (float, optional): Interval of new sources,
+                                                in seconds. Defaults to an
+                                                hour.
+            change_probability (float, optional): Target probability that
+                                                  a source has changed by
+                                                  its next fetch. Defaults
+                                                  to 0.5.
+            decay (float, optional): Weight kept by earlier fetches in the
+                                     change-rate estimate. Defaults to 0.9.
+            host_interval (float, optional): Shortest time between
+                                             requests to one host, in
+                                             seconds. Defaults to 1.
+            backoff (float, optional): Delay after a first failure, in
+                                       seconds, doubled with each further
+                                       failure. Defaults to a minute.
+            max_backoff (float, optional): Longest delay after failures.
+                                           Defaults to a day.
+            jitter (float, optional): Random extra fraction added to
+                                      delays, so that sources do not fall
+                                      into step. Defaults to 0.1.
+            clock (callable, optional): Current time in epoch seconds.
+            sleep (callable, optional): Sleeps for a number of seconds.
+            seed (int, optional): Seed of the jitter.
+        """
+        if not 0 < change_probability < 1:
+            raise ValueError('change_probability must be between 0 and 1.')
+        if not 0 < min_interval <= max_interval:
+            raise ValueError('Expected 0 < min_interval <= max_interval.')
+        self.pipeline = build_pipeline() if pipeline is None else pipeline
+        self.handler = handler
+        self.state_path = Path(state_path) if state_path is not None \
+            else None
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_interval = initial_interval
+        self.change_probability = change_probability
+        self.decay = decay
+        self.host_interval = host_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self.sources = {}
+        self.fetches = 0
+        self.changes = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._queue = []
+        self._counter = 0
+        self._host_ready = {}
+        self.load()
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add(self, url, next_fetch=None):
+        """
+        Start scheduling a source, if it is not scheduled already.
+
+        Parameters:
+            url (str): The source URL.
+            next_fetch (float, optional): Time of the first fetch.
+                                          Defaults to now.
+
+        Returns:
+            SourceState: The state of the source.
+        """
+        url = str(url)
+        if url not in self.sources:
+            source = SourceState(url, self.initial_interval)
+            self.sources[url] = source
+            self._schedule(source, self.clock() if next_fetch is None
+                           else next_fetch)
+        return self.sources[url]
+
+    def remove(self, url):
+        """Stop scheduling a source."""
+        self.sources.pop(str(url), None)
+
+    def _schedule(self, source, when):
+        source.next_fetch = when
+        self._counter += 1
+        heapq.heappush(self._queue, (when, self._counter, source.url))
+
+    def _jittered(self, delay):
+        return delay * (1 + self.jitter * self._random.random())
+
+    def next_interval(self, source):
+        """
+        Interval after which the source has changed with probability
+        `change_probability`, within the interval bounds.
+        """
+        rate = source.change_rate
+        if rate is None:
+            return self.initial_interval
+        if rate <= 0:
+            return self.max_interval
+        interval = -math.log(1 - self.change_probability) / rate
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def fetch(self, source, now=None):
+        """
+        Fetch a source now, and schedule its next fetch.
+
+        Parameters:
+            source (SourceState): The source.
+            now (float, optional): Time of the fetch. Defaults to now.
+
+        Changed content is passed to the handler. If the handler fails,
+        the fetch counts as failed and is retried with backoff, and the
+        content is only recorded as seen once it has been processed.
+
+        Returns:
+            bool or None: Whether the content had changed, or None if the
+            fetch or the processing of its content failed.
+        """
+        now = self.clock() if now is None else now
+        self._host_ready[source.host] = now + self.host_interval
+        try:
+            response = self.pipeline.fetch_html_content(source.url)
+            content = response.content
+        except requests.exceptions.RequestException as e:
+            self._failed(source, e, now)
+            return None
+        self.fetches += 1
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        changed = digest != source.content_hash
+        if changed and self.handler is not None:
+            try:
+                self.handler(source.url, response)
+            except Exception as e:
+                logger.error('Failed to process %s: %s', source.url, e)
+                self._failed(source, e, now)
+                return None
+        source.observe(changed, now, self.decay)
+        source.content_hash = digest
+        source.interval = self.next_interval(source)
+        self._schedule(source, now + self._jittered(source.interval))
+        logger.debug('Fetched %s: %s, next in %.0fs', source.url,
+                     'changed' if changed else 'unchanged', source.interval)
+        if changed:
+            self.changes += 1
+        return changed
+
+    def _failed(self, source, error, now):
+        self.failures += 1
+        source.errors += 1
+        source.last_error = str(error)
+        delay = min(self.backoff * 2 ** (source.errors - 1),
+                    self.max_backoff)
+        delay = self._jittered(delay)
+        wait = retry_after(error, now)
+        if wait is not None:
+            delay = max(delay, wait)
+        self._schedule(source, now + delay)
+        logger.warning('Fetching %s failed (%d in a row), retrying in '
+                       '%.0fs: %s', source.url, source.errors, delay, error)
+
+    def run_pending(self, now=None, limit=None):
+        """
+        Fetch every source that is due and whose host is free.
+
+        Sources held back by the host rate limit, or beyond `limit`, stay
+        at the head of the queue for the next round.
+
+        Parameters:
+            now (float, optional): The current time. Defaults to now.
+            limit (int, optional): Most sources to fetch. Defaults to
+                                   every source that is due.
+
+        Returns:
+            list: The URLs fetched.
+        """
+        now = self.clock() if now is None else now
+        fetched = []
+        held = []
+        while self._queue and self._queue[0][0] <= now and \
+                (limit is None or len(fetched) < limit):
+            entry = heapq.heappop(self._queue)
+            when, _, url = entry
+            source = self.sources.get(url)
+            if source is None or source.next_fetch != when:
+                continue  # removed, or rescheduled since queued
+            if self._host_ready.get(source.host, 0.) > now:
+                held.append(entry)
+                continue
+            self.fetch(source, now)
+            fetched.append(url)
+            now = max(now, self.clock())
+        for entry in held:
+            heapq.heappush(self._queue, entry)
+        if fetched:
+            self.save()
+            logger.debug('Scheduler metrics: %s', self.metrics(now))
+        return fetched
+
+    def wake_time(self, now=None):
+        """Time at which the next source can be fetched, if any."""
+        now = self.clock() if now is None else now
+        while self._queue:
+            when, _, url = self._queue[0]
+            source = self.sources.get(url)
+            if source is not None and source.next_fetch == when:
+                break
+            heapq.heappop(self._queue)
+        else:
+            return None
+        if when > now:
+            return when
+        # Sources already due are held back by host rate limits
+        return min((ready for ready in self._host_ready.values()
+                    if ready > now), default=now)
+
+    def run(self, max_fetches=None, until=None, max_sleep=60.):
+        """
+        Fetch sources as they fall due, until stopped.
+
+        Parameters:
+            max_fetches (int, optional): Stop after this many fetches.
+            until (float, optional): Stop at this time, in epoch seconds.
+            max_sleep (float, optional): Longest sleep between checks of
+                                         the queue, in seconds. Defaults
+                                         to a minute.
+
+        Returns:
+            int: The number of fetches made.
+        """
+        made = 0
+        while max_fetches is None or made < max_fetches:
+            now = self.clock()
+            if until is not None and now >= until:
+                break
+            made += len(self.run_pending(
+                now, None if max_fetches is None else max_fetches - made
+            ))
+            wake = self.wake_time(now)
+            if wake is None:
+                logger.info('No sources left to schedule.')
+                break
+            delay = min(max(wake - self.clock(), 0.), max_sleep)
+            if until is not None:
+                delay = min(delay, max(until - self.clock(), 0.))
+            if delay > 0:
+                self.sleep(delay)
+        return made
+
+    def metrics(self, now=None):
+        """
+        Queue depth, lag and counters of the scheduler.
+
+        Returns:
+            dict: The number of sources and of sources due (the queue
+            depth), the mean and largest time past due of those sources,
+            the number of sources backing off after failures, the time
+            until the next fetch, and the fetch, change and failure
+            counts.
+        """
+        now = self.clock() if now is None else now
+        lags = [now - s.next_fetch for s in self.sources.values()
+                if s.next_fetch <= now]
+        upcoming = [s.next_fetch - now for s in self.sources.values()
+                    if s.next_fetch > now]
+        return {
+            'sources': len(self.sources),
+            'queue_depth': len(lags),
+            'mean_lag': sum(lags) / len(lags) if lags else 0.,
+            'max_lag': max(lags, default=0.),
+            'backing_off': sum(s.errors > 0 for s in self.sources.values()),
+            'next_fetch_in': min(upcoming, default=None),
+            'fetches': self.fetches,
+            'changes': self.changes,
+            'failures': self.failures,
+        }
+
+    def load(self):
+        """Load the sources and their state from `state_path`."""
+        if self.state_path is None or not self.state_path.is_file():
+            return
+        state = json.loads(self.state_path.read_text())
+        if state.get('version') != STATE_VERSION:
+            logger.warning('Ignoring scheduler state %s of version %s',
+                           self.state_path, state.get('version'))
+            return
+        for entry in state['sources']:
+            source = SourceState.from_dict(entry)
+            self.sources[source.url] = source
+            self._schedule(source, source.next_fetch)
+        logger.debug('Loaded the state of %d source(s) from %s',
+                     len(self.sources), self.state_path)
+
+    def save(self):
+        """Write the state to `state_path`, replacing it atomically."""
+        if self.state_path is None:
+            return
+        state = {'version': STATE_VERSION,
+                 'saved': self.clock(),
+                 'sources': [s.to_dict() for s in self.sources.values()]}
+        with atomic_write(self.state_path) as f:
+            json.dump(state, f, indent=2)
+
+
+def source_dir(results_dir, url):
+    """Output directory of one source, named after its host and path."""
+    parts = urlsplit(str(url))
+    name = f'{parts.netloc}{parts.path}'.strip('/') or 'index'
+    return Path(results_dir) / re.sub(r'[^\w.-]+', '_', name)
+
+
+def process_source(pipeline, url, response, results_dir, n_sigma=5,
+                   n_places=4):
+    """
+    Clean the polls of a fetched source and save them with their trends.
+
+    Meant as a `Scheduler` handler, e.g. with `functools.partial`.
+
+    Parameters:
+        pipeline (DataPipeline): Pipeline used to read and clean.
+        url (str): The source URL.
+        response (requests.Response): The fetched response.
+        results_dir (str or pathlib.Path): Root output directory; each
+                                           source is saved under
+                                           `source_dir`.
+        n_sigma (int, optional): Outlier threshold for the trends.
+                                 Defaults to 5.
+        n_places (int, optional): Floating point precision of the output
+                                  files. Defaults to 4.
+
+    Returns:
+        dict: The written files for each table.
+    """
+    # Each source is deduplicated on its own
+    pipeline.deduplicator = PollDeduplicator()
+    polls = pipeline.clean_data(pipeline.read_response(url, response))
+    trends, _, _ = PollTrend.calculate_trends(polls.copy(), n_sigma=n_sigma)
+    return write_outputs({'polls': polls, 'trends': trends},
+                         source_dir(results_dir, url), n_places)
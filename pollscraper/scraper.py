@@ -3,10 +3,15 @@ import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 import numpy as np
-import logging
 from urlpath import URL
 from pollscraper import logger
-from requests.adapters import HTTPAdapter, Retry
+from pollscraper.connection import build_session
+from pollscraper.dates import parse_poll_dates
+from pollscraper.dedup import PollDeduplicator
+from pollscraper.sources import get_source_adapter
+from pollscraper.streaming import (CHUNK_SIZE, TableRowParser,
+                                   iter_table_rows, response_encoding)
+from pollscraper.validation import Validator
 
 
 class DataPipeline:
@@ -24,7 +29,15 @@ class DataPipeline:
 
     def __init__(self, http_n_retries=5,
                  http_connection_timeout=5,
-                 http_read_timeout=30) -> None:
+                 http_read_timeout=30,
+                 session=None,
+                 pool_connections=10,
+                 pool_maxsize=10,
+                 keep_alive=True,
+                 date_anchor='end',
+                 validator=None,
+                 deduplicator=None,
+                 stream=False) -> None:
         """
         Initialize the DataPipeline object.
 
@@ -44,35 +57,73 @@ class DataPipeline:
             http_read_timeout (int, optional): number of seconds the client
                                                will wait for the server to
                                                send a response. Defaults to 30.
+            session (requests.Session, optional): Session to fetch with, e.g.
+                                                  `connection.shared_session()`
+                                                  to reuse connections across
+                                                  pipelines. When omitted, a
+                                                  new session is built.
+            pool_connections (int, optional): Number of hosts to pool
+                                              connections for. Ignored when
+                                              `session` is given.
+                                              Defaults to 10.
+            pool_maxsize (int, optional): Connections kept open per host.
+                                          Ignored when `session` is given.
+                                          Defaults to 10.
+            keep_alive (bool, optional): Keep connections open between
+                                         requests. Ignored when `session`
+                                         is given. Defaults to True.
+            date_anchor (str, optional): Date given to polls fielded over a
+                                         range of dates; one of 'start',
+                                         'end' or 'mid'. Defaults to 'end'.
+            validator (validation.Validator, optional): Rules checked by
+                                                        `clean_data`.
+                                                        Defaults to
+                                                        warnings for every
+                                                        default rule.
+            deduplicator (dedup.PollDeduplicator, optional): Removes
+                republished and revised polls in `clean_data`. Give one
+                with a `path` to deduplicate against earlier runs.
+                Defaults to an in-memory index.
+            stream (bool, optional): Download responses in chunks and
+                                     parse HTML tables as they arrive,
+                                     rather than after the whole body
+                                     has been read. Defaults to False.
         """
         self.common_header_mapping = {
             'Date': 'date',
             'Pollster': 'pollster',
             'Sample': 'n'
         }
-        self.session = requests.Session()
-        self.retries = Retry(total=5,
-                             backoff_factor=0.1,
-                             status_forcelist=[
-                                    500,
-                                    502,
-                                    503,
-                                    504
-                                 ])
-        self.adapter = HTTPAdapter(max_retries=self.retries)
-        self.session.mount('http://', self.adapter)
-        timeout_connect = 5
-        timeout_read = 30
-        self.timeout_policy = (timeout_connect, timeout_read)
+        if session is None:
+            session = build_session(http_n_retries=http_n_retries,
+                                    pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize,
+                                    keep_alive=keep_alive)
+        self.session = session
+        self.adapter = self.session.get_adapter('https://')
+        self.retries = self.adapter.max_retries
+        self.timeout_policy = (http_connection_timeout, http_read_timeout)
         self.headers = {'Accept-Encoding': 'identity'}
+        if date_anchor not in ('start', 'end', 'mid'):
+            raise ValueError(f'Unknown date anchor {date_anchor}.')
+        self.date_anchor = date_anchor
+        self.validator = Validator() if validator is None else validator
+        self.violations = None
+        self.deduplicator = PollDeduplicator() if deduplicator is None \
+            else deduplicator
+        self.stream = stream
         logger.debug("Data Pipeline Initialised.")
 
-    def fetch_html_content(self, url):
+    def fetch_html_content(self, url, stream=None):
         """
         Fetch the HTML content from the given URL.
 
         Parameters:
             url (str): The URL to fetch the HTML from.
+            stream (bool, optional): Return once the headers have arrived,
+                                     leaving the body to be read with
+                                     `response.iter_content`. Defaults to
+                                     `self.stream`.
 
         Returns:
             requests.Response: The HTTP response object containing
@@ -80,15 +131,18 @@ class DataPipeline:
         """
         logger.debug("Attempting to fetch HTML content.")
         logger.debug('Attempting HTTP request with:')
-        logger.debug(f'URL: {url}')
-        logger.debug(f'timeout_policy: {self.timeout_policy}')
-        logger.debug(f'headers: {self.headers}')
-        logger.debug(f'retries: {self.retries}')
+        logger.debug('URL: %s', url)
+        logger.debug('timeout_policy: %s', self.timeout_policy)
+        logger.debug('headers: %s', self.headers)
+        logger.debug('retries: %s', self.retries)
+        if stream is None:
+            stream = self.stream
         try:
             response = self.session.get(
                 url,
                 headers=self.headers,
-                timeout=self.timeout_policy
+                timeout=self.timeout_policy,
+                stream=stream
             )
             response.raise_for_status()
             return response
@@ -98,10 +152,10 @@ class DataPipeline:
                          'see pollscraper --help')
             raise e
         except requests.exceptions.HTTPError as e:
-            logger.error(f'requests.exceptions.HTTPError: {e}')
+            logger.error('requests.exceptions.HTTPError: %s', e)
             raise e
         except requests.exceptions.RequestException as e:
-            logger.error(f'Error fetching HTML: {e}')
+            logger.error('Error fetching HTML: %s', e)
             raise e
 
     def extract_html_table_data(self, table):
@@ -133,8 +187,8 @@ class DataPipeline:
         n_tables = len(tables)
         if n_tables > 1:
             logger.warning('Unexpected URL format - '
-                           f'{n_tables} tables found.'
-                           'Only processing the first table.')
+                           '%s tables found.'
+                           'Only processing the first table.', n_tables)
         table_data = self.extract_html_table_data(tables[0])
         return self.table_data_to_dataframe(table_data)
 
@@ -153,18 +207,46 @@ class DataPipeline:
         try:
             return pd.read_html(html_content)[0]
         except ValueError as ve:
-            logging\
-                .warning(f'Pandas failed to read html content with error {ve}')
+            logger.warning('Pandas failed to read html content with error %s',
+                           ve)
             logger.info('Falling back to BeautifulSoup.')
             return self.parse_html_bs4(html_content)
         except Exception as e:
-            logger.error(f"Error extracting table data: {e}")
+            logger.error('Error extracting table data: %s', e)
             raise e
 
+    def stream_table_rows(self, url, chunk_size=CHUNK_SIZE):
+        """
+        Yield the rows of the first HTML table at a URL as they download.
+
+        Each row is yielded once the chunk holding its end has been read,
+        before the rest of the page has arrived.
+
+        Parameters:
+            url (str): The URL of the HTML page.
+            chunk_size (int, optional): Bytes read at a time.
+
+        Yields:
+            dict: Each row, mapping the table headings to the cell text.
+        """
+        response = self.fetch_html_content(str(url), stream=True)
+        parser = TableRowParser()
+        try:
+            for row in iter_table_rows(response.iter_content(chunk_size),
+                                       response_encoding(response), parser):
+                headings = parser.header[-1] if parser.header \
+                    else range(len(row))
+                yield dict(zip(headings, row))
+        finally:
+            response.close()
+
     def extract_table_data(self, url):
         """
         Extract table data from the given URL.
 
+        The source format is chosen from the URL suffix, falling back to
+        the response `Content-Type`; see `pollscraper.sources`.
+
         Parameters:
             url (str): The URL to fetch and extract data from.
 
@@ -174,15 +256,34 @@ class DataPipeline:
         """
         # OO library to ingest URL string formats (slightly overkill)
         url = URL(url)
-        response = self.fetch_html_content(url)
-        if url.suffix == '.html':
-            table_data = self.parse_html_table(response.content)
-        else:
-            logger.warning(f'Error extracting data from source {url}')
+        # Adapters that read the body incrementally get a streamed
+        # response when the URL already tells which adapter applies
+        adapter = get_source_adapter(url.suffix)
+        stream = True if getattr(adapter, 'streams', False) else None
+        response = self.fetch_html_content(url, stream=stream)
+        return self.read_response(url, response)
+
+    def read_response(self, url, response):
+        """
+        Read the table from a response already fetched from `url`.
+
+        Parameters:
+            url (str): The URL the response was fetched from.
+            response (requests.Response): The HTTP response.
+
+        Returns:
+            pandas.DataFrame: The raw table data.
+        """
+        url = URL(url)
+        headers = getattr(response, 'headers', None) or {}
+        adapter = get_source_adapter(url.suffix, headers.get('Content-Type'))
+        if adapter is None:
+            logger.warning('Error extracting data from source %s', url)
             logger.warning('No protocol yet implemented for '
-                           f'scraping {url.suffix} sources.')
+                           'scraping %s sources.', url.suffix)
             raise ValueError('Undefined URL format.')
-        return table_data
+        logger.debug('Reading source with %s.', type(adapter).__name__)
+        return adapter.read(self, url, response)
 
     def table_data_to_dataframe(self, table_data):
         """
@@ -208,6 +309,10 @@ class DataPipeline:
     def clean_data(self, table_df):
         """_summary_
 
+        Rows are checked against `self.validator` and the violations
+        found are kept in `self.violations`. Republished and revised
+        polls are then removed by `self.deduplicator`.
+
         Parameters:
             table_df (pandas.DataFrame): pandas.DataFrame scraped from
                                          target URL
@@ -217,8 +322,8 @@ class DataPipeline:
         common_headers = list(self.common_header_mapping.keys())
         if not set(common_headers).issubset(table_df.columns):
             logger.error('Table has missing headings!')
-            logger.error('Table columns are: {table_df.columns}')
-            logger.error('Expecting a minimum of {common_headers}')
+            logger.error('Table columns are: %s', list(table_df.columns))
+            logger.error('Expecting a minimum of %s', common_headers)
             raise ValueError('Table has missing headings!')
         candidate_headers = sorted(
                 list(set(table_df.columns)-set(common_headers))
@@ -229,24 +334,20 @@ class DataPipeline:
         missing_values = ["n/a", "na", "--", '**', '', 'NaN', '*']
         table_df.replace(missing_values, np.nan, inplace=True)
 
-        # Remove remaining asterisks
+        # Remove remaining asterisks (columns left empty by the source
+        # are inferred as floats, so cast back to object first)
         for c in expected_headers:
-            table_df[c] = table_df[c].str.rstrip('*')
+            table_df[c] = table_df[c].astype(object).str.rstrip('*')
 
-        # parse dates
+        # parse dates, dating field-period ranges by self.date_anchor
         try:
-            table_df['Date'] = pd.to_datetime(
-                    table_df['Date'], errors='raise', format='%m/%d/%y'
-                )
-        except pd._libs.tslibs.parsing.DateParseError as e:
+            table_df['Date'] = parse_poll_dates(
+                    table_df['Date']
+                )[self.date_anchor]
+        except ValueError as e:
             logger.fatal('Date Time parsing error.')
             raise e
 
-        # Date parsing check
-        invalid_dates = table_df[table_df['Date'].isnull()]
-        if not invalid_dates.empty:
-            logger.warning(f"Invalid dates detected: {invalid_dates}")
-
         # Sort results by date and then alphabetically by Pollster.
         table_df = table_df.sort_values(
                 by=['Date', 'Pollster'], ascending=False
@@ -257,28 +358,22 @@ class DataPipeline:
                                            errors='coerce',
                                            downcast='integer')
 
-        # Sample size validation
-        invalid_samples = table_df[table_df['Sample'] < 10]
-        if not invalid_samples.empty:
-            logger.warning(f"Small sample sizes detected: {invalid_samples}")
-
-        # Calculate and check polling fractions
+        # Convert percentages to fractions
         for c in candidate_headers:
             table_df[c] = table_df[c].str.rstrip('%').astype('float')/100
-        table_df['combined_percentage'] = table_df[candidate_headers]\
-            .sum(axis=1)
 
-        for c in candidate_headers:
-            table_df[c] = table_df[c]
+        # Check dates, sample sizes and vote-shares together, keeping
+        # the violations for inspection
+        table_df, self.violations = self.validator.validate(
+                table_df, candidate_headers
+            )
 
-        checksum = table_df[
-                ~np.isclose(table_df['combined_percentage'], 1, atol=0.02)
-            ].shape[0]
-        if checksum > 0:
-            logger.warning(f'{checksum} Row(s) with unbalanced vote-share')
+        table_df = table_df[expected_headers]\
+            .rename(columns=self.common_header_mapping)
 
-        table_df = table_df[expected_headers]
-        return table_df.rename(columns=self.common_header_mapping)
+        # Drop republished polls and all but the latest revision, which
+        # would otherwise be double-weighted in the trends
+        return self.deduplicator.deduplicate(table_df)
 
 
 def main():
@@ -0,0 +1,274 @@
+"""Source adapters for ingesting poll tables from different formats."""
+import io
+import json
+import re
+import pandas as pd
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup, SoupStrainer
+from pollscraper import logger
+from pollscraper.streaming import read_html_stream
+
+
+# Any tag attribute rel="next", found without parsing the page
+_REL_NEXT = re.compile(rb'\brel\s*=\s*["\']?[^"\'>]*\bnext\b', re.IGNORECASE)
+
+
+class SourceAdapter:
+    """
+    Base class for reading a poll table from a fetched source.
+
+    Adapters turn a `requests.Response` into the raw string table that
+    `DataPipeline.clean_data` expects (source headers such as `Date`,
+    `Pollster` and `Sample`, with every cell held as a string).
+
+    Attributes:
+        suffixes (tuple): URL suffixes handled by the adapter.
+        content_types (tuple): MIME types handled by the adapter.
+        max_pages (int): Maximum number of pages followed when a source
+                         is paginated.
+        streams (bool): Whether pages are always fetched with
+                        `stream=True`, leaving the body to be read
+                        incrementally by `read_page`. Otherwise pages
+                        only stream when the pipeline does.
+    """
+
+    suffixes = ()
+    content_types = ()
+    max_pages = 50
+    streams = False
+
+    def read(self, pipeline, url, response):
+        """
+        Read the table from a response, following pagination links.
+
+        Parameters:
+            pipeline (DataPipeline): Pipeline used to fetch further pages.
+            url (str): The URL the response was fetched from.
+            response (requests.Response): The HTTP response.
+
+        Returns:
+            pandas.DataFrame: The raw table data.
+        """
+        frames = []
+        seen = {str(url)}
+        while True:
+            frame, next_url = self.read_page(pipeline, response)
+            frames.append(frame)
+            if next_url is None:
+                break
+            next_url = urljoin(str(url), next_url)
+            if next_url in seen or len(frames) >= self.max_pages:
+                logger.warning('Stopped following pagination at %s',
+                               next_url)
+                break
+            seen.add(next_url)
+            logger.debug('Following pagination link to %s', next_url)
+            url = next_url
+            response = pipeline.fetch_html_content(
+                next_url, stream=True if self.streams else None
+            )
+        if len(frames) > 1:
+            frames = [pd.concat(frames, ignore_index=True)]
+        return as_string_table(frames[0])
+
+    def read_page(self, pipeline, response):
+        """
+        Read a single page of a source.
+
+        Parameters:
+            pipeline (DataPipeline): The calling pipeline.
+            response (requests.Response): The HTTP response.
+
+        Returns:
+            tuple: The page as a pandas.DataFrame and the URL of the next
+            page, or None when there is no further page.
+        """
+        raise NotImplementedError
+
+
+class HTMLSource(SourceAdapter):
+    """
+    Read the first table on an HTML page, following `rel="next"`.
+
+    Pages are parsed as they download when the pipeline streams, see
+    `streaming.read_html_stream`.
+    """
+
+    suffixes = ('.html', '.htm')
+    content_types = ('text/html', 'application/xhtml+xml')
+
+    def read_page(self, pipeline, response):
+        if getattr(pipeline, 'stream', False):
+            return read_html_stream(response)
+        frame = pipeline.parse_html_table(response.content)
+        return frame, self.next_page(response)
+
+    @staticmethod
+    def next_page(response):
+        """
+        Find the next page from the `Link` header or a `rel="next"` tag.
+
+        The page is only parsed for the tag when a scan of its bytes
+        finds a `rel="next"` attribute, which most pages lack.
+
+        Parameters:
+            response (requests.Response): The HTTP response.
+
+        Returns:
+            str or None: The (possibly relative) URL of the next page.
+        """
+        links = getattr(response, 'links', None) or {}
+        if 'next' in links:
+            return links['next'].get('url')
+        if not _REL_NEXT.search(response.content):
+            return None
+        # Only build a tree of the anchor/link tags, not the whole page.
+        strainer = SoupStrainer(['a', 'link'], rel='next')
+        soup = BeautifulSoup(response.content, 'html.parser',
+                             parse_only=strainer)
+        tag = soup.find(href=True)
+        return tag['href'] if tag is not None else None
+
+
+class CSVSource(SourceAdapter):
+    """Read a CSV download with every column held as a string."""
+
+    suffixes = ('.csv',)
+    content_types = ('text/csv', 'application/csv')
+
+    def read_page(self, pipeline, response):
+        # Explicit string dtypes skip type inference; clean_data parses.
+        frame = pd.read_csv(io.BytesIO(response.content), dtype=str,
+                            keep_default_na=False, engine='c')
+        frame = restore_source_headers(frame, pipeline)
+        links = getattr(response, 'links', None) or {}
+        return frame, links.get('next', {}).get('url')
+
+
+class JSONSource(SourceAdapter):
+    """
+    Read a JSON document of poll records.
+
+    The document is either a list of records, or an object holding the
+    records under one of `record_keys` with an optional `next` link.
+    """
+
+    suffixes = ('.json',)
+    content_types = ('application/json',)
+    record_keys = ('polls', 'data', 'results', 'records')
+
+    def read_page(self, pipeline, response):
+        document = response.json()
+        next_url = None
+        if isinstance(document, dict):
+            next_url = document.get('next')
+            for key in self.record_keys:
+                if key in document:
+                    document = document[key]
+                    break
+            else:
+                raise ValueError('No poll records found in JSON source.')
+        links = getattr(response, 'links', None) or {}
+        next_url = next_url or links.get('next', {}).get('url')
+        return records_to_frame(document, pipeline), next_url
+
+
+class JSONLinesSource(SourceAdapter):
+    """
+    Read newline-delimited JSON records a line at a time.
+
+    Sources found by their URL suffix are fetched with `stream=True`, so
+    the records are decoded as the body downloads rather than after it
+    has been buffered. Sources only recognised by their content type
+    have already been read in full when the adapter is chosen.
+    """
+
+    suffixes = ('.jsonl', '.ndjson')
+    content_types = ('application/x-ndjson', 'application/jsonl',
+                     'application/json-seq')
+    streams = True
+
+    def read_page(self, pipeline, response):
+        decode = json.JSONDecoder().decode
+        records = [
+            decode(line.decode('utf-8') if isinstance(line, bytes) else line)
+            for line in response.iter_lines() if line.strip()
+        ]
+        links = getattr(response, 'links', None) or {}
+        return (records_to_frame(records, pipeline),
+                links.get('next', {}).get('url'))
+
+
+def restore_source_headers(frame, pipeline):
+    """
+    Map cleaned column names (`date`, `pollster`, `n`) back to the
+    source headers expected by `clean_data`.
+    """
+    inverse = {v: k for k, v in pipeline.common_header_mapping.items()}
+    return frame.rename(columns=inverse)
+
+
+def records_to_frame(records, pipeline):
+    """
+    Convert a list of JSON records into a table.
+
+    Parameters:
+        records (list): A list of mappings, one per poll.
+        pipeline (DataPipeline): The calling pipeline.
+
+    Returns:
+        pandas.DataFrame: The raw table data.
+    """
+    if not isinstance(records, list):
+        raise ValueError('Expected a list of poll records.')
+    frame = pd.DataFrame.from_records(records)
+    return restore_source_headers(frame, pipeline)
+
+
+def as_string_table(frame):
+    """
+    Hold every cell as a string, as `clean_data` expects, whatever types
+    the reader inferred. Missing values become empty strings.
+    """
+    return frame.astype(object).where(frame.notna(), '').astype(str)
+
+
+# Adapters are tried in order; see register_source.
+SOURCE_ADAPTERS = [HTMLSource(), CSVSource(), JSONSource(), JSONLinesSource()]
+
+
+def register_source(adapter):
+    """
+    Register a source adapter, taking priority over existing adapters.
+
+    Parameters:
+        adapter (SourceAdapter): The adapter instance to register.
+
+    Returns:
+        SourceAdapter: The registered adapter.
+    """
+    SOURCE_ADAPTERS.insert(0, adapter)
+    return adapter
+
+
+def get_source_adapter(suffix, content_type=None):
+    """
+    Look up the adapter for a source by URL suffix, then content type.
+
+    Parameters:
+        suffix (str): The URL suffix, e.g. `.html`.
+        content_type (str, optional): The response `Content-Type` header.
+
+    Returns:
+        SourceAdapter or None: The matching adapter, if any.
+    """
+    suffix = (suffix or '').lower()
+    for adapter in SOURCE_ADAPTERS:
+        if suffix and suffix in adapter.suffixes:
+            return adapter
+    if content_type:
+        mime = content_type.split(';')[0].strip().lower()
+        for adapter in SOURCE_ADAPTERS:
+            if mime in adapter.content_types:
+                return adapter
+    return None
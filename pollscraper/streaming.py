@@ -0,0 +1,342 @@
+"""Incremental parsing of HTML tables from streamed responses."""
+import codecs
+import re
+from html.parser import HTMLParser
+from pandas.io.parsers import TextParser
+from pollscraper import logger
+
+
+# Bytes read from the response at a time
+CHUNK_SIZE = 64 * 2**10
+
+# Whitespace collapsed within cells, as by `pandas.read_html`
+_WHITESPACE = re.compile(r'[\r\n]+|\s{2,}')
+
+_SECTIONS = ('thead', 'tbody', 'tfoot')
+
+# A charset declared by `<meta charset>` or `<meta http-equiv>`, looked
+# for in the first bytes of a page as browsers do
+_SNIFF_BYTES = 1024
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)',
+                           re.IGNORECASE)
+
+
+class TableRowParser(HTMLParser):
+    """
+    Incremental parser for the rows of the first table in a document.
+
+    Feed it the document in pieces with `feed`; each row is available
+    from `pop_rows` as soon as it is closed, so rows can be processed
+    while the rest of the document is still downloading. Only the rows
+    are kept, never the document or a tree of it.
+
+    Rows follow the layout read by `pandas.read_html`: cells outside of
+    a `<tr>` form a row of their own, cell text has its whitespace
+    collapsed, `<tfoot>` rows come last, and cells spanning several
+    columns or rows are repeated in each of them. Rows that only exist
+    because of a row span are emitted when their section ends.
+
+    Attributes:
+        header (list): Header rows, from `<thead>` or from the rows of
+                       only `<th>` cells opening the table.
+        n_tables (int): Number of top-level tables seen so far.
+        next_url (str): Target of the first `rel="next"` link, if any.
+        table_closed (bool): Whether the first table has ended.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.header = []
+        self.n_tables = 0
+        self.next_url = None
+        self.table_closed = False
+        self._rows = []
+        self._footer = []
+        self._depth = 0
+        self._section = None
+        self._body_started = False
+        self._row = None
+        self._row_headings = True
+        self._cell = None
+        self._span = (1, 1)
+        # Cells spanning into later rows of each section, as (column,
+        # text, rows left)
+        self._remainders = {'header': [], 'body': [], 'footer': []}
+
+    @property
+    def in_table(self):
+        return self._depth == 1 and self.n_tables == 1
+
+    def pop_rows(self):
+        """
+        Take the body rows completed since the last call.
+
+        Returns:
+            list: The rows, each a list of cell strings.
+        """
+        rows, self._rows = self._rows, []
+        return rows
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('a', 'link') and self.next_url is None:
+            attrs = dict(attrs)
+            rel = (attrs.get('rel') or '').lower().split()
+            if 'next' in rel and attrs.get('href'):
+                self.next_url = attrs['href']
+        if tag == 'table':
+            if self._depth == 0:
+                self.n_tables += 1
+            self._depth += 1
+            return
+        if not self.in_table:
+            return
+        if tag in _SECTIONS:
+            self._end_row()
+            self._section = tag
+        elif tag == 'tr':
+            self._end_row()
+            self._start_row()
+        elif tag in ('td', 'th'):
+            self._end_cell()
+            if self._row is None:
+                self._start_row()
+            self._row_headings &= tag == 'th'
+            self._cell = []
+            attrs = dict(attrs)
+            self._span = (_span(attrs.get('rowspan')),
+                          _span(attrs.get('colspan')))
+
+    def handle_endtag(self, tag):
+        if tag == 'table':
+            if self.in_table:
+                self._end_row()
+                self.header.extend(self._flush('header'))
+                self._rows.extend(self._flush('body'))
+                self._rows.extend(self._footer + self._flush('footer'))
+                self._footer = []
+                self.table_closed = True
+            self._depth = max(self._depth - 1, 0)
+            return
+        if not self.in_table:
+            return
+        if tag in ('td', 'th'):
+            self._end_cell()
+        elif tag == 'tr':
+            self._end_row()
+        elif tag in _SECTIONS:
+            self._end_row()
+            self._section = None
+
+    def handle_data(self, data):
+        if self._cell is not None and self.in_table:
+            self._cell.append(data)
+
+    def _start_row(self):
+        self._row = []
+        self._row_headings = True
+
+    def _end_cell(self):
+        if self._cell is not None:
+            text = _WHITESPACE.sub(' ', ''.join(self._cell).strip())
+            self._row.append((text,) + self._span)
+            self._cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        cells, self._row = self._row, None
+        if cells is None:
+            return
+        if self._section == 'thead' or (
+                self._section != 'tfoot' and self._row_headings and
+                not self._body_started and cells):
+            section = 'header'
+        elif self._section == 'tfoot':
+            section = 'footer'
+        else:
+            section = 'body'
+        row = self._expand(cells, section)
+        if not row:
+            return
+        if section == 'header':
+            self.header.append(row)
+        elif section == 'footer':
+            self._footer.append(row)
+        else:
+            if not self._body_started:
+                self.header.extend(self._flush('header'))
+            self._body_started = True
+            self._rows.append(row)
+
+    def _expand(self, cells, section):
+        """Repeat spanning cells, as `read_html` does."""
+        remainder = self._remainders[section]
+        row = []
+        spans = []
+        for text, rowspan, colspan in cells:
+            # Cells spanning down from earlier rows come before this one
+            while remainder and remainder[0][0] <= len(row):
+                spans.append(remainder.pop(0))
+                row.append(spans[-1][1])
+            for _ in range(colspan):
+                if rowspan > 1:
+                    spans.append((len(row), text, rowspan))
+                row.append(text)
+        spans.extend(remainder)
+        row.extend(text for _, text, _ in remainder)
+        self._remainders[section] = [(column, text, rows - 1)
+                                     for column, text, rows in spans
+                                     if rows > 1]
+        return row
+
+    def _flush(self, section):
+        """Rows made only of cells spanning past a section's last row."""
+        rows = []
+        while self._remainders[section]:
+            rows.append(self._expand([], section))
+        return rows
+
+
+def _span(value):
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def meta_charset(data):
+    """
+    Encoding declared by a `<meta>` tag near the start of a document.
+
+    Parameters:
+        data (bytes): The start of the document.
+
+    Returns:
+        str or None: The name of the encoding, if one is declared and
+        known to Python.
+    """
+    match = _META_CHARSET.search(data)
+    if match is None:
+        return None
+    try:
+        return codecs.lookup(match.group(1).decode('ascii')).name
+    except LookupError:
+        return None
+
+
+def iter_table_rows(chunks, encoding=None, parser=None):
+    """
+    Yield the rows of the first table as the document arrives.
+
+    Parameters:
+        chunks (iterable): Pieces of the document, as bytes or str, e.g.
+                           `response.iter_content(CHUNK_SIZE)`.
+        encoding (str, optional): Encoding of byte chunks. Defaults to
+                                  a `<meta charset>` in the first 1024
+                                  bytes, as `read_html` honours it, or
+                                  else UTF-8.
+        parser (TableRowParser, optional): Parser to feed, to read its
+                                           header and links afterwards.
+
+    Yields:
+        list: Each body row, as a list of cell strings.
+    """
+    parser = TableRowParser() if parser is None else parser
+    head = b''
+
+    def get_decoder():
+        return codecs.getincrementaldecoder(
+            encoding or meta_charset(head) or 'utf-8'
+        )(errors='replace')
+
+    # Only hold back the start of the page to look for its encoding
+    decoder = get_decoder() if encoding else None
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            if decoder is None:
+                head += chunk
+                if len(head) < _SNIFF_BYTES:
+                    continue
+                decoder = get_decoder()
+                chunk = head
+            chunk = decoder.decode(chunk)
+        parser.feed(chunk)
+        yield from parser.pop_rows()
+    if decoder is None and head:
+        decoder = get_decoder()
+        parser.feed(decoder.decode(head))
+    if decoder is not None:
+        parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.pop_rows()
+
+
+def rows_to_frame(header, rows):
+    """
+    Build a table from parsed rows, inferring types as `read_html` does.
+
+    Parameters:
+        header (list): Header rows.
+        rows (list): Body rows.
+
+    Returns:
+        pandas.DataFrame: The table.
+    """
+    body = header + rows
+    width = max((len(row) for row in body), default=0)
+    for row in body:
+        row.extend([''] * (width - len(row)))
+    if len(header) > 1:
+        columns = [i for i, row in enumerate(header) if any(row)]
+    else:
+        columns = 0 if header else None
+    with TextParser(body, header=columns, thousands=',') as parser:
+        return parser.read()
+
+
+def response_encoding(response):
+    """
+    Encoding of a response's body, from its `Content-Type` header.
+
+    Unlike `requests`, a text type without a charset is not taken to be
+    ISO-8859-1: None is returned, leaving `iter_table_rows` to find the
+    encoding in the page itself.
+    """
+    headers = getattr(response, 'headers', None) or {}
+    if 'charset=' in headers.get('Content-Type', '').lower() and \
+            response.encoding:
+        return response.encoding
+    return None
+
+
+def read_html_stream(response, chunk_size=CHUNK_SIZE):
+    """
+    Read the first table of a streamed HTML response.
+
+    The body is parsed chunk by chunk as it downloads, so the whole body
+    is never held in memory.
+
+    Parameters:
+        response (requests.Response): A response fetched with
+                                      `stream=True`.
+        chunk_size (int, optional): Bytes read at a time. Defaults to
+                                    `CHUNK_SIZE`.
+
+    Returns:
+        tuple: The table as a pandas.DataFrame, and the (possibly
+        relative) URL of the next page, or None.
+    """
+    parser = TableRowParser()
+    try:
+        rows = list(iter_table_rows(response.iter_content(chunk_size),
+                                    response_encoding(response), parser))
+    finally:
+        response.close()
+    if not parser.n_tables:
+        logger.warning('No table found on the website.')
+        raise ValueError('No tables found')
+    if parser.n_tables > 1:
+        logger.warning('Unexpected URL format - %s tables found.'
+                       'Only processing the first table.', parser.n_tables)
+    links = getattr(response, 'links', None) or {}
+    next_url = links.get('next', {}).get('url') or parser.next_url
+    return rows_to_frame(parser.header, rows), next_url
@@ -1,6 +1,11 @@
 import pandas as pd
 import numpy as np
 from pollscraper import logger
+from pollscraper.cache import ResultCache, fingerprint_frame
+from pollscraper.codes import PollMatrix
+from pollscraper.kalman import KalmanTrend
+from pollscraper.kernels import get_kernels
+from pollscraper.rolling import rolling_weighted_stats
 from pandas.api.types import is_datetime64_any_dtype as is_datetime
 from pandas.tseries.frequencies import to_offset
 from datetime import datetime
@@ -29,6 +34,7 @@ class Weighting:
                     'Dataland Register-Gazette': 1.,
                     'Proudly Paid For Polling': 1.,
                     'Electropolis Elects': 1.}
+        self._pollster_factors = None
 
     def modality_factor(self, sample_weights, modality_col):
         map = self.modality_factor_weights
@@ -51,11 +57,33 @@ class Weighting:
         sample_weights *= population_col.map(map).fillna(1)
 
     def pollster_factor(self, sample_weights, pollster_col):
-        map = self.pollster_factor_weights
         if type(pollster_col) is NoneTypeOverload: # noqa E721
             return
         assert type(pollster_col) is pd.Series
-        sample_weights *= pollster_col.map(map).fillna(1)
+        names, factors = self.pollster_factors()
+        # Unknown pollsters (-1) pick the trailing factor of 1
+        sample_weights *= factors[names.get_indexer(pollster_col)]
+
+    def pollster_factors(self):
+        """
+        The pollster factors as a lookup table, built once.
+
+        The table is only rebuilt when `pollster_factor_weights` has
+        been changed since it was last built.
+
+        Returns:
+            tuple: The pollster names as a pandas.Index, and their
+            factors followed by the factor of unknown pollsters.
+        """
+        weights = self.pollster_factor_weights
+        if self._pollster_factors is None or \
+                self._pollster_factors[0] != weights:
+            self._pollster_factors = (
+                dict(weights), pd.Index(list(weights), dtype=object),
+                np.append(np.asarray(list(weights.values()), dtype=float),
+                          1.)
+            )
+        return self._pollster_factors[1:]
 
     def sample_size_factor(self, sample_weights, sample_col):
         if type(sample_col) is NoneTypeOverload: # noqa E721
@@ -95,6 +123,192 @@ def check_offset(offset):
         raise e
 
 
+ESTIMATORS = ('rolling', 'kalman')
+
+
+def get_estimator(estimator, sample_periodicity):
+    """
+    Set up a trend estimator for the given periodicity.
+
+    Parameters:
+        estimator (str or KalmanTrend): 'rolling' for the rolling mean,
+                                        'kalman' for a `KalmanTrend` with
+                                        default settings, or a configured
+                                        `KalmanTrend`, which is copied
+                                        rather than fitted in place.
+        sample_periodicity (str): The periodicity of the trends.
+
+    Returns:
+        KalmanTrend: An unfitted estimator, or None for the rolling mean.
+    """
+    if isinstance(estimator, KalmanTrend):
+        return estimator.with_periodicity(sample_periodicity)
+    if estimator not in ESTIMATORS:
+        raise ValueError(f'Unknown estimator {estimator}.')
+    if estimator == 'kalman':
+        return KalmanTrend(sample_periodicity=sample_periodicity)
+    return None
+
+
+class SparseTrends:
+    """
+    Trend series stored over each candidate's active span only.
+
+    Candidates who are only polled for part of the history hold values
+    for the dates between their first and last polls (extended by the
+    rolling window) rather than for the whole date range. The dense
+    trends frame is only built on request, by `to_dense`.
+
+    Attributes:
+        index (pandas.DatetimeIndex): The full date grid of the trends.
+        spans (dict): Maps each candidate to the position of its span in
+                      `index` and the array of trend values over it.
+    """
+
+    def __init__(self, index) -> None:
+        self.index = index
+        self.spans = {}
+
+    @property
+    def candidates(self):
+        return list(self.spans)
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for _, values in self.spans.values())
+
+    def add(self, candidate, series):
+        """
+        Store the trend of a candidate.
+
+        Parameters:
+            candidate (str): The candidate name.
+            series (pandas.Series): Trend values indexed by a contiguous
+                                    run of dates from `index`.
+        """
+        start = self.index.get_indexer(series.index[:1])[0] \
+            if not series.empty else 0
+        self.spans[candidate] = (start, series.to_numpy(dtype=float))
+
+    def __getitem__(self, candidate):
+        start, values = self.spans[candidate]
+        return pd.Series(values, index=self.index[start:start + len(values)],
+                         name=candidate)
+
+    def to_dense(self):
+        """
+        Expand to the trends frame returned by `PollTrend.calculate_trends`.
+
+        Returns:
+            pandas.DataFrame:
+                DataFrame containing trends for each candidate, with
+                candidates sorted by their latest average.
+        """
+        dense = np.full((len(self.index), len(self.spans)), np.nan)
+        for i, (start, values) in enumerate(self.spans.values()):
+            dense[start:start + len(values), i] = values
+        return dense_trends(dense, self.index, self.candidates)
+
+
+def dense_trends(values, index, candidates):
+    """
+    Lay out trend values as the frame returned by `calculate_trends`.
+
+    Parameters:
+        values (numpy.ndarray): Trend values, dates by candidates.
+        index (pandas.DatetimeIndex): Descending dates of the rows.
+        candidates (list): Candidate of each column.
+
+    Returns:
+        pandas.DataFrame:
+            DataFrame with a date column followed by one column of trends
+            per candidate, with candidates sorted by their latest average.
+    """
+    trends = pd.DataFrame(values, index=index, columns=candidates)
+    trends.index.name = 'date'
+    # Sort columns so that they are in descending order from latest poll
+    latest = trends.first_valid_index()
+    if latest is not None:
+        trends.sort_values(latest, axis=1, inplace=True, ascending=False)
+    trends.reset_index(inplace=True)
+    return trends
+
+
+class ResampledPolls:
+    """
+    Weighted poll sums for each candidate and sampling period.
+
+    Holding sums rather than averages means periods can be merged by
+    adding them up, see `rollup`. This is the expensive stage of
+    `calculate_trends`; it does not depend on the rolling window or
+    outlier settings.
+
+    Attributes:
+        polls (pandas.DataFrame): The weighted polls, indexed by date.
+        date_range (pandas.DatetimeIndex): Descending grid of output dates.
+        start_date (pandas.Timestamp): First date of the output grid.
+        end_date (pandas.Timestamp): Last date of the output grid.
+        weighted_sums (pandas.DataFrame): Sum of share times weight for
+                                          each period and candidate.
+        weight_totals (pandas.Series): Sum of the weights of every poll in
+                                       each period.
+        n_polled (pandas.DataFrame): Number of polls including each
+                                     candidate in each period.
+    """
+
+    def __init__(self, polls, start_date, end_date, sample_periodicity,
+                 weighted_sums, weight_totals, n_polled) -> None:
+        self.polls = polls
+        self.sample_periodicity = sample_periodicity
+        self.start_date = start_date
+        self.end_date = end_date
+        self.date_range = pd.date_range(
+                start=start_date, end=end_date, freq=sample_periodicity
+            )[::-1]
+        self.weighted_sums = weighted_sums
+        self.weight_totals = weight_totals
+        self.n_polled = n_polled
+
+    @property
+    def candidates(self):
+        return list(self.weighted_sums.columns)
+
+    @property
+    def averages(self):
+        """Weighted average share of each candidate in each period."""
+        return self.weighted_sums.div(self.weight_totals, axis=0)
+
+    def rollup(self, sample_periodicity):
+        """
+        Merge the periods into coarser ones, e.g. days into weeks.
+
+        The result matches resampling the polls at the coarser
+        periodicity directly, provided each of the current periods falls
+        within one of the coarser periods.
+
+        Args:
+            sample_periodicity (str): The coarser periodicity.
+
+        Returns:
+            ResampledPolls: The weighted sums for each coarser period.
+        """
+        check_offset(sample_periodicity)
+        grouper = pd.Grouper(freq=sample_periodicity)
+        return ResampledPolls(
+            self.polls, self.start_date, self.end_date, sample_periodicity,
+            self.weighted_sums.groupby(grouper).sum(),
+            self.weight_totals.groupby(grouper).sum(),
+            self.n_polled.groupby(grouper).sum()
+        )
+
+    @property
+    def nbytes(self):
+        return int(sum(
+            frame.memory_usage(deep=True).sum()
+            for frame in (self.polls, self.weighted_sums, self.n_polled)
+        ) + self.weight_totals.memory_usage(deep=True))
+
+
 class PollTrend:
     """
     Represents poll trends and provides methods to calculate trends.
@@ -109,14 +323,37 @@ class PollTrend:
     def calculate_trends(cls, poll_data, n_sigma=5,
                          weights_col=None, sample_periodicity='1D',
                          rolling_average_window='7D',
-                         start_date=datetime(2023, 10, 11)):
+                         start_date=datetime(2023, 10, 11),
+                         sparse=False, cache=None, backend='numpy',
+                         estimator='rolling'):
         # WARNING - START DATE MUST BE SET TO NONE - FIX IN FUTURE
         # modality_col='', sponsor_col='', population_col=''):
         """
         Calculate poll trends based on poll data.
 
+        Each candidate's trend is only computed over their active span,
+        from their first poll to a rolling window after their last.
+
         Args:
             poll_data (PollData): Poll data containing poll information.
+            sparse (bool, optional): Return the trends as `SparseTrends`
+                                     rather than a dense DataFrame.
+                                     Defaults to False.
+            cache (ResultCache, optional): Cache of results keyed by a
+                                           fingerprint of `poll_data` and
+                                           the parameters. The resampled
+                                           polls are cached too, and
+                                           shared between calls with
+                                           different windows or n_sigma.
+            backend (str, optional): Kernel backend for the aggregation,
+                                     rolling statistics and outlier
+                                     checks: 'numpy', 'numba' or 'auto';
+                                     see `kernels.get_kernels`. Defaults
+                                     to 'numpy'.
+            estimator (str or KalmanTrend, optional): 'rolling' for a
+                rolling weighted mean, or 'kalman' (or a configured
+                `KalmanTrend`) for a smoothed state-space average. Both
+                give the same output layout. Defaults to 'rolling'.
 
         Returns:
             pandas.DataFrame:
@@ -127,6 +364,131 @@ class PollTrend:
         if not is_datetime(poll_data['date']):
             raise ValueError('Preprocessing step has been missed. '
                              'Date column incorrectly formatted')
+        backend = get_kernels(backend)
+        if cache is None:
+            resampled = cls.resample_polls(poll_data, weights_col,
+                                           sample_periodicity, start_date,
+                                           backend)
+            return cls.trends_from_resampled(resampled, n_sigma,
+                                             rolling_average_window, sparse,
+                                             backend, estimator)
+
+        resample_key = cls.resample_key(poll_data, weights_col,
+                                        sample_periodicity, start_date)
+        trends_key = cache.key('trends', resample_key, n_sigma,
+                               rolling_average_window, sparse, estimator)
+        result = cache.get(trends_key)
+        if result is not None:
+            logger.info('Rolling averages loaded from cache.')
+            return result
+        resampled = cls.cached_resample_polls(poll_data, weights_col,
+                                              sample_periodicity, start_date,
+                                              cache, resample_key, backend)
+        result = cls.trends_from_resampled(resampled, n_sigma,
+                                           rolling_average_window, sparse,
+                                           backend, estimator)
+        cache.set(trends_key, result)
+        return result
+
+    @classmethod
+    def calculate_multi_resolution_trends(
+                cls, poll_data, resolutions=('1D', 'W', 'MS'), n_sigma=5,
+                weights_col=None, rolling_average_window='7D',
+                start_date=datetime(2023, 10, 11), base_periodicity='1D',
+                sparse=False, cache=None, backend='numpy',
+                estimator='rolling'
+            ):
+        """
+        Calculate poll trends at several resolutions in one call.
+
+        The polls are resampled once, at `base_periodicity`, and the
+        weighted sums are rolled up into each coarser resolution rather
+        than resampling the polls again. Each resolution gives the same
+        result as `calculate_trends` with that `sample_periodicity`.
+
+        Args:
+            poll_data (PollData): Poll data containing poll information.
+            resolutions (iterable, optional): Output periodicities, each
+                                              a multiple of
+                                              `base_periodicity`.
+            rolling_average_window (str or dict, optional): The rolling
+                window, or a mapping from each resolution to its window.
+            base_periodicity (str, optional): The finest periodicity, which
+                                              every resolution is rolled
+                                              up from. Defaults to '1D'.
+
+        Returns:
+            dict: Maps each resolution to its trends, outlying poll
+            averages and outlying polls, as from `calculate_trends`.
+        """
+        check_offset(base_periodicity)
+        if not is_datetime(poll_data['date']):
+            raise ValueError('Preprocessing step has been missed. '
+                             'Date column incorrectly formatted')
+        backend = get_kernels(backend)
+        if cache is None:
+            base = cls.resample_polls(poll_data, weights_col,
+                                      base_periodicity, start_date, backend)
+        else:
+            base = cls.cached_resample_polls(poll_data, weights_col,
+                                             base_periodicity, start_date,
+                                             cache, backend=backend)
+        results = {}
+        for resolution in resolutions:
+            window = rolling_average_window.get(resolution, '7D') \
+                if isinstance(rolling_average_window, dict) \
+                else rolling_average_window
+            check_offset(window)
+            resampled = base if resolution == base_periodicity \
+                else base.rollup(resolution)
+            results[resolution] = cls.trends_from_resampled(
+                resampled, n_sigma, window, sparse, backend, estimator
+            )
+        return results
+
+    @classmethod
+    def resample_key(cls, poll_data, weights_col, sample_periodicity,
+                     start_date):
+        """Cache key of the resampled polls for the given settings."""
+        return ResultCache.key('resample', fingerprint_frame(poll_data),
+                               weights_col, sample_periodicity, start_date)
+
+    @classmethod
+    def cached_resample_polls(cls, poll_data, weights_col,
+                              sample_periodicity, start_date, cache,
+                              resample_key=None, backend='numpy'):
+        """
+        Resample the polls, reusing the result from `cache` if present.
+
+        Returns:
+            ResampledPolls: The weighted sums for each period.
+        """
+        if resample_key is None:
+            resample_key = cls.resample_key(poll_data, weights_col,
+                                            sample_periodicity, start_date)
+        # The resampled polls are only read, so share them uncopied
+        resampled = cache.get(resample_key, copy_value=False)
+        if resampled is None:
+            resampled = cls.resample_polls(poll_data, weights_col,
+                                           sample_periodicity, start_date,
+                                           backend)
+            cache.set(resample_key, resampled, copy_value=False)
+        return resampled
+
+    @classmethod
+    def resample_polls(cls, poll_data, weights_col=None,
+                       sample_periodicity='1D',
+                       start_date=datetime(2023, 10, 11),
+                       backend='numpy'):
+        """
+        Sum the weighted polls of every candidate in each period.
+
+        Args:
+            poll_data (PollData): Poll data containing poll information.
+
+        Returns:
+            ResampledPolls: The weighted sums for each period.
+        """
         poll_data = poll_data.sort_values(by='date', ascending=False)
         if type(weights_col) is NoneTypeOverload: # noqa E721
             weights_col = 'weights'
@@ -141,84 +503,154 @@ class PollTrend:
         try:
             start_date = pd.to_datetime(start_date)
         except Exception:
-            logger.warning(f'Invalid startdate - {start_date}'
-                           f'Overriding with the min date -'
-                           f"{poll_data['date'].min()}")
+            logger.warning('Invalid startdate - %s'
+                           'Overriding with the min date -'
+                           '%s', start_date, poll_data['date'].min())
             start_date = None
         if start_date is None:
             start_date = poll_data['date'].min()
         end_date = poll_data['date'].max()
-        date_range = pd.date_range(
-                start=start_date, end=end_date, freq=sample_periodicity
-            )[::-1]
         poll_data.set_index('date', inplace=True)
 
-        # Initialize an empty DataFrame to store trends
-        trends = pd.DataFrame(index=date_range)
+        # Sum every candidate's weighted shares in each period, in one
+        # pass over the integer-keyed share matrix
+        matrix = PollMatrix.from_frame(poll_data, candidate_cols)
+        bins, periods = matrix.period_bins(sample_periodicity)
+        sums, weight_totals, n_polled = matrix.binned_sums(
+                bins, len(periods), poll_data[weights_col].to_numpy(),
+                backend
+            )
+        columns = pd.Index(candidate_cols)
+        return ResampledPolls(
+            poll_data, start_date, end_date, sample_periodicity,
+            pd.DataFrame(sums, index=periods, columns=columns),
+            pd.Series(weight_totals, index=periods, name=weights_col),
+            pd.DataFrame(n_polled, index=periods, columns=columns)
+        )
+
+    @classmethod
+    def trends_from_resampled(cls, resampled_polls, n_sigma=5,
+                              rolling_average_window='7D', sparse=False,
+                              backend='numpy', estimator='rolling'):
+        """
+        Calculate rolling average trends from resampled polls.
+
+        With the Kalman estimator, the trend is the smoothed share, and
+        the outlier band combines its uncertainty with the sampling error
+        of a typical poll.
+
+        Args:
+            resampled_polls (ResampledPolls): Output of `resample_polls`.
+            estimator (str or KalmanTrend, optional): See
+                                                     `calculate_trends`.
+
+        Returns:
+            tuple: The trends, and the outlying poll averages and polls.
+        """
+        poll_data = resampled_polls.polls
+        date_range = resampled_polls.date_range
+        resampled = resampled_polls.averages
+        n_polled = resampled_polls.n_polled
+        window = pd.to_timedelta(to_offset(rolling_average_window))
+        kalman = get_estimator(estimator, resampled_polls.sample_periodicity)
+        if kalman is not None:
+            weights_col = resampled_polls.weight_totals.name
+            kalman.fit(poll_data, resampled_polls.candidates,
+                       poll_data[weights_col].to_numpy())
+            smoothed, smoothed_sd = kalman.smooth()
+
+        trends = SparseTrends(date_range)
         outliers_avg = pd.DataFrame()
         outliers_poll = pd.DataFrame()
-        # Calculate average on each day and calculate
-        # rolling average trends for each candidate
-        for candidate in candidate_cols:
-            weighted_candidate = poll_data[[candidate, weights_col]]
-            resampled_candidates = weighted_candidate.groupby(
-                    pd.Grouper(freq=sample_periodicity)
-                ).apply(wavg)
-            resampled_candidates.replace(0, np.nan, inplace=True)
+        # Calculate rolling average trends for each candidate
+        # over the periods in which they were polled
+        for candidate in resampled_polls.candidates:
+            polled = n_polled.index[n_polled[candidate] > 0]
+            if polled.empty:
+                trends.add(candidate, pd.Series(dtype=float))
+                continue
+            resampled_candidates = resampled.loc[
+                    polled.min():polled.max(), candidate
+                ].replace(0, np.nan)
             problems = resampled_candidates[
                     (resampled_candidates > 1.) |
                     (resampled_candidates < 0.)
                 ]
             if problems.shape[0] > .05 * resampled_candidates.shape[0]:
                 logger.warning('Imbalance after re-weighting.')
+            # Restrict the grid to the candidate's active span, which
+            # runs on for a window after their last poll.
+            span = date_range[(date_range >= polled.min()) &
+                              (date_range <= polled.max() + window)]
             # Ensure there are no missing date stamps
-            candidate_data = resampled_candidates.reindex(date_range)
+            candidate_data = resampled_candidates.reindex(span)
 
-            # Invert for left aligned windows, then restore
-            rolling_avg = candidate_data[::-1].rolling(
-                rolling_average_window).mean()[::-1]
-            rolling_std = candidate_data[::-1].rolling(
-                rolling_average_window).std()[::-1]
+            if kalman is None:
+                # Trailing windows over the polled periods, evaluated on
+                # the (descending) span in one pass
+                observed = resampled_candidates.dropna()
+                mean, std, _ = rolling_weighted_stats(
+                    observed.index, observed.to_numpy(),
+                    rolling_average_window, eval_times=span[::-1],
+                    backend=backend
+                )
+                rolling_avg = pd.Series(mean[::-1], index=span)
+                rolling_std = pd.Series(std[::-1], index=span)
+            else:
+                rolling_avg = smoothed[candidate].reindex(span)
+                rolling_std = np.sqrt(
+                    smoothed_sd[candidate].reindex(span) ** 2 +
+                    kalman.noise_sd[candidate] ** 2
+                )
             # Use standard deviations to check for outliers
             # Check against averaged poll dat.ina
             avg_outliers = check_for_outliers_in_poll_averages(
-                candidate_data, rolling_avg, rolling_std, n_sigma, candidate
+                candidate_data, rolling_avg, rolling_std, n_sigma, candidate,
+                backend
             )
             # Check against each individual poll
             individual_outliers = check_for_outliers_in_individual_polls(
-                poll_data, candidate, rolling_avg, rolling_std, n_sigma
+                poll_data, candidate, rolling_avg, rolling_std, n_sigma,
+                backend
             )
-            trends[candidate] = rolling_avg
+            trends.add(candidate, rolling_avg)
             outliers_avg[candidate] = avg_outliers
             outliers_poll.join(individual_outliers, how='outer')
-        trends.index.name = 'date'
-        # trends.set_index('date',inplace=True)
-        # Sort columns so that they are in descending order from latest poll
-        trends.sort_values(
-                trends.first_valid_index(),
-                axis=1, inplace=True,
-                ascending=False
-            )
-        trends.reset_index(inplace=True)
-        logger.info('Rolling averages calculated.')
+        logger.info('Rolling averages calculated.' if kalman is None
+                    else 'Kalman-smoothed averages calculated.')
+        if not sparse:
+            trends = trends.to_dense()
         return trends, outliers_avg, outliers_poll
 
 
+def outlier_mask(values, avg, sig, n_sigma, backend='numpy'):
+    """Flag values at least n_sigma standard deviations from avg."""
+    return get_kernels(backend).outlier_mask(
+        values.to_numpy(dtype=float, na_value=np.nan),
+        avg.to_numpy(dtype=float, na_value=np.nan),
+        sig.to_numpy(dtype=float, na_value=np.nan),
+        float(n_sigma)
+    )
+
+
 def check_for_outliers_in_poll_averages(
-            poll_averages, avg, sig, n_sigma, candidate
+            poll_averages, avg, sig, n_sigma, candidate, backend='numpy'
         ):
+    avg = avg.reindex(poll_averages.index)
+    sig = sig.reindex(poll_averages.index)
     avg_outliers = poll_averages.loc[
-        np.abs(poll_averages - avg) >= n_sigma * sig
+        outlier_mask(poll_averages, avg, sig, n_sigma, backend)
     ]
     if not avg_outliers.empty:
-        logger.warning(f'Checking averaged polls for candidate {candidate}.')
-        logger.warning(f'Found {avg_outliers.shape[0]} poll averages detected '
-                       f'at > {n_sigma} sigma from the mean')
+        logger.warning('Checking averaged polls for candidate %s.', candidate)
+        logger.warning('Found %d poll averages detected '
+                       'at > %s sigma from the mean',
+                       avg_outliers.shape[0], n_sigma)
     return avg_outliers
 
 
 def check_for_outliers_in_individual_polls(
-            poll_data, candidate, avg, sig, n_sigma
+            poll_data, candidate, avg, sig, n_sigma, backend='numpy'
         ):
     rolling = pd.DataFrame()
     rolling['sigma_band'] = sig
@@ -228,14 +660,15 @@ def check_for_outliers_in_individual_polls(
         .join(rolling)
 
     individual_outliers = check_individual_polls.loc[
-        np.abs(
-                check_individual_polls[candidate] -
-                check_individual_polls['rolling_avg']
-            )
-        >= n_sigma * check_individual_polls['sigma_band']
+        outlier_mask(check_individual_polls[candidate],
+                     check_individual_polls['rolling_avg'],
+                     check_individual_polls['sigma_band'],
+                     n_sigma, backend)
     ]
     if not individual_outliers.empty:
-        logger.warning(f'Checking individual polls for candidate {candidate}.')
-        logger.warning(f'Found {individual_outliers.shape[0]} individual '
-                       f'polls detected at > {n_sigma} sigma from the mean')
+        logger.warning('Checking individual polls for candidate %s.',
+                       candidate)
+        logger.warning('Found %d individual '
+                       'polls detected at > %s sigma from the mean',
+                       individual_outliers.shape[0], n_sigma)
     return individual_outliers[candidate]
@@ -0,0 +1,304 @@
+"""Declarative validation of scraped poll tables."""
+import logging
+import numpy as np
+import pandas as pd
+from pollscraper import logger
+
+
+# What happens to rows that break a rule:
+#   ignore - the rule is not evaluated
+#   flag   - violations are recorded without logging
+#   warn   - violations are recorded and counted in the log
+#   drop   - violating rows are recorded and removed from the table
+#   raise  - any violation raises ValidationError
+ACTIONS = ('ignore', 'flag', 'warn', 'drop', 'raise')
+
+VIOLATION_COLUMNS = ['row', 'rule', 'action']
+
+
+class ValidationError(ValueError):
+    """
+    Raised when a rule configured with the 'raise' action is broken.
+
+    Attributes:
+        violations (pandas.DataFrame): Every violation found in the pass.
+    """
+
+    def __init__(self, message, violations) -> None:
+        super().__init__(message)
+        self.violations = violations
+
+
+class Rule:
+    """
+    A vectorised check over a poll table.
+
+    Subclasses implement `evaluate`, returning a boolean array that is
+    True for each violating row.
+
+    Attributes:
+        name (str): Name used in the violations table and configuration.
+        action (str): One of `ACTIONS`.
+        message (str): Log message, formatted with the violation count.
+    """
+
+    name = 'rule'
+    message = '%d rule violation(s) detected'
+
+    def __init__(self, action='warn', name=None, message=None) -> None:
+        if action not in ACTIONS:
+            raise ValueError(f'Unknown validation action {action}.')
+        self.action = action
+        if name is not None:
+            self.name = name
+        if message is not None:
+            self.message = message
+
+    def evaluate(self, frame, shares):
+        """
+        Find the rows breaking the rule.
+
+        Parameters:
+            frame (pandas.DataFrame): The poll table.
+            shares (numpy.ndarray): Candidate vote shares, one column per
+                                    candidate, as fractions.
+
+        Returns:
+            numpy.ndarray: True for each violating row.
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f'{type(self).__name__}(name={self.name!r}, ' \
+               f'action={self.action!r})'
+
+
+class NotNullRule(Rule):
+    """Rows where a column is missing, e.g. unparseable dates."""
+
+    name = 'invalid_date'
+    message = '%d invalid date(s) detected'
+
+    def __init__(self, column='Date', **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.column = column
+
+    def evaluate(self, frame, shares):
+        return frame[self.column].isna().to_numpy()
+
+
+class RangeRule(Rule):
+    """Rows with a vote share outside [low, high]."""
+
+    name = 'share_range'
+    message = '%d row(s) with vote-share out of range'
+
+    def __init__(self, low=0., high=1., **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.low = low
+        self.high = high
+
+    def evaluate(self, frame, shares):
+        with np.errstate(invalid='ignore'):
+            outside = (shares < self.low) | (shares > self.high)
+        return outside.any(axis=1)
+
+
+class SumToOneRule(Rule):
+    """Rows whose vote shares do not sum to one, within `atol`."""
+
+    name = 'sum_to_one'
+    message = '%d Row(s) with unbalanced vote-share'
+
+    def __init__(self, atol=0.02, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.atol = atol
+
+    def evaluate(self, frame, shares):
+        return ~np.isclose(np.nansum(shares, axis=1), 1, atol=self.atol)
+
+
+class SampleBoundsRule(Rule):
+    """Rows whose sample size is below `low` or above `high`."""
+
+    name = 'sample_bounds'
+    message = '%d small sample size(s) detected'
+
+    def __init__(self, column='Sample', low=10, high=None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def evaluate(self, frame, shares):
+        sample = frame[self.column].to_numpy(dtype=float, na_value=np.nan)
+        with np.errstate(invalid='ignore'):
+            outside = np.zeros(len(sample), dtype=bool)
+            if self.low is not None:
+                outside |= sample < self.low
+            if self.high is not None:
+                outside |= sample > self.high
+        return outside
+
+
+class DuplicateRule(Rule):
+    """
+    Repeats of an earlier row with the same pollster, date, sample and
+    vote shares. The first occurrence is not a violation.
+    """
+
+    name = 'duplicate'
+    message = '%d duplicate poll(s) detected'
+
+    def __init__(self, columns=('Date', 'Pollster', 'Sample'),
+                 **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.columns = list(columns)
+
+    def evaluate(self, frame, shares):
+        keys = frame[self.columns].reset_index(drop=True)
+        keys = pd.concat([keys, pd.DataFrame(shares).round(6)], axis=1)
+        return keys.duplicated(keep='first').to_numpy()
+
+
+class FrequencyRule(Rule):
+    """
+    Polls from a pollster publishing unusually often.
+
+    Polls are counted per pollster and period. A row is a violation when
+    its pollster's count for the period exceeds `factor` times that
+    pollster's median count per active period, and at least `min_count`.
+    """
+
+    name = 'pollster_frequency'
+    message = '%d poll(s) from unusually frequent pollsters detected'
+
+    def __init__(self, pollster='Pollster', date='Date', period='W',
+                 factor=3., min_count=3, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.pollster = pollster
+        self.date = date
+        self.period = period
+        self.factor = factor
+        self.min_count = min_count
+
+    def evaluate(self, frame, shares):
+        dates = pd.to_datetime(frame[self.date])
+        periods = dates.dt.to_period(self.period)
+        groups = frame.groupby([frame[self.pollster], periods], sort=False)
+        counts = groups[self.pollster].transform('size')
+        typical = groups.size().groupby(level=0).median()
+        threshold = np.maximum(
+            frame[self.pollster].map(typical) * self.factor, self.min_count
+        )
+        return (dates.notna() & (counts > threshold)).to_numpy()
+
+
+def default_rules():
+    """
+    The checks applied by `DataPipeline.clean_data`.
+
+    Every rule warns by default, so tables pass through unchanged.
+
+    Returns:
+        list: The default rules.
+    """
+    return [NotNullRule(), SampleBoundsRule(), RangeRule(), SumToOneRule(),
+            DuplicateRule(), FrequencyRule()]
+
+
+class Validator:
+    """
+    Evaluate a set of rules against a poll table.
+
+    The vote shares are extracted once and shared by every rule. Each
+    rule is a vectorised check that contributes one column of a boolean
+    violation matrix. The violations table, log counts and dropped rows
+    are then all derived from that matrix.
+
+    Attributes:
+        rules (list): The active rules, excluding ignored ones.
+    """
+
+    def __init__(self, rules=None, actions=None) -> None:
+        """
+        Parameters:
+            rules (list, optional): Rules to apply. Defaults to
+                                    `default_rules()`.
+            actions (dict, optional): Action overrides by rule name, e.g.
+                                      {'sample_bounds': 'drop'}.
+        """
+        rules = default_rules() if rules is None else list(rules)
+        for rule in rules:
+            if actions and rule.name in actions:
+                if actions[rule.name] not in ACTIONS:
+                    raise ValueError('Unknown validation action '
+                                     f'{actions[rule.name]}.')
+                rule.action = actions[rule.name]
+        self.rules = [rule for rule in rules if rule.action != 'ignore']
+
+    def violation_matrix(self, frame, candidates):
+        """
+        Evaluate every rule against the table.
+
+        Parameters:
+            frame (pandas.DataFrame): The poll table.
+            candidates (list): Columns holding vote-share fractions.
+
+        Returns:
+            numpy.ndarray: Boolean matrix of rows by rules.
+        """
+        shares = frame[list(candidates)].to_numpy(dtype=float,
+                                                  na_value=np.nan)
+        matrix = np.zeros((len(frame), len(self.rules)), dtype=bool)
+        for i, rule in enumerate(self.rules):
+            matrix[:, i] = rule.evaluate(frame, shares)
+        return matrix
+
+    def validate(self, frame, candidates):
+        """
+        Validate a poll table and apply each rule's action.
+
+        Parameters:
+            frame (pandas.DataFrame): The poll table.
+            candidates (list): Columns holding vote-share fractions.
+
+        Returns:
+            tuple: The table with dropped rows removed, and the
+            violations table with one row per broken rule and row.
+
+        Raises:
+            ValidationError: If a rule with the 'raise' action is broken.
+        """
+        matrix = self.violation_matrix(frame, candidates)
+        rows, columns = np.nonzero(matrix)
+        actions = np.array([rule.action for rule in self.rules], dtype=object)
+        violations = pd.DataFrame({
+            'row': frame.index.to_numpy()[rows],
+            'rule': np.array([rule.name for rule in self.rules],
+                             dtype=object)[columns],
+            'action': actions[columns],
+        }, columns=VIOLATION_COLUMNS)
+
+        counts = matrix.sum(axis=0)
+        for i, rule in enumerate(self.rules):
+            if not counts[i] or rule.action == 'flag':
+                continue
+            logger.warning(rule.message, counts[i])
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('%s violations: %s', rule.name,
+                             frame[matrix[:, i]])
+
+        raising = [rule.name for rule, count in zip(self.rules, counts)
+                   if count and rule.action == 'raise']
+        if raising:
+            raise ValidationError(
+                f'Validation failed for rule(s): {", ".join(raising)}',
+                violations
+            )
+        drop = matrix[:, actions == 'drop'].any(axis=1)
+        if drop.any():
+            logger.info('Dropping %d row(s) that failed validation',
+                        drop.sum())
+            frame = frame[~drop]
+        return frame, violations
@@ -4,6 +4,21 @@ import pandas as pd
 from pollscraper.scraper import DataPipeline
 
 
+def pytest_addoption(parser):
+    parser.addoption('--performance', action='store_true', default=False,
+                     help='Run the performance budget tests.')
+
+
+def pytest_collection_modifyitems(config, items):
+    # Performance tests are slow, so only run them when asked to
+    if config.getoption('--performance'):
+        return
+    skip = pytest.mark.skip(reason='needs --performance to run')
+    for item in items:
+        if 'performance' in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture
 def http_instance():
     return DataPipeline()
@@ -98,3 +113,32 @@ def expected_dataframe_response():
         'Header1': ['Data1', 'Data3'],
         'Header2': ['Data2', 'Data4']
     })
+
+
+@pytest.fixture
+def local_source(monkeypatch):
+    """Serve fetches from the files in tests/test_sources."""
+    import requests
+    from pathlib import Path
+    from urllib.parse import urlparse
+
+    content_types = {'.html': 'text/html', '.csv': 'text/csv',
+                     '.json': 'application/json',
+                     '.jsonl': 'application/x-ndjson'}
+
+    def mock_fetch(self, url, content_type=None, stream=None):
+        name = Path(urlparse(str(url)).path).name
+        path = Path('tests/test_sources') / name
+        if not path.suffix:
+            path = path.with_suffix('.json')
+        response = requests.Response()
+        response.status_code = 200
+        response.url = str(url)
+        response._content = path.read_bytes() if path.exists() else b''
+        response._content_consumed = True
+        response.headers['Content-Type'] = content_type or \
+            content_types.get(path.suffix, 'application/octet-stream')
+        return response
+
+    monkeypatch.setattr(DataPipeline, 'fetch_html_content', mock_fetch)
+    return 'https://polls.example.com/'
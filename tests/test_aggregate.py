@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pollscraper.aggregate import RegionalAggregator, aggregate_trends
+from pollscraper.trends import PollTrend
+
+
+CANDIDATES = ['Alice', 'Bob', 'Carol']
+
+
+@pytest.fixture
+def weights():
+    return pd.DataFrame({
+        'region': ['north', 'south', 'east', 'west', 'centre'],
+        'state': ['A', 'A', 'B', 'B', 'B'],
+        'weight': [4., 1., 2., 2., 1.],
+    })
+
+
+def make_trends(seed, start='2024-01-01', days=60, candidates=CANDIDATES):
+    """Trends laid out as by `calculate_trends`, latest date first."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=days, freq='D', name='date')
+    values = rng.uniform(.1, .4, (days, len(candidates)))
+    trends = pd.DataFrame(values, index=dates[::-1],
+                          columns=list(candidates))
+    return trends.reset_index()
+
+
+@pytest.fixture
+def region_trends():
+    trends = {region: make_trends(i) for i, region
+              in enumerate(['north', 'south', 'east', 'west', 'centre'])}
+    # East only reports from mid-January, and has a gap in February
+    east = trends['east']
+    east = east[east['date'] >= '2024-01-15']
+    trends['east'] = east[~east['date'].between('2024-02-01', '2024-02-05')]
+    # Carol does not stand in the west
+    trends['west'] = trends['west'].drop(columns='Carol')
+    return trends
+
+
+def expected_trends(region_trends, weights, regions, min_coverage=.5):
+    """Weighted averages computed a day and a region at a time."""
+    weight = weights.set_index('region')['weight']
+    frames = {region: region_trends[region].set_index('date')
+              for region in regions}
+    dates = sorted(set().union(*(frame.index for frame in frames.values())),
+                   reverse=True)
+    candidates = sorted(set().union(*(frame.columns
+                                      for frame in frames.values())))
+    total = weight[regions].sum()
+    expected = pd.DataFrame(np.nan, index=pd.DatetimeIndex(dates,
+                                                           name='date'),
+                            columns=candidates)
+    for date in dates:
+        for candidate in candidates:
+            shares, covered = 0., 0.
+            for region, frame in frames.items():
+                if date not in frame.index:
+                    continue
+                share = frame[candidate][date] \
+                    if candidate in frame.columns else 0.
+                shares += weight[region] * share
+                covered += weight[region]
+            if covered >= min_coverage * total:
+                expected.loc[date, candidate] = shares / covered
+    return expected
+
+
+def assert_trends_equal(trends, expected):
+    trends = trends.set_index('date')
+    assert trends.index.is_monotonic_decreasing
+    pd.testing.assert_frame_equal(trends.sort_index(axis=1),
+                                  expected.sort_index(axis=1),
+                                  check_freq=False)
+
+
+def test_matches_weighted_average(region_trends, weights):
+    result = aggregate_trends(region_trends, weights, levels=['state'])
+    assert set(result) == {'state', 'national'}
+    national = result['national']['national']
+    assert_trends_equal(national, expected_trends(
+        region_trends, weights, list(weights['region'])
+    ))
+    # Candidates are ordered by their latest national average
+    latest = national.iloc[0, 1:]
+    assert list(latest) == sorted(latest, reverse=True)
+
+    assert_trends_equal(result['state']['A'], expected_trends(
+        region_trends, weights, ['north', 'south']
+    ))
+    state_b = result['state']['B']
+    assert_trends_equal(state_b, expected_trends(
+        region_trends, weights, ['east', 'west', 'centre']
+    ))
+    # Before mid-January only the west and centre report, with 60% of
+    # the weight of state B
+    assert state_b.set_index('date').loc['2024-01-10'].notna().all()
+
+
+def test_coverage_threshold(region_trends, weights):
+    result = aggregate_trends(region_trends, weights, levels=['state'],
+                              min_coverage=.7)
+    state_b = result['state']['B'].set_index('date')
+    assert state_b.loc['2024-01-10'].isna().all()
+    assert state_b.loc['2024-02-10'].notna().all()
+    assert_trends_equal(result['state']['B'], expected_trends(
+        region_trends, weights, ['east', 'west', 'centre'], .7
+    ))
+
+
+def test_absent_candidates(weights):
+    region_trends = {
+        'north': make_trends(0, candidates=['Alice', 'Bob']),
+        'south': make_trends(1, candidates=['Alice', 'Dave']),
+    }
+    zero = aggregate_trends(region_trends, weights)['national']['national']
+    assert_trends_equal(zero, expected_trends(region_trends, weights,
+                                              ['north', 'south']))
+
+    skip = aggregate_trends(region_trends, weights, min_coverage=.3,
+                            absent_candidates='skip')['national']['national']
+    skip = skip.set_index('date')
+    north = region_trends['north'].set_index('date')
+    # Only the north reports Bob, with 40% of the weight
+    np.testing.assert_allclose(skip['Bob'], north['Bob'])
+    # Only the south reports Dave, with 10% of the weight
+    assert skip['Dave'].isna().all()
+
+    # Groups only list the candidates standing in them
+    states = aggregate_trends(region_trends, weights, levels=['state'])
+    assert 'B' in states['state']
+    assert list(states['state']['B'].columns) == ['date']
+
+
+def test_incremental_update(region_trends, weights, monkeypatch):
+    aggregator = RegionalAggregator(weights, levels=['state'])
+    for region, trends in region_trends.items():
+        aggregator.update(region, trends)
+
+    # Loading every region at once recomputes the groups only once
+    refreshes = []
+    refresh = RegionalAggregator.refresh
+    monkeypatch.setattr(RegionalAggregator, 'refresh',
+                        lambda self: refreshes.append(1) or refresh(self))
+    loaded = RegionalAggregator(weights, levels=['state'])\
+        .load(region_trends)
+    assert len(refreshes) == 1
+    for level, groups in aggregator.all_trends().items():
+        for group, trends in groups.items():
+            pd.testing.assert_frame_equal(trends,
+                                          loaded.trends(level)[group])
+    monkeypatch.undo()
+
+    # Replace one region, with new dates and a new candidate
+    revised = make_trends(10, start='2024-01-20', days=50,
+                          candidates=CANDIDATES + ['Dave'])
+    aggregator.update('south', revised)
+    aggregator.update('north', make_trends(11, days=70))
+    region_trends = dict(region_trends, south=revised,
+                         north=make_trends(11, days=70))
+    rebuilt = aggregate_trends(region_trends, weights, levels=['state'])
+    for level, groups in aggregator.all_trends().items():
+        for group, trends in groups.items():
+            pd.testing.assert_frame_equal(trends, rebuilt[level][group])
+
+    aggregator.remove('east')
+    assert 'east' not in aggregator.regions
+    del region_trends['east']
+    pd.testing.assert_frame_equal(
+        aggregator.trends()['national'],
+        aggregate_trends(region_trends, weights)['national']['national']
+    )
+
+
+def test_calculated_trends(sample_poll_data, weights):
+    trends, _, _ = PollTrend.calculate_trends(sample_poll_data)
+    sparse, _, _ = PollTrend.calculate_trends(sample_poll_data,
+                                              sparse=True)
+    aggregator = RegionalAggregator(weights)
+    aggregator.update('north', trends)
+    aggregator.update('south', sparse)
+    # Every region has the same trends, so the nation does too
+    pd.testing.assert_frame_equal(aggregator.trends()['national'], trends,
+                                  check_freq=False)
+
+
+def test_invalid_weights(weights):
+    with pytest.raises(ValueError, match='once'):
+        RegionalAggregator(pd.concat([weights, weights]))
+    with pytest.raises(ValueError, match='non-negative'):
+        RegionalAggregator(weights.assign(weight=-1.))
+    with pytest.raises(KeyError, match='atlantis'):
+        RegionalAggregator(weights).update('atlantis', make_trends(0))
+    with pytest.raises(KeyError, match='county'):
+        RegionalAggregator(weights).trends('county')
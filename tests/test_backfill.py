@@ -0,0 +1,89 @@
+import tarfile
+import zipfile
+import pandas as pd
+import pytest
+from click.testing import CliRunner
+from pollscraper import cli
+from pollscraper.backfill import backfill, iter_snapshots
+from pollscraper.scraper import DataPipeline
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, datafiles):
+    """
+    Two snapshots of the polls page: an older one where the latest poll
+    has since been revised, and a newer one from which a poll was removed.
+    """
+    rows = datafiles.split('<tr>')
+    older = datafiles.replace('<td>34.5</td>', '<td>33.5</td>', 1)
+    newer = '<tr>'.join(rows[:3] + rows[4:])
+    snapshots = tmp_path / 'snapshots'
+    snapshots.mkdir()
+    (snapshots / '2024-03-20.html').write_text(older)
+    (snapshots / '2024-03-21.html').write_text(newer)
+    (snapshots / 'notes.txt').write_text('not a snapshot')
+    return snapshots
+
+
+def test_iter_snapshots(snapshot_dir, tmp_path):
+    expected = list(iter_snapshots(snapshot_dir))
+    assert [name for name, _ in expected] == ['2024-03-20.html',
+                                              '2024-03-21.html']
+    with tarfile.open(tmp_path / 'snapshots.tar.gz', 'w:gz') as archive:
+        for path in sorted(snapshot_dir.iterdir()):
+            archive.add(path, arcname=path.name)
+    with zipfile.ZipFile(tmp_path / 'snapshots.zip', 'w') as archive:
+        for path in sorted(snapshot_dir.iterdir()):
+            archive.write(path, arcname=path.name)
+    assert list(iter_snapshots(tmp_path / 'snapshots.tar.gz')) == expected
+    assert list(iter_snapshots(tmp_path / 'snapshots.zip')) == expected
+    with pytest.raises(ValueError):
+        list(iter_snapshots(snapshot_dir / 'notes.txt'))
+
+
+def test_backfill(snapshot_dir, tmp_path, datafiles, expected_result,
+                  caplog):
+    (snapshot_dir / 'broken.html').write_text('<p>No table here</p>')
+    results = tmp_path / 'results'
+    merged, failed = backfill(snapshot_dir, results, max_workers=2,
+                              max_in_flight=1)
+    assert failed == ['broken.html']
+    # Warnings logged in the workers reach the parent's log
+    assert 'with unbalanced vote-share' in caplog.text
+    for name in ('2024-03-20', '2024-03-21'):
+        assert (results / 'snapshots' / name / 'polls.csv').is_file()
+        assert (results / 'snapshots' / name / 'trends.csv').is_file()
+    assert (results / 'polls.csv').is_file()
+    assert (results / 'trends.csv').is_file()
+
+    # Republished polls are kept once, but both versions of the revised
+    # poll are kept, as they might be distinct polls
+    dp = DataPipeline()
+    polls = dp.clean_data(dp.parse_html_table(datafiles))
+    assert len(merged) == len(polls) + 1
+    extra = merged.merge(polls, how='left', indicator=True)
+    extra = extra[extra['_merge'] == 'left_only']
+    assert len(extra) == 1
+    assert 0.335 in extra.iloc[0].to_numpy()
+
+
+def test_backfill_command(snapshot_dir, tmp_path, datafiles):
+    results = tmp_path / 'results'
+    result = CliRunner().invoke(cli.main, [
+        '--quiet', 'backfill', str(snapshot_dir),
+        '--results_dir', str(results), '--workers', '1',
+        '--merge_revisions'
+    ])
+    assert result.exit_code == 0
+
+    # Every poll is kept once, with the revision from the newer snapshot
+    dp = DataPipeline()
+    polls = dp.clean_data(dp.parse_html_table(datafiles))
+    merged = pd.read_csv(results / 'polls.csv', index_col=0,
+                         parse_dates=['date'])
+    assert len(merged) == len(polls)
+    pd.testing.assert_frame_equal(
+        merged.set_index(['date', 'pollster', 'n']).sort_index(),
+        polls.set_index(['date', 'pollster', 'n']).sort_index(),
+        check_dtype=False, check_index_type=False, atol=1e-4
+    )
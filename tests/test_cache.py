@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from pollscraper.cache import ResultCache, fingerprint_frame
+from pollscraper.trends import PollTrend
+
+
+def test_fingerprint_frame(sample_poll_data):
+    fingerprint = fingerprint_frame(sample_poll_data)
+    assert fingerprint == fingerprint_frame(sample_poll_data.copy())
+    changed = sample_poll_data.copy()
+    changed.loc[0, 'Bulstrode'] += 1e-9
+    assert fingerprint != fingerprint_frame(changed)
+    assert fingerprint != fingerprint_frame(
+        sample_poll_data.rename(columns={'Vincy': 'Garth'})
+    )
+
+
+def test_calculate_trends_cache(sample_poll_data, monkeypatch):
+    cache = ResultCache()
+    calls = []
+    resample_polls = PollTrend.resample_polls.__func__
+
+    def counting_resample(cls, *args, **kwargs):
+        calls.append(args)
+        return resample_polls(cls, *args, **kwargs)
+
+    monkeypatch.setattr(PollTrend, 'resample_polls',
+                        classmethod(counting_resample))
+
+    expected, _, _ = PollTrend.calculate_trends(sample_poll_data, n_sigma=2)
+    trends, _, _ = PollTrend.calculate_trends(sample_poll_data, n_sigma=2,
+                                              cache=cache)
+    pd.testing.assert_frame_equal(trends, expected)
+    # Results are copied out, so callers cannot corrupt the cache
+    trends.iloc[:, 1:] = np.nan
+    cached, _, _ = PollTrend.calculate_trends(sample_poll_data, n_sigma=2,
+                                              cache=cache)
+    pd.testing.assert_frame_equal(cached, expected)
+    assert len(calls) == 2
+
+    # Other windows reuse the resampled polls
+    PollTrend.calculate_trends(sample_poll_data, n_sigma=3,
+                               rolling_average_window='14D', cache=cache)
+    assert len(calls) == 2
+    PollTrend.calculate_trends(sample_poll_data, n_sigma=3,
+                               sample_periodicity='3D', cache=cache)
+    assert len(calls) == 3
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_bytes=3 * 800)
+    for key in 'abc':
+        cache.set(key, np.zeros(100))
+    cache.get('a')
+    cache.set('d', np.zeros(100))
+    assert 'b' not in cache
+    assert all(key in cache for key in 'acd')
+    assert cache.nbytes == 3 * 800
+    cache.set('e', np.zeros(1000))
+    assert 'e' not in cache
+
+
+def test_disk_tier(tmp_path, sample_poll_data):
+    cache = ResultCache(directory=tmp_path)
+    expected = PollTrend.calculate_trends(sample_poll_data, n_sigma=2,
+                                          cache=cache)
+    reloaded = ResultCache(directory=tmp_path)
+    result = PollTrend.calculate_trends(sample_poll_data, n_sigma=2,
+                                        cache=reloaded)
+    assert reloaded.hits == 1
+    pd.testing.assert_frame_equal(result[0], expected[0])
+
+    small = ResultCache(max_bytes=0, directory=tmp_path, max_disk_bytes=0)
+    small.set('x', np.zeros(10))
+    assert not list(tmp_path.glob('*.pkl'))
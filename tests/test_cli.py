@@ -1,6 +1,9 @@
+import logging
 from click.testing import CliRunner
 import pandas as pd
-from pollscraper import cli
+import pytest
+from pollscraper import cli, logger, logs_dir, package_log_json
+from pollscraper.log import JSONLinesFormatter, _listeners, configure_logging
 from pathlib import Path
 from pollscraper.root import ROOT_DIR
 from datetime import date
@@ -29,3 +32,36 @@ def test_command_line_interface(get_target_url):
     trends_df['date'] = pd.to_datetime(trends_df['date'], errors='raise')
     assert all(is_numeric(trends_df[col]) for col in trends_df.columns[1:])
     assert all(is_numeric(polls_df[col]) for col in polls_df.columns[3:])
+
+
+@pytest.fixture
+def package_logging():
+    """Restore the package logging configured at import afterwards."""
+    level = logger.level
+    yield
+    configure_logging(logger, level=level,
+                      log_file=logs_dir / "pollscraper.log",
+                      json_lines=package_log_json)
+
+
+def console_handler():
+    return next(h for h in _listeners[logger.name].handlers
+                if type(h) is logging.StreamHandler)
+
+
+def test_configure_cli_logging(package_logging):
+    logger.setLevel(logging.WARNING)
+    # The level set from POLLSCRAPER_LOG_LEVEL is kept
+    cli.configure_cli_logging(False, 'json')
+    assert logger.level == logging.WARNING
+    assert isinstance(console_handler().formatter, JSONLinesFormatter)
+    cli.configure_cli_logging(False, 'text')
+    assert not isinstance(console_handler().formatter, JSONLinesFormatter)
+
+    # Quiet only raises the level of the console, not of the log file
+    cli.configure_cli_logging(True, None, verbose=True)
+    assert logger.level == logging.DEBUG
+    assert console_handler().level == logging.WARNING
+    assert all(h.level == logging.NOTSET
+               for h in _listeners[logger.name].handlers
+               if h is not console_handler())
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+from pollscraper.codes import CodeTable, PollMatrix
+from pollscraper.trends import Weighting
+
+
+def test_code_table():
+    table = CodeTable('pollster', ['Tipton Times'])
+    codes = table.encode(['Lowick Polls', 'Tipton Times', 'Lowick Polls'])
+    assert list(codes) == [1, 0, 1]
+    assert codes.dtype == np.int32
+    assert list(table.decode(codes)) == ['Lowick Polls', 'Tipton Times',
+                                         'Lowick Polls']
+    # Labels keep their codes as others are added
+    assert list(table.encode(['Freshitt Hall', 'Tipton Times'])) == [2, 0]
+    assert len(table) == 3
+
+
+def test_poll_matrix_round_trip(sample_poll_data):
+    matrix = PollMatrix.from_frame(sample_poll_data)
+    assert matrix.shares.shape == (len(sample_poll_data),
+                                   sample_poll_data.shape[1] - 3)
+    assert matrix.candidate_names == list(sample_poll_data.columns[3:])
+    assert list(matrix.candidates) == list(range(len(matrix.candidates)))
+    frame = matrix.to_frame()
+    pd.testing.assert_frame_equal(frame, sample_poll_data,
+                                  check_dtype=False)
+
+
+def test_code_tables_are_scoped(sample_poll_data):
+    n_pollsters = sample_poll_data['pollster'].nunique()
+    first = PollMatrix.from_frame(sample_poll_data)
+    second = PollMatrix.from_frame(sample_poll_data.iloc[::-1])
+    # Each matrix has its own tables, which do not grow across matrices
+    assert first.pollster_table is not second.pollster_table
+    assert len(first.pollster_table) == len(second.pollster_table) == \
+        n_pollsters
+    assert list(second.pollster_names) == \
+        list(sample_poll_data['pollster'].iloc[::-1])
+
+
+def test_binned_sums_match_grouper(large_gap_data):
+    polls = large_gap_data.set_index('date')
+    matrix = PollMatrix.from_frame(polls)
+    weights = np.linspace(0.5, 1.5, len(polls))
+    for periodicity in ('1D', '3D', 'W', 'MS'):
+        bins, periods = matrix.period_bins(periodicity)
+        sums, totals, counts = matrix.binned_sums(bins, len(periods),
+                                                  weights)
+        grouper = pd.Grouper(freq=periodicity)
+        shares = polls[matrix.candidate_names]
+        expected = shares.mul(weights, axis=0).groupby(grouper).sum()
+        pd.testing.assert_index_equal(periods, expected.index)
+        np.testing.assert_allclose(sums, expected.to_numpy())
+        np.testing.assert_allclose(
+            totals, pd.Series(weights, index=polls.index)
+            .groupby(grouper).sum().to_numpy()
+        )
+        np.testing.assert_array_equal(
+            counts, shares.notna().groupby(grouper).sum().to_numpy()
+        )
+
+
+def test_pollster_factor():
+    weighting = Weighting()
+    weighting.pollster_factor_weights['Synapse Strategies'] = 0.5
+    pollsters = pd.Series(['Synapse Strategies', 'Unknown', 'Dataland Daily'])
+    weights = pd.Series(np.ones(3))
+    weighting.pollster_factor(weights, pollsters)
+    assert list(weights) == [0.5, 1., 1.]
+    # The table is rebuilt when the factors change
+    names, _ = weighting.pollster_factors()
+    assert weighting.pollster_factors()[0] is names
+    weighting.pollster_factor_weights['Unknown'] = 2.
+    weighting.pollster_factor(weights, pollsters)
+    assert list(weights) == [0.25, 2., 1.]
@@ -0,0 +1,86 @@
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pollscraper.connection import (build_session, close_shared_session,
+                                    shared_session)
+from pollscraper.scraper import DataPipeline
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'<table><tr><th>A</th></tr><tr><td>1</td></tr></table>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    server.connections = 0
+    server.failures = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    close_shared_session()
+
+
+def server_url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/index.html'
+
+
+def test_adapter_mounted_on_both_schemes():
+    dp = DataPipeline(http_n_retries=3, http_connection_timeout=1,
+                      http_read_timeout=2, pool_maxsize=4)
+    https = dp.session.get_adapter('https://example.com')
+    assert https is dp.session.get_adapter('http://example.com')
+    assert https.max_retries.total == 3
+    assert https.max_retries.respect_retry_after_header
+    assert 429 in https.max_retries.status_forcelist
+    assert https._pool_maxsize == 4
+    assert dp.timeout_policy == (1, 2)
+
+
+def test_keep_alive_disabled():
+    session = build_session(keep_alive=False)
+    assert session.headers['Connection'] == 'close'
+
+
+def test_retry_after(local_server):
+    local_server.failures = 2
+    dp = DataPipeline(http_n_retries=2)
+    response = dp.fetch_html_content(server_url(local_server))
+    assert response.status_code == 200
+
+
+def test_shared_session_reuses_connections(local_server):
+    url = server_url(local_server)
+    for _ in range(10):
+        DataPipeline().fetch_html_content(url)
+    assert local_server.connections == 10
+
+    local_server.connections = 0
+    for _ in range(10):
+        DataPipeline(session=shared_session()).fetch_html_content(url)
+    assert local_server.connections == 1
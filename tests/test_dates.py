@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from pollscraper.dates import detect_date_formats, parse_poll_dates
+from pollscraper.scraper import DataPipeline
+
+
+def test_parse_single_dates():
+    dates = pd.Series(['3/20/24', '3/18/24', '3/20/24', np.nan])
+    parsed = parse_poll_dates(dates)
+    expected = pd.to_datetime(['2024-03-20', '2024-03-18', '2024-03-20',
+                               None])
+    for col in ('start', 'end', 'mid'):
+        pd.testing.assert_index_equal(pd.DatetimeIndex(parsed[col]),
+                                      expected, check_names=False)
+
+
+def test_parse_date_ranges():
+    dates = pd.Series(['10/11-10/14/23', '10/11-14/23', '12/28-1/3/24',
+                       '12/28/23-1/3/2024', '10/14-10/11/23'])
+    parsed = parse_poll_dates(dates)
+    assert parsed['start'].tolist()[:4] == list(pd.to_datetime(
+        ['2023-10-11', '2023-10-11', '2023-12-28', '2023-12-28']))
+    assert parsed['end'].tolist()[:4] == list(pd.to_datetime(
+        ['2023-10-14', '2023-10-14', '2024-01-03', '2024-01-03']))
+    assert parsed['mid'].tolist()[:4] == list(pd.to_datetime(
+        ['2023-10-12', '2023-10-12', '2023-12-31', '2023-12-31']))
+    # Periods that end before they start are invalid
+    assert parsed.iloc[4].isnull().all()
+
+
+def test_parse_mixed_formats():
+    dates = pd.Series(['3/20/24', '2024-03-18', 'Mar 16, 2024', '25/03/2024',
+                       'not a date'])
+    parsed = parse_poll_dates(dates)['end']
+    assert parsed.tolist()[:4] == list(pd.to_datetime(
+        ['2024-03-20', '2024-03-18', '2024-03-16', '2024-03-25']))
+    assert pd.isnull(parsed.iloc[4])
+
+
+def test_detect_date_formats():
+    assert detect_date_formats(('3/4/24', '3/20/24'))[0] == '%m/%d/%y'
+    assert detect_date_formats(('20/3/2024', '4/3/2024'))[0] == '%d/%m/%Y'
+
+
+def test_unrecognised_dates():
+    with pytest.raises(ValueError, match='Unrecognised date format'):
+        parse_poll_dates(pd.Series(['soon', 'later']))
+
+
+def test_clean_data_date_anchor():
+    table_df = pd.DataFrame({'Date': ['3/18-3/20/24', '3/16/24'],
+                             'Pollster': ['A', 'B'],
+                             'Sample': ['1000', '800'],
+                             'X': ['50%', '40%'],
+                             'Y': ['50%', '60%']})
+    polls = DataPipeline(date_anchor='mid').clean_data(table_df)
+    assert polls['date'].tolist() == list(pd.to_datetime(
+        ['2024-03-19', '2024-03-16']))
+    with pytest.raises(ValueError):
+        DataPipeline(date_anchor='first')
@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+from pollscraper.dedup import PollDeduplicator, normalise_pollster
+
+
+@pytest.fixture
+def polls():
+    return pd.DataFrame({
+        'date': pd.to_datetime(['2023-10-20', '2023-10-20', '2023-10-20',
+                                '2023-10-19', '2023-10-18', '2023-10-18']),
+        'pollster': ['Middlemarch Post', 'middlemarch post.',
+                     'Middlemarch Post', 'Tipton Times', 'Lowick Polls',
+                     'Lowick Polls'],
+        'n': [500, 500, 520, 800, 900, 900],
+        'Bulstrode': [0.5, 0.5, 0.52, 0.4, 0.3, 0.6],
+        'Lydgate': [0.5, 0.5, 0.48, 0.6, 0.7, None],
+    }, index=['a', 'b', 'c', 'd', 'e', 'f'])
+
+
+def test_normalise_pollster():
+    names = pd.Series(['Middlemarch  Post', 'middlemarch-post.', 'MP'])
+    assert list(normalise_pollster(names)) == ['middlemarch post',
+                                               'middlemarch post', 'mp']
+
+
+def test_deduplicate(polls):
+    # By default only republications are dropped, as distinct polls by
+    # one pollster on one day would look like revisions of each other
+    deduplicator = PollDeduplicator()
+    result = deduplicator.deduplicate(polls)
+    assert list(result.index) == ['a', 'c', 'd', 'e', 'f']
+    assert list(deduplicator.superseded['reason']) == ['duplicate']
+
+    deduplicator = PollDeduplicator(revisions=True)
+    result = deduplicator.deduplicate(polls)
+    # Polls with different candidates on one day are distinct questions
+    assert list(result.index) == ['a', 'd', 'e', 'f']
+    superseded = deduplicator.superseded
+    assert list(superseded.index) == ['b', 'c']
+    assert list(superseded['superseded_by']) == ['a', 'a']
+    assert list(superseded['reason']) == ['duplicate', 'revision']
+
+    last = PollDeduplicator(keep='last', revisions=True).deduplicate(polls)
+    assert list(last.index) == ['c', 'd', 'e', 'f']
+
+
+def test_keys_ignore_added_candidates(polls):
+    deduplicator = PollDeduplicator()
+    exact, fuzzy = deduplicator.keys(polls)
+    widened = deduplicator.keys(polls.assign(Vincy=None))
+    assert (exact == widened[0]).all()
+    assert (fuzzy == widened[1]).all()
+
+
+def test_persisted_index(polls, tmp_path):
+    path = tmp_path / 'polls_index.csv'
+    first = PollDeduplicator(path, revisions=True)
+    first.deduplicate(polls.loc[['c', 'd']])
+    assert path.is_file()
+
+    # The revision first seen in a later run replaces the known version,
+    # whatever its position in the table
+    second = PollDeduplicator(path, revisions=True)
+    result = second.deduplicate(polls)
+    assert list(result.index) == ['a', 'd', 'e', 'f']
+    assert list(second.superseded.index) == ['b', 'c']
+
+    new = PollDeduplicator(path).deduplicate(polls, drop_known=True)
+    assert new.empty
+    assert set(pd.read_csv(path)['generation']) == {0, 1}
+
+
+def test_index_pruned(polls, tmp_path):
+    path = tmp_path / 'polls_index.csv'
+    PollDeduplicator(path, max_generations=2).deduplicate(polls.loc[['d']])
+    for _ in range(2):
+        PollDeduplicator(path, max_generations=2)\
+            .deduplicate(polls.loc[['e']])
+    # Polls are forgotten once not seen in max_generations runs
+    index = pd.read_csv(path)
+    assert len(index) == 1
+    assert list(index['last_seen']) == [2]
+    assert PollDeduplicator(path).deduplicate(
+        polls.loc[['d', 'e']], drop_known=True
+    ).index.tolist() == ['d']
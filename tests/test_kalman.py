@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pollscraper.kalman import KalmanTrend
+
+
+@pytest.fixture
+def simulated_polls():
+    """Polls of two candidates around a known trend, with house effects."""
+    rng = np.random.default_rng(0)
+    days = pd.date_range('2023-10-11', '2024-03-16')
+    step = np.arange(len(days))
+    truth = pd.DataFrame({'A': .40 + .05 * np.sin(step / 20),
+                          'B': np.where(step < 80, .30, .38)}, index=days)
+    dates = days[rng.integers(len(days), size=400)]
+    n = rng.integers(500, 3000, size=400)
+    pollster = rng.integers(8, size=400)
+    house = np.select([pollster == 0, pollster == 1], [.02, -.02], 0.)
+    polls = pd.DataFrame({
+        'date': dates,
+        'pollster': [f'Pollster {p}' for p in pollster],
+        'n': n,
+        'A': truth.loc[dates, 'A'].to_numpy() + house +
+        rng.normal(0, np.sqrt(.24 / n) + .01),
+        'B': truth.loc[dates, 'B'].to_numpy() - house +
+        rng.normal(0, np.sqrt(.21 / n) + .01),
+    })
+    return polls, truth
+
+
+def test_smoothed_trend(simulated_polls):
+    polls, truth = simulated_polls
+    mean, sd = KalmanTrend().fit(polls).smooth()
+    assert list(mean.columns) == ['A', 'B']
+    error = (mean - truth.reindex(mean.index)).abs()
+    assert error.mean().max() < .01
+    # The smoother's uncertainty covers the truth most of the time
+    covered = error < 1.96 * sd
+    assert covered.mean().min() > .8
+    # Filtering alone is noisier than smoothing
+    filtered, filtered_sd = KalmanTrend().fit(polls).filtered()
+    assert (filtered_sd >= sd - 1e-12).all().all()
+
+
+def test_streaming_update(simulated_polls):
+    polls, _ = simulated_polls
+    polls = polls.sort_values('date', kind='stable')
+    cut = polls['date'].iloc[300]
+    early, late = polls[polls['date'] <= cut], polls[polls['date'] > cut]
+
+    kalman = KalmanTrend().fit(early)
+    history, _ = kalman.filtered()
+    kalman.update(late)
+    filtered, _ = kalman.filtered()
+    # Earlier periods are not refitted
+    pd.testing.assert_frame_equal(filtered.loc[history.index], history)
+    assert filtered.index[-1] == polls['date'].max()
+
+    # Absorbing polls one at a time matches absorbing them in one batch
+    kalman.reset()
+    kalman.update(polls)
+    batch, _ = kalman.filtered()
+    kalman.reset()
+    for _, poll in polls.iterrows():
+        kalman.update(poll.to_frame().T.infer_objects())
+    streamed, _ = kalman.filtered()
+    pd.testing.assert_frame_equal(streamed, batch)
+    pd.testing.assert_frame_equal(batch, filtered)
+
+
+def test_late_polls_and_new_candidates(simulated_polls):
+    polls, _ = simulated_polls
+    kalman = KalmanTrend(extra_sd=.01).fit(polls[['date', 'pollster', 'n',
+                                                  'A']])
+    last = kalman.periods[-1]
+    late = polls.head(3).assign(date=last - pd.Timedelta('30D'))
+    kalman.update(late)
+    mean, sd = kalman.smooth()
+    assert kalman.periods[-1] == last
+    assert list(mean.columns) == ['A', 'B']
+    # B is only observed in the latest period
+    assert mean['B'].notna().sum() == 1
+    assert sd['B'].iloc[-1] > 0
+
+
+def test_pollster_effects(simulated_polls):
+    polls, truth = simulated_polls
+    kalman = KalmanTrend(pollster_effects=True).fit(polls)
+    effects = kalman.house_effects
+    assert effects.loc['Pollster 0', 'A'] > .01
+    assert effects.loc['Pollster 1', 'A'] < -.01
+    assert effects.loc['Pollster 0', 'B'] < -.01
+    np.testing.assert_allclose(effects.mean(), 0, atol=1e-12)
+    mean, _ = kalman.smooth()
+    error = (mean - truth.reindex(mean.index)).abs().mean()
+    plain, _ = KalmanTrend().fit(polls).smooth()
+    plain_error = (plain - truth.reindex(plain.index)).abs().mean()
+    assert (error <= plain_error + 1e-3).all()
+
+
+def test_parameters():
+    with pytest.raises(ValueError):
+        KalmanTrend(process_sd=0)
+    kalman = KalmanTrend(process_sd=.01, pollster_effects=True)
+    weekly = kalman.with_periodicity('W')
+    assert weekly.sample_periodicity == 'W'
+    assert repr(weekly) == repr(kalman).replace("'1D'", "'W'")
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pollscraper import kernels
+from pollscraper.kernels import get_kernels
+from pollscraper.trends import PollTrend
+
+
+@pytest.fixture
+def arrays():
+    rng = np.random.default_rng(0)
+    shares = rng.uniform(0, 1, (200, 4))
+    shares[rng.uniform(size=shares.shape) < 0.2] = np.nan
+    bins = rng.integers(-1, 30, 200)
+    weights = rng.uniform(0.5, 2, 200)
+    lo = np.sort(rng.integers(0, 200, 50))
+    hi = np.minimum(lo + rng.integers(0, 20, 50), 200)
+    return bins, shares, weights, lo, hi
+
+
+def test_get_kernels(monkeypatch, caplog):
+    assert get_kernels().name == 'numpy'
+    assert get_kernels(get_kernels('numpy')).name == 'numpy'
+    with pytest.raises(ValueError):
+        get_kernels('fortran')
+    monkeypatch.setattr(kernels, 'numba', None)
+    assert get_kernels('auto').name == 'numpy'
+    assert get_kernels('numba').name == 'numpy'
+    assert 'falling back to the NumPy backend' in caplog.text
+
+
+def test_numpy_kernels(arrays):
+    bins, shares, weights, lo, hi = arrays
+    k = get_kernels('numpy')
+    sums, totals, counts = k.binned_sums(bins, 30, shares, weights)
+    binned = bins >= 0
+    frame = pd.DataFrame(shares[binned] * weights[binned, None])
+    grouped = frame.groupby(bins[binned])
+    np.testing.assert_allclose(sums[np.unique(bins[binned])],
+                               grouped.sum().to_numpy())
+    assert counts.sum() == (~np.isnan(shares[binned])).sum()
+    np.testing.assert_allclose(totals.sum(), weights[binned].sum())
+
+    values = shares[:, 0][~np.isnan(shares[:, 0])]
+    mean, std = k.window_stats(values, np.ones_like(values), [0, 3, 5],
+                               [3, 4, 5])
+    np.testing.assert_allclose(mean[:2], [values[:3].mean(), values[3]])
+    np.testing.assert_allclose(std[0], values[:3].std(ddof=1))
+    assert np.isnan(std[1]) and np.isnan(mean[2])
+
+    mask = k.outlier_mask(np.array([1., 2., np.nan, 1.]),
+                          np.array([1., 1., 1., np.nan]),
+                          np.array([0.1, 0.1, 0.1, 0.1]), 2.)
+    assert list(mask) == [False, True, False, False]
+
+
+def test_numba_kernels_match_numpy(arrays):
+    pytest.importorskip('numba')
+    bins, shares, weights, lo, hi = arrays
+    fast, reference = get_kernels('numba'), get_kernels('numpy')
+    for a, b in zip(fast.binned_sums(bins, 30, shares, weights),
+                    reference.binned_sums(bins, 30, shares, weights)):
+        np.testing.assert_allclose(a, b)
+    values = shares[:, 1][~np.isnan(shares[:, 1])]
+    lo, hi = np.minimum(lo, len(values)), np.minimum(hi, len(values))
+    for a, b in zip(fast.window_stats(values, weights[:len(values)], lo, hi),
+                    reference.window_stats(values, weights[:len(values)],
+                                           lo, hi)):
+        np.testing.assert_allclose(a, b, equal_nan=True)
+    mean = np.nanmean(shares, axis=0)[[0, 1, 2, 3] * 200]
+    np.testing.assert_array_equal(
+        fast.outlier_mask(shares.ravel(), mean, np.full(200 * 4, 0.2), 1.),
+        reference.outlier_mask(shares.ravel(), mean,
+                               np.full(200 * 4, 0.2), 1.)
+    )
+
+
+def test_backend_trends(sample_poll_data, large_gap_data):
+    pytest.importorskip('numba')
+    for poll_data in (sample_poll_data, large_gap_data):
+        expected = PollTrend.calculate_trends(poll_data.copy(), n_sigma=2)
+        result = PollTrend.calculate_trends(poll_data.copy(), n_sigma=2,
+                                            backend='numba')
+        for a, b in zip(result, expected):
+            pd.testing.assert_frame_equal(a, b)
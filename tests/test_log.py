@@ -0,0 +1,86 @@
+import io
+import json
+import logging
+import threading
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+from pollscraper import logger
+from pollscraper.log import _listeners, configure_logging, stop_logging
+
+
+class CountingRepr:
+    calls = 0
+
+    def __str__(self):
+        CountingRepr.calls += 1
+        return 'formatted'
+
+
+def test_package_logger_is_queued():
+    assert any(isinstance(h, QueueHandler) for h in logger.handlers)
+
+
+def test_configure_logging(tmp_path):
+    test_logger = logging.getLogger('pollscraper.test_log')
+    test_logger.propagate = False
+    stream = io.StringIO()
+    log_file = tmp_path / 'test.log'
+    listener = configure_logging(test_logger, level=logging.INFO,
+                                 log_file=log_file, stream=stream,
+                                 json_lines=True, max_bytes=1024)
+    try:
+        assert any(isinstance(h, RotatingFileHandler) and h.maxBytes == 1024
+                   for h in listener.handlers)
+        # Messages below the level are never formatted
+        test_logger.debug('Skipped %s', CountingRepr())
+        assert CountingRepr.calls == 0
+        test_logger.info('Found %d polls', 3)
+    finally:
+        stop_logging(test_logger)
+    assert not test_logger.handlers
+    lines = log_file.read_text().splitlines()
+    assert len(lines) == 1
+    entry = json.loads(lines[0])
+    assert entry['message'] == 'Found 3 polls'
+    assert entry['level'] == 'INFO'
+    assert json.loads(stream.getvalue()) == entry
+    assert 'pollscraper' in _listeners
+
+
+class ThreadRecordingRepr:
+
+    def __init__(self) -> None:
+        self.threads = []
+        self.items = [1]
+
+    def __str__(self):
+        self.threads.append(threading.current_thread())
+        return 'items %s' % self.items
+
+    def __copy__(self):
+        copied = ThreadRecordingRepr()
+        copied.threads = self.threads
+        copied.items = list(self.items)
+        return copied
+
+
+def test_formatting_deferred_to_listener():
+    test_logger = logging.getLogger('pollscraper.test_deferred')
+    test_logger.propagate = False
+    stream = io.StringIO()
+    configure_logging(test_logger, stream=stream)
+    argument = ThreadRecordingRepr()
+    try:
+        try:
+            raise ValueError('bad row')
+        except ValueError:
+            test_logger.exception('Parsed %s', argument)
+        # Changes after the call do not reach the message
+        argument.items.append(2)
+    finally:
+        stop_logging(test_logger)
+    assert argument.threads
+    assert threading.current_thread() not in argument.threads
+    output = stream.getvalue()
+    assert 'Parsed items [1]' in output
+    assert 'ValueError: bad row' in output
@@ -0,0 +1,105 @@
+import os
+import stat
+import pandas as pd
+import pytest
+from pollscraper.output import (ALL_RACES, DEFAULT_PARTITION, atomic_write,
+                                write_csv, write_outputs, write_partitioned)
+
+
+@pytest.fixture
+def umask():
+    old = os.umask(0o027)
+    yield 0o027
+    os.umask(old)
+
+
+@pytest.fixture
+def polls():
+    return pd.DataFrame({
+        'date': pd.to_datetime(['2024-03-02', '2024-02-20', '2024-02-01',
+                                None]),
+        'pollster': ['A', 'B', 'A', 'C'],
+        'Bulstrode': [0.51234, 0.5, 0.45, 0.4],
+    })
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'out' / 'polls.csv'
+    with atomic_write(path) as f:
+        f.write('first')
+    assert path.read_text() == 'first'
+
+    # A failed write leaves the previous file and no temporary files
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as f:
+            f.write('partial')
+            raise RuntimeError('crash')
+    assert path.read_text() == 'first'
+    assert [p.name for p in path.parent.iterdir()] == ['polls.csv']
+
+
+def test_output_modes(polls, tmp_path, umask, monkeypatch):
+    monkeypatch.setattr('pollscraper.output._umask', None)
+    # Outputs get the same modes as files written directly
+    path = write_csv(polls, tmp_path / 'polls.csv')
+    polls.to_csv(tmp_path / 'direct.csv')
+    assert stat.S_IMODE(path.stat().st_mode) == 0o640 == \
+        stat.S_IMODE((tmp_path / 'direct.csv').stat().st_mode)
+    write_partitioned(polls, tmp_path / 'polls', race='mayor')
+    race = tmp_path / 'polls' / 'race=mayor'
+    assert stat.S_IMODE(race.stat().st_mode) == 0o750
+    assert stat.S_IMODE(
+        (race / 'month=2024-02' / 'part-0.csv').stat().st_mode
+    ) == 0o640
+
+
+def test_write_csv(polls, tmp_path):
+    path = write_csv(polls, tmp_path / 'polls.csv', n_places=2)
+    assert '0.51' in path.read_text()
+    assert '0.512' not in path.read_text()
+
+
+def test_write_partitioned(polls, tmp_path):
+    written = write_partitioned(polls, tmp_path / 'polls', race='mayor',
+                                index=False)
+    root = tmp_path / 'polls' / 'race=mayor'
+    assert sorted(written) == sorted([
+        root / 'month=2024-02' / 'part-0.csv',
+        root / 'month=2024-03' / 'part-0.csv',
+        root / f'month={DEFAULT_PARTITION}' / 'part-0.csv',
+    ])
+    february = pd.read_csv(root / 'month=2024-02' / 'part-0.csv')
+    assert list(february['pollster']) == ['B', 'A']
+
+    # Rewriting replaces the race's partitions, leaving other races alone
+    write_partitioned(polls.iloc[:1], tmp_path / 'polls', race='governor')
+    write_partitioned(polls.iloc[:1], tmp_path / 'polls', race='mayor')
+    assert [p.name for p in root.iterdir()] == ['month=2024-03']
+    assert (tmp_path / 'polls' / 'race=governor').is_dir()
+    assert sorted(p.name for p in (tmp_path / 'polls').iterdir()) == \
+        ['race=governor', 'race=mayor']
+
+
+def test_write_outputs(polls, tmp_path):
+    trends = polls[['date', 'Bulstrode']]
+    written = write_outputs({'polls': polls, 'trends': trends}, tmp_path)
+    assert written == {'polls': [tmp_path / 'polls.csv'],
+                       'trends': [tmp_path / 'trends.csv']}
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / 'trends.csv', index_col=0,
+                    parse_dates=['date']),
+        trends, atol=1e-4
+    )
+
+    written = write_outputs({'polls': polls, 'trends': trends}, tmp_path,
+                            partition=True)
+    assert len(written['trends']) == 3
+    assert (tmp_path / 'trends' / f'race={ALL_RACES}' / 'month=2024-03' /
+            'part-0.csv').is_file()
+
+    # Writing without a race leaves the races' partitions alone
+    write_outputs({'trends': trends}, tmp_path, partition=True,
+                  race='mayor')
+    write_outputs({'trends': trends}, tmp_path, partition=True)
+    assert sorted(p.name for p in (tmp_path / 'trends').iterdir()) == \
+        [f'race={ALL_RACES}', 'race=mayor']
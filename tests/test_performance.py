@@ -0,0 +1,242 @@
+"""
+Time and memory budgets for the pipeline on scaled-up fixtures.
+
+These tests only run with ``pytest --performance`` (or ``make
+test-performance``). Each fixture is tiled 100 to 10,000 times, and the
+run time and peak traced memory of `clean_data` and `calculate_trends`
+are checked against budgets that grow linearly with the number of rows.
+The growth of run time with scale is checked to be roughly linear too.
+
+Every run is appended to a JSON history file, and a run fails if it is
+much slower than earlier runs of the same case on the same machine.
+
+Environment variables:
+    POLLSCRAPER_PERF_SCALES: Comma-separated scale factors.
+    POLLSCRAPER_PERF_BUDGET_SCALE: Multiplier for every budget, for
+                                   slower machines.
+    POLLSCRAPER_PERF_HISTORY: Path of the JSON history file.
+    POLLSCRAPER_PERF_REGRESSION: Allowed slowdown against the median of
+                                 earlier runs.
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from pollscraper.output import atomic_write
+from pollscraper.scraper import DataPipeline
+from pollscraper.trends import PollTrend
+
+
+pytestmark = pytest.mark.performance
+
+SCALES = tuple(int(s) for s in os.environ.get(
+    'POLLSCRAPER_PERF_SCALES', '100,1000,10000').split(','))
+BUDGET_SCALE = float(os.environ.get('POLLSCRAPER_PERF_BUDGET_SCALE', 1))
+HISTORY = Path(os.environ.get('POLLSCRAPER_PERF_HISTORY',
+                              '.benchmarks/performance.json'))
+REGRESSION_FACTOR = float(os.environ.get('POLLSCRAPER_PERF_REGRESSION', 2))
+
+# Largest allowed exponent of run time against number of rows
+MAX_SCALING_EXPONENT = 1.3
+
+# Budgets are a fixed allowance plus an allowance per million input rows
+BUDGETS = {
+    'clean_data': {'seconds': (1., 25.), 'peak_bytes': (16 * 2**20, 1.5e9)},
+    'calculate_trends': {'seconds': (1., 5.),
+                         'peak_bytes': (16 * 2**20, 1.2e9)},
+}
+
+TREND_FIXTURES = ('sample_poll_data', 'opinion_shift_data',
+                  'large_gap_data')
+
+
+def budget(function, measure, rows):
+    fixed, per_million = BUDGETS[function][measure]
+    return (fixed + per_million * rows / 1e6) * BUDGET_SCALE
+
+
+def scale_rows(frame, factor, pollster_col):
+    """
+    Tile a frame `factor` times, numbering each copy's pollsters so that
+    the copies are distinct polls.
+    """
+    scaled = pd.concat([frame] * factor, ignore_index=True)
+    copy = np.arange(len(scaled)) // len(frame)
+    scaled[pollster_col] = scaled[pollster_col].astype(str) + ' #' + \
+        copy.astype(str)
+    return scaled
+
+
+def measure(setup, func):
+    """
+    Run time of one call, and peak traced memory of another.
+
+    Each call gets fresh arguments from `setup`, outside of the
+    measurement, so the second call does the same work as the first.
+    """
+    args = setup()
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - start
+    args = setup()
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak_bytes
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history():
+    try:
+        return json.loads(HISTORY.read_text())
+    except (OSError, ValueError):
+        return []
+
+
+def previous_seconds(history, function, fixture, scale):
+    return [case['seconds'] for run in history
+            if run['machine'] == platform.node()
+            for case in run['cases']
+            if (case['function'], case['fixture'], case['scale']) ==
+            (function, fixture, scale)]
+
+
+def raw_table():
+    with open('tests/test_scraper/expected_source_fixture.html') as f:
+        return DataPipeline().parse_html_table(f.read())
+
+
+class Measurements:
+    """
+    Measurements of this session, made once per case when first needed.
+
+    Budget and scaling tests share the measurements, so each test can
+    run on its own, in any order, or in its own worker.
+    """
+
+    def __init__(self) -> None:
+        self.results = {}
+
+    def get(self, request, function, fixture, scale):
+        """The measurement of a case, with fixtures from a test `request`."""
+        key = (function, fixture, scale)
+        if key not in self.results:
+            self.results[key] = self._measure(request, function, fixture,
+                                              scale)
+        return self.results[key]
+
+    def _measure(self, request, function, fixture, scale):
+        if function == 'clean_data':
+            table = scale_rows(raw_table(), scale, 'Pollster')
+            # A fresh pipeline each time, as the deduplicator indexes
+            # the polls it has seen
+            seconds, peak_bytes = measure(
+                lambda: (DataPipeline(), table.copy()),
+                lambda pipeline, table: pipeline.clean_data(table)
+            )
+            rows = len(table)
+        else:
+            polls = scale_rows(request.getfixturevalue(fixture),
+                               scale, 'pollster')
+            seconds, peak_bytes = measure(lambda: (polls.copy(),),
+                                          PollTrend.calculate_trends)
+            rows = len(polls)
+        return {'function': function, 'fixture': fixture, 'scale': scale,
+                'rows': rows, 'seconds': seconds,
+                'peak_bytes': peak_bytes}
+
+
+@pytest.fixture(scope='session')
+def history():
+    return load_history()
+
+
+@pytest.fixture(scope='session')
+def measurements(history):
+    """Measure cases on demand, and append them to the history at the end."""
+    measurements = Measurements()
+    yield measurements
+    if not measurements.results:
+        return
+    history.append({
+        'time': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'cases': list(measurements.results.values()),
+    })
+    with atomic_write(HISTORY) as f:
+        json.dump(history, f, indent=2)
+
+
+def check_case(history, case):
+    function, rows = case['function'], case['rows']
+    seconds, peak_bytes = case['seconds'], case['peak_bytes']
+    assert seconds <= budget(function, 'seconds', rows), \
+        f'{function} took {seconds:.2f}s on {rows} rows'
+    assert peak_bytes <= budget(function, 'peak_bytes', rows), \
+        f'{function} peaked at {peak_bytes / 2**20:.0f} MiB on {rows} rows'
+    earlier = previous_seconds(history, function, case['fixture'],
+                               case['scale'])
+    if earlier:
+        median = float(np.median(earlier))
+        assert seconds <= REGRESSION_FACTOR * max(median, 0.05), \
+            f'{function} took {seconds:.2f}s, against {median:.2f}s before'
+
+
+def check_scaling(request, measurements, function, fixture):
+    if len(SCALES) < 2:
+        pytest.skip('needs two scales to check the scaling')
+    # Fixed costs flatten the curve at small scales, so only the two
+    # largest scales are compared
+    small, large = (measurements.get(request, function, fixture, scale)
+                    for scale in sorted(SCALES)[-2:])
+    exponent = math.log(large['seconds'] / small['seconds']) / \
+        math.log(large['rows'] / small['rows'])
+    assert exponent <= MAX_SCALING_EXPONENT, \
+        f'{function} run time grows as rows^{exponent:.2f}'
+
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_clean_data_budget(history, measurements, request, scale):
+    check_case(history, measurements.get(request, 'clean_data',
+                                         'expected_source_fixture', scale))
+
+
+def test_clean_data_scaling(measurements, request):
+    check_scaling(request, measurements, 'clean_data',
+                  'expected_source_fixture')
+
+
+@pytest.mark.parametrize('fixture', TREND_FIXTURES)
+@pytest.mark.parametrize('scale', SCALES)
+def test_calculate_trends_budget(history, measurements, request, fixture,
+                                 scale):
+    check_case(history, measurements.get(request, 'calculate_trends',
+                                         fixture, scale))
+
+
+@pytest.mark.parametrize('fixture', TREND_FIXTURES)
+def test_calculate_trends_scaling(measurements, request, fixture):
+    check_scaling(request, measurements, 'calculate_trends', fixture)
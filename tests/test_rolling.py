@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pollscraper.rolling import rolling_weighted_stats
+
+
+@pytest.fixture
+def irregular_polls():
+    rng = np.random.default_rng(0)
+    days = np.sort(rng.choice(120, size=60, replace=False))
+    times = pd.Timestamp('2023-10-11') + pd.to_timedelta(days, unit='D')
+    values = rng.uniform(.2, .4, size=60)
+    values[[5, 17]] = np.nan
+    return pd.Series(values, index=times)
+
+
+def brute_force(series, weights, eval_times, window, align):
+    window = pd.Timedelta(window)
+    mean, std = [], []
+    for t in eval_times:
+        if align == 'right':
+            inside = (series.index > t - window) & (series.index <= t)
+        else:
+            inside = (series.index >= t) & (series.index < t + window)
+        x, w = series[inside], weights[inside]
+        keep = x.notna()
+        x, w = x[keep].to_numpy(), w[keep].to_numpy()
+        mean.append(np.average(x, weights=w) if len(x) else np.nan)
+        if len(x) > 1:
+            m = np.average(x, weights=w)
+            dof = w.sum() - (w ** 2).sum() / w.sum()
+            std.append(np.sqrt((w * (x - m) ** 2).sum() / dof))
+        else:
+            std.append(np.nan)
+    return np.array(mean), np.array(std)
+
+
+def test_matches_pandas_rolling(irregular_polls):
+    grid = pd.date_range(irregular_polls.index.min(),
+                         irregular_polls.index.max() + pd.Timedelta('7D'))
+    mean, std, count = rolling_weighted_stats(
+        irregular_polls.index, irregular_polls.to_numpy(), '7D',
+        eval_times=grid
+    )
+    dense = irregular_polls.reindex(grid).rolling('7D')
+    np.testing.assert_allclose(mean, dense.mean(), rtol=1e-12)
+    np.testing.assert_allclose(std, dense.std(), rtol=1e-9)
+    np.testing.assert_array_equal(count, dense.count().fillna(0))
+
+
+@pytest.mark.parametrize('align', ['left', 'right'])
+def test_weighted_windows(irregular_polls, align):
+    weights = pd.Series(np.linspace(.5, 2, len(irregular_polls)),
+                        index=irregular_polls.index)
+    grid = pd.date_range('2023-10-01', '2024-02-20', freq='3D')
+    mean, std, _ = rolling_weighted_stats(
+        irregular_polls.index, irregular_polls, '10D', eval_times=grid,
+        weights=weights, align=align
+    )
+    expected_mean, expected_std = brute_force(irregular_polls, weights,
+                                              grid, '10D', align)
+    np.testing.assert_allclose(mean, expected_mean, rtol=1e-12)
+    np.testing.assert_allclose(std, expected_std, rtol=1e-9)
+
+
+def test_numerically_stable(irregular_polls):
+    _, std, _ = rolling_weighted_stats(irregular_polls.index,
+                                       irregular_polls, '14D')
+    _, shifted_std, _ = rolling_weighted_stats(irregular_polls.index,
+                                               irregular_polls + 1e6, '14D')
+    np.testing.assert_allclose(shifted_std, std, rtol=1e-6)
+
+
+def test_invalid_alignment(irregular_polls):
+    with pytest.raises(ValueError):
+        rolling_weighted_stats(irregular_polls.index, irregular_polls, '7D',
+                               align='centre')
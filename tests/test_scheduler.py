@@ -0,0 +1,268 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+import requests
+
+from pollscraper.scheduler import (Scheduler, SourceState, build_pipeline,
+                                   process_source, source_dir)
+from pollscraper.scraper import DataPipeline
+
+
+class FakeClock:
+
+    def __init__(self, now=1_700_000_000.) -> None:
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakePipeline:
+    """Serve pages whose content changes every `periods[url]` seconds."""
+
+    def __init__(self, clock, periods, failures=None) -> None:
+        self.clock = clock
+        self.periods = periods
+        self.failures = failures or {}
+        self.requests = []
+
+    def fetch_html_content(self, url):
+        self.requests.append((self.clock(), url))
+        failure = self.failures.get(url)
+        if failure is not None:
+            raise failure
+        response = requests.Response()
+        response.status_code = 200
+        version = int(self.clock() // self.periods[url])
+        response._content = f'{url} version {version}'.encode()
+        return response
+
+
+def make_scheduler(clock, pipeline, **kwargs):
+    kwargs.setdefault('jitter', 0.)
+    return Scheduler(pipeline, clock=clock, sleep=clock.sleep, seed=0,
+                     **kwargs)
+
+
+def test_intervals_follow_change_rate():
+    clock = FakeClock()
+    hourly, weekly = 'https://a.example/hourly', 'https://b.example/weekly'
+    pipeline = FakePipeline(clock, {hourly: 3600., weekly: 7 * 86400.})
+    changed = []
+    scheduler = make_scheduler(clock, pipeline,
+                               handler=lambda url, _: changed.append(url))
+    scheduler.add(hourly)
+    scheduler.add(weekly)
+    scheduler.run(until=clock() + 14 * 86400)
+
+    fast, slow = scheduler.sources[hourly], scheduler.sources[weekly]
+    # Half of the fetches should find a change, at an interval of
+    # ln(2) hours for the hourly page
+    assert 1200 < fast.interval < 4800
+    assert slow.interval > 2 * 86400
+    assert fast.fetches > 10 * slow.fetches
+    assert changed.count(weekly) == slow.changes >= 2
+    assert changed.count(hourly) == fast.changes
+    assert 0.3 < fast.changes / fast.fetches < 0.8
+
+
+def test_interval_bounds():
+    clock = FakeClock()
+    url = 'https://a.example/polls.html'
+    pipeline = FakePipeline(clock, {url: 1.})
+    scheduler = make_scheduler(clock, pipeline, min_interval=600.,
+                               max_interval=3600.)
+    scheduler.add(url)
+    scheduler.run(max_fetches=10)
+    assert scheduler.sources[url].interval == 600.
+    pipeline.periods[url] = 10**12
+    scheduler.run(max_fetches=30)
+    assert scheduler.sources[url].interval == 3600.
+
+
+def test_host_rate_limit():
+    clock = FakeClock()
+    urls = [f'https://polls.example/page-{i}.html' for i in range(3)]
+    pipeline = FakePipeline(clock, dict.fromkeys(urls, 3600.))
+    scheduler = make_scheduler(clock, pipeline, host_interval=10.)
+    for url in urls:
+        scheduler.add(url)
+    scheduler.add('https://other.example/polls.html')
+    pipeline.periods['https://other.example/polls.html'] = 3600.
+
+    start = clock()
+    assert len(scheduler.run_pending()) == 2
+    metrics = scheduler.metrics()
+    assert metrics['queue_depth'] == 2
+    assert metrics['max_lag'] == 0.
+    assert scheduler.wake_time() == start + 10.
+    scheduler.run(max_fetches=2)
+    times = [t for t, url in pipeline.requests if url in urls]
+    assert times == [start, start + 10., start + 20.]
+    assert scheduler.metrics()['queue_depth'] == 0
+
+
+def test_backoff_on_errors():
+    clock = FakeClock()
+    url = 'https://a.example/polls.html'
+    pipeline = FakePipeline(clock, {url: 3600.}, failures={
+        url: requests.exceptions.ConnectionError('refused')
+    })
+    scheduler = make_scheduler(clock, pipeline, backoff=60.,
+                               max_backoff=300.)
+    source = scheduler.add(url)
+    delays = []
+    for _ in range(5):
+        now = clock()
+        scheduler.fetch(source)
+        delays.append(source.next_fetch - now)
+        clock.now = source.next_fetch
+    assert delays == [60., 120., 240., 300., 300.]
+    assert source.errors == 5
+    assert scheduler.metrics()['backing_off'] == 1
+
+    # The server's Retry-After is honoured when longer than the backoff
+    response = requests.Response()
+    response.status_code = 503
+    response.headers['Retry-After'] = '900'
+    pipeline.failures[url] = requests.exceptions.HTTPError(response=response)
+    scheduler.fetch(source)
+    assert source.next_fetch - clock() == 900.
+
+    del pipeline.failures[url]
+    assert scheduler.fetch(source) is True
+    assert source.errors == 0 and source.last_error is None
+    assert scheduler.failures == 6
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(429)
+        self.send_header('Retry-After', '2')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def rate_limited_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RateLimitedHandler)
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_rate_limited_by_server(rate_limited_server):
+    clock = FakeClock()
+    url = f'http://127.0.0.1:{rate_limited_server.server_address[1]}/'
+    scheduler = make_scheduler(clock, build_pipeline(), backoff=1.)
+    source = scheduler.add(url)
+    start = time.monotonic()
+    assert scheduler.fetch(source) is None
+    # The session does not wait out the Retry-After itself, and the
+    # scheduler honours it rather than its shorter backoff
+    assert time.monotonic() - start < 1.
+    assert rate_limited_server.requests == 1
+    assert source.next_fetch - clock() == 2.
+    assert '429' in source.last_error
+
+
+def test_handler_failure_retried():
+    clock = FakeClock()
+    url = 'https://a.example/polls.html'
+    pipeline = FakePipeline(clock, {url: 10**12})
+    processed = []
+
+    def handler(url, response):
+        if not processed:
+            processed.append(None)
+            raise OSError('disk full')
+        processed.append(response.content)
+
+    scheduler = make_scheduler(clock, pipeline, handler=handler,
+                               backoff=60.)
+    source = scheduler.add(url)
+    # The content is only recorded once the handler has processed it
+    assert scheduler.fetch(source) is None
+    assert source.content_hash is None
+    assert source.errors == 1 and source.last_error == 'disk full'
+    assert source.next_fetch - clock() == 60.
+    clock.now = source.next_fetch
+    assert scheduler.fetch(source) is True
+    assert processed[1:] == [f'{url} version 0'.encode()]
+    assert source.errors == 0 and source.fetches == 1
+    clock.now = source.next_fetch
+    assert scheduler.fetch(source) is False
+
+
+def test_max_fetches():
+    clock = FakeClock()
+    urls = [f'https://polls-{i}.example/polls.html' for i in range(3)]
+    pipeline = FakePipeline(clock, dict.fromkeys(urls, 3600.))
+    scheduler = make_scheduler(clock, pipeline)
+    for url in urls:
+        scheduler.add(url)
+    # All three are due at once, but only two may be fetched
+    assert scheduler.run(max_fetches=2) == 2
+    assert len(pipeline.requests) == 2
+    assert scheduler.metrics()['queue_depth'] == 1
+
+
+def test_state_persists(tmp_path):
+    clock = FakeClock()
+    url = 'https://a.example/polls.html'
+    pipeline = FakePipeline(clock, {url: 3600.})
+    path = tmp_path / 'schedule.json'
+    scheduler = make_scheduler(clock, pipeline, state_path=path)
+    scheduler.add(url)
+    scheduler.run(max_fetches=6)
+    saved = scheduler.sources[url].to_dict()
+
+    restarted = make_scheduler(clock, pipeline, state_path=path)
+    assert restarted.sources[url].to_dict() == saved
+    assert restarted.wake_time() == saved['next_fetch']
+    # Adding a known source keeps what was learned about it
+    assert restarted.add(url).fetches == 6
+
+    path.write_text(json.dumps({'version': 0, 'sources': [saved]}))
+    assert len(make_scheduler(clock, pipeline, state_path=path)) == 0
+
+
+def test_change_rate_estimate():
+    source = SourceState('https://a.example/', 3600.)
+    assert source.change_rate is None
+    now = 0.
+    source.observe(True, now, decay=1.)
+    for changed in [True, False] * 50:
+        now += 100.
+        source.observe(changed, now, decay=1.)
+    # Half the fetches 100s apart changed: ln(2) / 100 per second
+    assert source.change_rate == pytest.approx(0.00693, rel=0.02)
+
+
+def test_process_source(local_source, tmp_path):
+    url = local_source + 'page-1.html'
+    dp = DataPipeline()
+    response = dp.fetch_html_content(url)
+    written = process_source(dp, url, response, tmp_path, n_sigma=2)
+    directory = source_dir(tmp_path, url)
+    assert directory == tmp_path / 'polls.example.com_page-1.html'
+    assert written['polls'] == [directory / 'polls.csv']
+    polls = pd.read_csv(directory / 'polls.csv', index_col=0)
+    expected = dp.clean_data(dp.extract_table_data(url))
+    assert len(polls) == len(expected)
+    assert (directory / 'trends.csv').is_file()
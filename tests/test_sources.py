@@ -0,0 +1,91 @@
+import io
+import pytest
+import pandas as pd
+import requests
+
+from pollscraper.scraper import DataPipeline
+from pollscraper.sources import (CSVSource, HTMLSource, JSONSource,
+                                 get_source_adapter)
+
+
+@pytest.fixture
+def expected_polls(local_source):
+    dp = DataPipeline()
+    return dp.clean_data(dp.extract_table_data(f'{local_source}polls.csv'))
+
+
+def test_get_source_adapter():
+    assert isinstance(get_source_adapter('.html'), HTMLSource)
+    assert isinstance(get_source_adapter('.CSV'), CSVSource)
+    assert isinstance(
+        get_source_adapter('', 'application/json; charset=utf-8'),
+        JSONSource
+    )
+    assert get_source_adapter('.xlsx', 'application/octet-stream') is None
+
+
+def test_csv_source(expected_polls):
+    assert expected_polls.shape == (4, 9)
+    assert expected_polls['n'].iloc[:3].tolist() == [1507, 1004, 708]
+    assert expected_polls['Bulstrode'].iloc[0] == pytest.approx(.376)
+    assert expected_polls['Chettam'].isnull().all()
+
+
+@pytest.mark.parametrize('name', ['polls.json', 'polls.jsonl', 'page-1.html'])
+def test_sources_match_csv(local_source, expected_polls, name):
+    dp = DataPipeline()
+    table_df = dp.extract_table_data(f'{local_source}{name}')
+    assert table_df.shape[0] == 4
+    pd.testing.assert_frame_equal(dp.clean_data(table_df), expected_polls,
+                                  check_dtype=False)
+
+
+def test_source_from_content_type(local_source, expected_polls):
+    dp = DataPipeline()
+    table_df = dp.extract_table_data(f'{local_source}api/polls')
+    pd.testing.assert_frame_equal(dp.clean_data(table_df), expected_polls,
+                                  check_dtype=False)
+
+
+def test_undefined_source(local_source):
+    dp = DataPipeline()
+    with pytest.raises(ValueError, match='Undefined URL format.'):
+        dp.extract_table_data(f'{local_source}polls.xlsx')
+
+
+def test_jsonl_source_streams(monkeypatch, expected_polls):
+    with open('tests/test_sources/polls.jsonl', 'rb') as f:
+        content = f.read()
+    streams = []
+
+    def fetch(self, url, stream=None):
+        streams.append(stream)
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(content)
+        return response
+
+    monkeypatch.setattr(DataPipeline, 'fetch_html_content', fetch)
+    dp = DataPipeline()
+    table_df = dp.extract_table_data('https://polls.example.com/polls.jsonl')
+    assert streams == [True]
+    pd.testing.assert_frame_equal(dp.clean_data(table_df), expected_polls,
+                                  check_dtype=False)
+
+
+def test_next_page(monkeypatch):
+    response = requests.Response()
+    response._content = b'<nav><a href="?page=1">1</a>' \
+        b"<a class=page rel=next href=\"?page=3\">3</a></nav>"
+    assert HTMLSource.next_page(response) == '?page=3'
+    response.headers['Link'] = '<?page=4>; rel="next"'
+    assert HTMLSource.next_page(response) == '?page=4'
+
+    # Pages without a rel="next" attribute are not parsed for one
+    def parse(*args, **kwargs):
+        raise AssertionError('page parsed')
+
+    monkeypatch.setattr('pollscraper.sources.BeautifulSoup', parse)
+    response = requests.Response()
+    response._content = b'<table><tr><td>next</td></tr></table>'
+    assert HTMLSource.next_page(response) is None
@@ -0,0 +1,158 @@
+import threading
+import pandas as pd
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pollscraper.scraper import DataPipeline
+from pollscraper.sources import as_string_table
+from pollscraper.streaming import (TableRowParser, iter_table_rows,
+                                   rows_to_frame)
+
+
+def parse_chunks(chunks):
+    parser = TableRowParser()
+    rows = list(iter_table_rows(chunks, parser=parser))
+    return parser, rows_to_frame(parser.header, rows)
+
+
+def split(content, size):
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+@pytest.mark.parametrize('size', [1, 13, 4096, 10**7])
+@pytest.mark.parametrize('fixture', ['expected_source_fixture.html',
+                                     'spanned_source_fixture.html'])
+def test_matches_read_html(http_instance, fixture, size):
+    with open(f'tests/test_scraper/{fixture}', 'rb') as f:
+        content = f.read()
+    expected = http_instance.parse_html_table(content)
+    parser, frame = parse_chunks(split(content, size))
+    pd.testing.assert_frame_equal(frame, expected)
+    pd.testing.assert_frame_equal(as_string_table(frame),
+                                  as_string_table(expected))
+    assert parser.n_tables == 1
+    assert parser.table_closed
+
+
+@pytest.mark.parametrize('declaration', [
+    b'<meta charset="windows-1252">',
+    b'<meta http-equiv="Content-Type" content="text/html; charset=latin-1">',
+])
+def test_meta_charset(http_instance, declaration):
+    content = b'<html><head>' + declaration + b'</head><body><table>' \
+        b'<tr><th>Pollster</th><th>Sample</th></tr>' \
+        b'<tr><td>Caf\xe9 Polling</td><td>1,000</td></tr>' \
+        b'</table></body></html>'
+    expected = http_instance.parse_html_table(content)
+    assert expected['Pollster'][0] == 'Caf\xe9 Polling'
+    for size in (3, 4096):
+        _, frame = parse_chunks(split(content, size))
+        pd.testing.assert_frame_equal(frame, expected)
+
+
+def test_spanned_cells():
+    content = '''
+        <table>
+          <tr><th>Date</th><th>Pollster</th><th>A</th><th>B</th></tr>
+          <tr><td rowspan="2">X</td><td>P</td><td>40</td><td>30</td></tr>
+          <tr><td>Y</td><td>41</td><td>29</td></tr>
+        </table>
+    '''
+    _, frame = parse_chunks(split(content, 5))
+    assert frame.to_dict('list') == {'Date': ['X', 'X'],
+                                     'Pollster': ['P', 'Y'],
+                                     'A': [40, 41], 'B': [30, 29]}
+
+
+def test_table_layouts():
+    content = '''
+        <a rel="nofollow" href="about.html">About</a>
+        <table>
+          <tfoot><tr><td>Total</td><td>2,000</td></tr></tfoot>
+          <tr><th>Pollster</th><th>Sample</th></tr>
+          <tr><td>  Caf&eacute;
+                Polling </td><td>1,000</td></tr>
+          <tr></tr>
+          <tr><td>Ragged</td></tr>
+          <tr><td>Nested <table><tr><td>x</td></tr></table></td>
+              <td>500</td></tr>
+        </table>
+        <table><tr><td>ignored</td></tr></table>
+        <link rel="Next" href="?page=2">
+    '''
+    parser, frame = parse_chunks(split(content, 7))
+    assert list(frame.columns) == ['Pollster', 'Sample']
+    # Whitespace is collapsed exactly as read_html does
+    assert frame['Pollster'].tolist() == ['Café  Polling', 'Ragged',
+                                          'Nested', 'Total']
+    assert frame['Sample'].tolist()[::3] == [1000, 2000]
+    assert parser.n_tables == 2
+    assert parser.next_url == '?page=2'
+
+
+def test_multibyte_characters_split_across_chunks():
+    content = '<table><tr><th>Pollster</th></tr>' \
+              '<tr><td>Ünïcødé Polls</td></tr></table>'.encode('utf-8')
+    _, frame = parse_chunks(split(content, 1))
+    assert frame['Pollster'].tolist() == ['Ünïcødé Polls']
+
+
+def test_streamed_sources(local_source):
+    expected = DataPipeline().extract_table_data(local_source + 'page-1.html')
+    streamed = DataPipeline(stream=True)\
+        .extract_table_data(local_source + 'page-1.html')
+    pd.testing.assert_frame_equal(streamed, expected)
+    with pytest.raises(ValueError, match='No tables found'):
+        DataPipeline(stream=True).extract_table_data(
+            local_source + 'missing.html'
+        )
+
+
+class SlowPageHandler(BaseHTTPRequestHandler):
+    """Send a table's first rows, then wait before sending the rest."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        head = b'<table><tr><th>Pollster</th><th>Sample</th></tr>' \
+               b'<tr><td>First</td><td>1,000</td></tr>'
+        tail = b'<tr><td>Second</td><td>2,000</td></tr></table>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(head) + len(tail)))
+        self.end_headers()
+        self.wfile.write(head)
+        self.wfile.flush()
+        self.server.first_row_read.wait(5)
+        self.server.tail_sent = True
+        self.wfile.write(tail)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slow_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowPageHandler)
+    server.first_row_read = threading.Event()
+    server.tail_sent = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/index.html', server
+    server.first_row_read.set()
+    server.shutdown()
+    server.server_close()
+
+
+def test_rows_before_download_completes(slow_server):
+    url, server = slow_server
+    rows = DataPipeline().stream_table_rows(url, chunk_size=1)
+    # The server holds back the rest of the page until the first row
+    # has been read
+    assert next(rows) == {'Pollster': 'First', 'Sample': '1,000'}
+    assert not server.tail_sent
+    server.first_row_read.set()
+    assert list(rows) == [{'Pollster': 'Second', 'Sample': '2,000'}]
+
+    frame = DataPipeline(stream=True).extract_table_data(url)
+    assert frame.to_dict('list') == {'Pollster': ['First', 'Second'],
+                                     'Sample': ['1000', '2000']}
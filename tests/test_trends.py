@@ -1,6 +1,7 @@
 from pollscraper.trends import PollTrend
+import pandas as pd
 from pandas.api.types import is_numeric_dtype as is_numeric
-# import pytest
+import pytest
 
 
 def test_calculate_trends(sample_poll_data):
@@ -41,3 +42,55 @@ def test_opinion_shift_trends(opinion_shift_data):
 
     assert trends.shape[0]*.05 > outliers_avg.shape[0]
     assert trends.shape[0]*.1 > outliers_poll.shape[0]
+
+
+def test_sparse_trends(candidate_dropout_data, candidate_late_join_data):
+    for poll_data in (candidate_dropout_data, candidate_late_join_data):
+        dense, _, _ = PollTrend.calculate_trends(poll_data.copy(), n_sigma=2)
+        sparse, _, _ = PollTrend.calculate_trends(poll_data.copy(),
+                                                  n_sigma=2, sparse=True)
+        pd.testing.assert_frame_equal(sparse.to_dense(), dense)
+        # Short-lived candidates are only stored over their active span
+        spans = {c: len(sparse[c]) for c in sparse.candidates}
+        assert min(spans.values()) < len(sparse.index)
+        assert sparse.nbytes < dense.shape[0] * (dense.shape[1] - 1) * 8
+        for c in sparse.candidates:
+            active = dense.set_index('date')[c].dropna()
+            assert set(active.index).issubset(sparse[c].index)
+
+
+def test_multi_resolution_trends(sample_poll_data, opinion_shift_data):
+    for poll_data in (sample_poll_data, opinion_shift_data):
+        results = PollTrend.calculate_multi_resolution_trends(
+            poll_data.copy(), ('1D', '3D', 'W', 'MS'), n_sigma=2,
+            rolling_average_window={'MS': '62D'}
+        )
+        for resolution, window in (('1D', '7D'), ('3D', '7D'),
+                                   ('W', '7D'), ('MS', '62D')):
+            expected = PollTrend.calculate_trends(
+                poll_data.copy(), n_sigma=2, sample_periodicity=resolution,
+                rolling_average_window=window
+            )
+            for result, expected_result in zip(results[resolution],
+                                               expected):
+                pd.testing.assert_frame_equal(result, expected_result)
+
+
+def test_kalman_trends(sample_poll_data, candidate_late_join_data):
+    for poll_data in (sample_poll_data, candidate_late_join_data):
+        rolling, _, _ = PollTrend.calculate_trends(poll_data.copy(),
+                                                   n_sigma=2)
+        trends, outliers_avg, outliers_poll = PollTrend.calculate_trends(
+            poll_data.copy(), n_sigma=2, estimator='kalman'
+        )
+        assert trends.shape == rolling.shape
+        assert set(trends.columns) == set(rolling.columns)
+        assert trends['date'].equals(rolling['date'])
+        assert all(is_numeric(trends[col]) for col in trends.columns[1:])
+        # The smoothed trend has no gaps within a candidate's span
+        active = rolling.notna()
+        assert trends[active.columns][active].notna().sum().equals(
+            active.sum())
+        assert trends.shape[0]*.1 > outliers_avg.shape[0]
+    with pytest.raises(ValueError):
+        PollTrend.calculate_trends(sample_poll_data, estimator='loess')
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pollscraper.validation import (DuplicateRule, FrequencyRule, RangeRule,
+                                    SampleBoundsRule, SumToOneRule,
+                                    ValidationError, Validator)
+
+
+@pytest.fixture
+def poll_table():
+    dates = pd.to_datetime(['2023-10-20', '2023-10-20', '2023-10-19',
+                            '2023-10-18', None, '2023-10-17'])
+    return pd.DataFrame({
+        'Date': dates,
+        'Pollster': ['A', 'A', 'B', 'C', 'C', 'D'],
+        'Sample': [500, 500, 5, 800, 900, 700],
+        'Bulstrode': [0.5, 0.5, 0.4, 1.2, 0.5, 0.3],
+        'Lydgate': [0.5, 0.5, 0.6, -0.2, 0.5, 0.3],
+    }, index=[10, 11, 12, 13, 14, 15])
+
+
+def violated(violations, rule):
+    return sorted(violations.loc[violations['rule'] == rule, 'row'])
+
+
+def test_default_rules_warn(poll_table, caplog):
+    validator = Validator()
+    frame, violations = validator.validate(poll_table,
+                                           ['Bulstrode', 'Lydgate'])
+    pd.testing.assert_frame_equal(frame, poll_table)
+    assert violated(violations, 'invalid_date') == [14]
+    assert violated(violations, 'sample_bounds') == [12]
+    assert violated(violations, 'share_range') == [13]
+    assert violated(violations, 'sum_to_one') == [15]
+    assert violated(violations, 'duplicate') == [11]
+    assert (violations['action'] == 'warn').all()
+    assert '1 small sample size(s) detected' in caplog.text
+    assert '1 Row(s) with unbalanced vote-share' in caplog.text
+
+
+def test_actions(poll_table, caplog):
+    validator = Validator(actions={'duplicate': 'drop',
+                                   'sample_bounds': 'drop',
+                                   'sum_to_one': 'flag',
+                                   'invalid_date': 'ignore'})
+    frame, violations = validator.validate(poll_table,
+                                           ['Bulstrode', 'Lydgate'])
+    assert list(frame.index) == [10, 13, 14, 15]
+    assert 'invalid_date' not in set(violations['rule'])
+    assert violated(violations, 'sum_to_one') == [15]
+    assert 'unbalanced vote-share' not in caplog.text
+
+    with pytest.raises(ValidationError) as error:
+        Validator(actions={'share_range': 'raise'})\
+            .validate(poll_table, ['Bulstrode', 'Lydgate'])
+    assert violated(error.value.violations, 'share_range') == [13]
+
+    with pytest.raises(ValueError):
+        Validator(actions={'duplicate': 'explode'})
+
+
+def test_rules():
+    shares = np.array([[0.5, np.nan], [0.45, 0.5], [0.6, 0.6]])
+    frame = pd.DataFrame({'Sample': [np.nan, 20, 50000]})
+    assert list(SumToOneRule(atol=0.02).evaluate(frame, shares)) == \
+        [True, True, True]
+    assert list(SumToOneRule(atol=0.1).evaluate(frame, shares)) == \
+        [True, False, True]
+    assert list(RangeRule(high=0.55).evaluate(frame, shares)) == \
+        [False, False, True]
+    assert list(SampleBoundsRule(low=10, high=10000)
+                .evaluate(frame, shares)) == [False, False, True]
+    assert not DuplicateRule(columns=['Sample'])\
+        .evaluate(frame, shares).any()
+
+
+def test_frequency_rule():
+    weeks = pd.date_range('2023-10-02', periods=8, freq='W-MON')
+    burst = pd.date_range('2023-12-04', periods=5, freq='D')
+    frame = pd.DataFrame({
+        'Date': weeks.append(burst),
+        'Pollster': 'A',
+    })
+    flagged = FrequencyRule().evaluate(frame, np.empty((len(frame), 0)))
+    assert list(frame['Date'][flagged]) == list(burst)